@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+ConvNeXt CPU 推理后端基准测试 (ConvNeXt CPU backend benchmark)
+
+在同一组本地图像上比较各推理后端 (eager PyTorch、ONNX fp32、ONNX int8)：
+1. 预处理吞吐量 (解码 + 裁剪 + 归一化，与推理分开计时)
+2. 每个后端的推理吞吐量 (图像/秒) 与相对第一个后端的加速比
+3. 与第一个后端 (默认 eager 模型) 的 top-1 一致率，以及其 top-1 落在本后端 top-5 中的比例
+
+结果以 JSON 输出，便于跨版本比较。int8 后端需先运行
+`python convnext_onnx.py export --quantize --calibration-dir <目录>`。
+
+用法 (Usage):
+    python benchmark_convnext.py --images samples/ --limit 256 --output convnext_bench.json
+    python benchmark_convnext.py --images samples/ --backends torch onnx-int8 --threads 8
+"""
+
+import os
+import json
+import time
+import argparse
+import platform
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from convnext_service import DEFAULT_MODEL, BACKENDS, BatchImageClassifier, ConvNextClassifier
+from image_preprocessing import iter_batches, list_images
+
+
+def load_backend(backend: str, model_name: str, threads: Optional[int] = None) -> BatchImageClassifier:
+    """按后端加载分类器并设置线程数 (Load a classifier for a backend with a thread count)"""
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return ConvNextClassifier(model_name)
+    from convnext_onnx import load_onnx_classifier
+
+    return load_onnx_classifier(model_name, quantized=backend == "onnx-int8", threads=threads)
+
+
+def preprocess(paths: List[str], config: Any, batch_size: int, workers: Optional[int]) -> Dict[str, Any]:
+    """预处理全部图像并计时 (Preprocess all images and time it)"""
+    start = time.perf_counter()
+    batches = [
+        batch.pixel_values.copy()
+        for batch in iter_batches(paths, config, batch_size=batch_size, workers=workers)
+        if batch.sources
+    ]
+    seconds = time.perf_counter() - start
+    images = sum(len(batch) for batch in batches)
+    return {
+        "batches": batches,
+        "images": images,
+        "seconds": seconds,
+        "images_per_sec": images / seconds if seconds else 0.0,
+    }
+
+
+def run_backend(classifier: BatchImageClassifier, batches: List[np.ndarray]) -> Dict[str, Any]:
+    """对预处理好的批次推理并计时 (Run and time inference over preprocessed batches)"""
+    classifier.predict_pixels(batches[0])  # 预热 (Warm-up)
+    probabilities = []
+    start = time.perf_counter()
+    for batch in batches:
+        probabilities.append(classifier.predict_pixels(batch))
+    seconds = time.perf_counter() - start
+    probabilities = np.concatenate(probabilities)
+    return {
+        "seconds": seconds,
+        "images_per_sec": len(probabilities) / seconds if seconds else 0.0,
+        "top5": np.argsort(-probabilities, axis=1)[:, :5],
+    }
+
+
+def run_benchmark(
+    image_dir: str,
+    model_name: str = DEFAULT_MODEL,
+    backends: Optional[List[str]] = None,
+    batch_size: int = 16,
+    limit: int = 256,
+    threads: Optional[int] = None,
+    workers: Optional[int] = None
+) -> Dict[str, Any]:
+    backends = backends or list(BACKENDS)
+    paths = list_images(image_dir)[:limit]
+    if not paths:
+        raise SystemExit(f"目录中没有图像: {image_dir} (No images found)")
+
+    results: Dict[str, Any] = {
+        "model": model_name,
+        "images": len(paths),
+        "batch_size": batch_size,
+        "threads": threads,
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "backends": {},
+    }
+    reference_top5 = reference_speed = None
+    batches = None
+    for backend in backends:
+        classifier = load_backend(backend, model_name, threads)
+        if batches is None:
+            prepared = preprocess(paths, classifier.preprocess_config, batch_size, workers)
+            batches = prepared.pop("batches")
+            results["preprocess"] = prepared
+        run = run_backend(classifier, batches)
+        top5 = run.pop("top5")
+        if reference_top5 is None:
+            reference_top5, reference_speed = top5, run["images_per_sec"]
+        run["speedup"] = run["images_per_sec"] / reference_speed if reference_speed else 0.0
+        run["top1_agreement"] = float(np.mean(top5[:, 0] == reference_top5[:, 0]))
+        run["reference_top1_in_top5"] = float(np.mean((top5 == reference_top5[:, :1]).any(axis=1)))
+        results["backends"][backend] = run
+    results["reference_backend"] = backends[0]
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ConvNeXt CPU backend benchmark")
+    parser.add_argument("--images", type=str, required=True, help="Folder of sample images")
+    parser.add_argument("--model", type=str, default=DEFAULT_MODEL, help="Hugging Face model name")
+    parser.add_argument("--backends", type=str, nargs="+", default=list(BACKENDS), choices=BACKENDS,
+                        help="Backends to compare; the first one is the agreement reference")
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per batch")
+    parser.add_argument("--limit", type=int, default=256, help="Max images")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads for every backend")
+    parser.add_argument("--workers", type=int, default=None, help="Decode threads for preprocessing")
+    parser.add_argument("--output", type=str, default=None, help="Write JSON results to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = run_benchmark(
+        args.images,
+        model_name=args.model,
+        backends=args.backends,
+        batch_size=args.batch_size,
+        limit=args.limit,
+        threads=args.threads,
+        workers=args.workers
+    )
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
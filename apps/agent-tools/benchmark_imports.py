@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+导入耗时基准与回归守卫 (Import-time benchmark & regression guard)
+
+在独立子进程中以 `python -X importtime` 导入各模块，解析累计耗时，
+并检查重型依赖 (torch、transformers、Chroma 等) 是否在模块加载时被提前导入。
+任何模块超出时间预算或导入了禁止的依赖时返回非零退出码，可直接用于 CI。
+
+用法 (Usage):
+    python benchmark_imports.py
+    python benchmark_imports.py --repeat 5 --output imports.json
+    python benchmark_imports.py --only rag_pipeline --budget-scale 2.0
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+from typing import Dict, Any
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(HERE))
+
+# 每个预设: 模块名、所在目录、时间预算 (毫秒)、禁止在导入时加载的顶层包
+# (Each preset: module, directory, time budget in ms, top-level packages that must not load at import)
+PRESETS: Dict[str, Dict[str, Any]] = {
+    "rag_pipeline": {
+        "module": "rag_pipeline",
+        "path": os.path.join(HERE, "rag_module"),
+        "budget_ms": 1500,
+        "forbidden": [
+            "langchain_openai", "langchain_huggingface", "langchain_chroma", "chromadb",
+            "langchain_community", "langchain_classic",
+            "openai", "numpy", "torch", "transformers", "sentence_transformers",
+        ],
+    },
+    "finetune_utils": {
+        "module": "utils",
+        "path": os.path.join(REPO_ROOT, "llm", "finetune"),
+        "budget_ms": 200,
+        "forbidden": ["torch", "transformers", "datasets", "peft", "unsloth", "pandas", "numpy", "mlx", "mlx_lm"],
+    },
+    "convnext_example": {
+        "module": "convnext_example",
+        "path": HERE,
+        "budget_ms": 200,
+        "forbidden": ["torch", "transformers", "PIL", "requests"],
+    },
+}
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_import(module: str, path: str) -> Dict[str, Any]:
+    """
+    在新解释器中导入模块并解析 -X importtime 输出
+    (Import a module in a fresh interpreter and parse the -X importtime output)
+
+    :return: {"cumulative_ms": 目标模块累计耗时, "modules": {模块名: 累计微秒}}
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [path, os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=path, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败 (Import failed):\n{proc.stderr[-2000:]}")
+
+    modules: Dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(2))
+    if module not in modules:
+        raise RuntimeError(f"未在 importtime 输出中找到 {module} (Module missing from importtime output)")
+    return {"cumulative_ms": modules[module] / 1000, "modules": modules}
+
+
+def check_preset(name: str, repeat: int = 3, budget_scale: float = 1.0) -> Dict[str, Any]:
+    """
+    测量一个预设并与预算和禁止列表比较 (Measure one preset against its budget and forbidden list)
+    """
+    preset = PRESETS[name]
+    runs = [measure_import(preset["module"], preset["path"]) for _ in range(repeat)]
+    # 取最小值以减少磁盘缓存和调度噪声 (Min over runs filters out cache and scheduling noise)
+    best = min(runs, key=lambda run: run["cumulative_ms"])
+    loaded = {m.split(".")[0] for m in best["modules"]}
+    forbidden_loaded = sorted(loaded & set(preset["forbidden"]))
+    budget_ms = preset["budget_ms"] * budget_scale
+
+    slowest = sorted(
+        ((m, us / 1000) for m, us in best["modules"].items() if "." not in m and m != preset["module"]),
+        key=lambda item: item[1], reverse=True
+    )[:10]
+    return {
+        "module": preset["module"],
+        "cumulative_ms": best["cumulative_ms"],
+        "runs_ms": [run["cumulative_ms"] for run in runs],
+        "budget_ms": budget_ms,
+        "forbidden_loaded": forbidden_loaded,
+        "slowest_top_level": dict(slowest),
+        "passed": best["cumulative_ms"] <= budget_ms and not forbidden_loaded,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import-time benchmark & regression guard")
+    parser.add_argument("--only", type=str, nargs="+", default=None, choices=sorted(PRESETS),
+                        help="Presets to check (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh-interpreter runs per module; the minimum is reported")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply all time budgets (e.g. for slow CI machines)")
+    parser.add_argument("--output", type=str, default=None, help="Write JSON results to this file")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    results = {name: check_preset(name, args.repeat, args.budget_scale) for name in (args.only or PRESETS)}
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+    failed = [name for name, result in results.items() if not result["passed"]]
+    for name in failed:
+        result = results[name]
+        print(
+            f"FAIL {name}: {result['cumulative_ms']:.1f}ms (budget {result['budget_ms']:.0f}ms), "
+            f"forbidden imports: {result['forbidden_loaded'] or 'none'}",
+            file=sys.stderr
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,56 +1,62 @@
-import torch
-from PIL import Image
-import requests
-from transformers import ConvNextFeatureExtractor, ConvNextForImageClassification
 import logging
+from typing import Any, Dict, Optional
+
+# torch / transformers / PIL 由 convnext_service 在 classify_image 中按需导入，避免导入本模块时的启动开销
+# (Heavy dependencies are imported via convnext_service inside classify_image to keep module import cheap)
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("ConvNeXtApp")
 
-def classify_image(image_source: str, is_url: bool = True):
+def classify_image(image_source: str, is_url: bool = True, top_k: int = 1, backend: str = "torch", use_cache: bool = True):
     """
     使用 ConvNeXt 模型进行图像分类的交互示例
+
+    模型通过进程内共享的分类服务只加载一次，并发调用会被合并成批。
+    (The model is loaded once by the shared classifier service; concurrent calls are batched.)
     
     :param image_source: 图像的 URL 或本地路径
     :param is_url: 是否为 URL，默认为 True
+    :param top_k: 打印的候选类别数 (Number of candidate classes to print)
+    :param backend: 推理后端 "torch"、"onnx" 或 "onnx-int8"，后两者见 convnext_onnx.py
+                    (Inference backend: "torch", "onnx" or "onnx-int8"; see convnext_onnx.py)
+    :param use_cache: 按图像内容哈希缓存结果，URL 通过 ETag/Last-Modified 重新验证 (见 image_cache.py)
+                      (Cache results by image content hash; URLs are revalidated via ETag/Last-Modified, see image_cache.py)
     """
+    from convnext_service import get_classifier_service, load_image
+    from image_cache import get_cached_classifier
+
     model_name = "facebook/convnext-base-224"
     
     try:
-        # 1. 加载图像 (Load Image)
+        # 1. 命中缓存时直接返回，不下载也不推理 (A cache hit skips both the download and inference)
         logger.info(f"正在获取图像: {image_source}")
-        if is_url:
-            image = Image.open(requests.get(image_source, stream=True).raw)
+        if use_cache:
+            # 第一次运行会自动从 Hugging Face 下载模型文件 (Approx. 350MB)
+            logger.info("正在进行图像识别...")
+            predictions = get_cached_classifier(model_name, backend=backend).classify(
+                image_source, top_k=max(top_k, 1), is_url=is_url
+            )
         else:
-            image = Image.open(image_source)
-        
-        # 2. 初始化模型和提取器 (Initialize Model and Extractor)
-        # 第一次运行会自动从 Hugging Face 下载模型文件 (Approx. 350MB)
-        logger.info("正在加载 ConvNeXt 模型和特征提取器...")
-        feature_extractor = ConvNextFeatureExtractor.from_pretrained(model_name)
-        model = ConvNextForImageClassification.from_pretrained(model_name)
-        
-        # 3. 预处理图像 (Preprocess Image)
-        # 将 PIL 图像转换为模型需要的 PyTorch 张量格式
-        inputs = feature_extractor(images=image, return_tensors="pt")
-        
-        # 4. 推理 (Inference)
-        logger.info("正在进行图像识别...")
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
+            # 2. 加载图像并获取共享的分类服务 (Load the image and get the shared classifier service)
+            image = load_image(image_source, is_url=is_url)
+            service = get_classifier_service(model_name, backend=backend)
+
+            # 3. 预处理与推理在服务的批处理线程中完成 (Preprocessing and inference run in the service's batch thread)
+            logger.info("正在进行图像识别...")
+            predictions = service.classify([image], top_k=max(top_k, 1))[0]
             
-        # 5. 解析结果 (Parse Results)
-        # 获取概率最高的类别索引
-        predicted_label_idx = logits.argmax(-1).item()
-        # 从模型配置中获取人类可读的标签
-        label_name = model.config.id2label[predicted_label_idx]
+        # 4. 解析结果 (Parse Results)
+        # 概率最高的类别及其人类可读的标签
+        best = predictions[0]
+        label_name = best.label
         
         print("-" * 30)
         print(f"识别成功！")
-        print(f"预测类别索引: {predicted_label_idx}")
+        print(f"预测类别索引: {best.index}")
         print(f"预测类别名称: {label_name}")
+        for prediction in predictions[1:]:
+            print(f"  候选: {prediction.label} ({prediction.probability:.1%})")
         print("-" * 30)
         
         return label_name
@@ -59,15 +65,57 @@ def classify_image(image_source: str, is_url: bool = True):
         logger.error(f"处理过程中出现错误: {str(e)}")
         return None
 
-# --- 提示：此脚本可作为构建 Agent 工具的参考逻辑 ---
-# 想法：你可以将此函数包装在 @tool 中，让 Agent 具备视觉分类能力。
-# 例如：
-# @tool("image_classifier")
-# def image_classifier_tool(url: str) -> str:
-#     \"\"\"识别给定 URL 图像中的物体内容\"\"\"
-#     return classify_image(url)
+# --- 提示：Agent 工具版本见 convnext_service.image_classifier_tool ---
+# (The agent tool lives in convnext_service.image_classifier_tool; it batches many images per call.)
+
+def classify_folder(
+    directory: str,
+    top_k: int = 1,
+    batch_size: int = 32,
+    workers: Optional[int] = None,
+    backend: str = "torch"
+) -> Dict[str, Any]:
+    """
+    目录模式：分类文件夹中的全部本地图像 (Directory mode: classify every local image in a folder)
+
+    :param directory: 图像目录 (Image directory)
+    :param top_k: 每张图像打印的类别数 (Classes printed per image)
+    :param batch_size: 每批图像数 (Images per batch)
+    :param workers: 解码线程数，默认 CPU 核数 (Decode threads, default CPU count)
+    :param backend: 推理后端 (Inference backend)
+    :return: 路径 -> 最可能的类别名称，解码失败时为 None (Path -> top label, None if decoding failed)
+    """
+    from convnext_service import classify_directory
+
+    results: Dict[str, Any] = {}
+    for path, predictions in classify_directory(
+        directory, top_k=max(top_k, 1), batch_size=batch_size, workers=workers, backend=backend
+    ):
+        if isinstance(predictions, str):
+            print(f"{path}: 错误 {predictions}")
+            results[path] = None
+            continue
+        print(f"{path}: " + ", ".join(f"{p.label} ({p.probability:.1%})" for p in predictions))
+        results[path] = predictions[0].label
+    return results
 
 if __name__ == "__main__":
-    # 示例图像：经典的 COCO 数据集中的猫咪图片
-    test_url = "http://images.cocodataset.org/val2017/000000039769.jpg"
-    classify_image(test_url)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ConvNeXt 图像分类示例 (ConvNeXt image classification example)")
+    parser.add_argument("source", nargs="?", help="图像 URL 或本地路径 (Image URL or local path)")
+    parser.add_argument("--dir", help="目录模式：分类文件夹中的全部图像 (Classify every image in a folder)")
+    parser.add_argument("--top-k", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None, help="解码线程数 (Decode threads)")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx", "onnx-int8"], help="推理后端 (Inference backend)")
+    parser.add_argument("--no-cache", action="store_true", help="不使用结果缓存 (Bypass the result cache)")
+    args = parser.parse_args()
+
+    if args.dir:
+        classify_folder(args.dir, top_k=args.top_k, batch_size=args.batch_size, workers=args.workers, backend=args.backend)
+    else:
+        # 示例图像：经典的 COCO 数据集中的猫咪图片
+        test_url = args.source or "http://images.cocodataset.org/val2017/000000039769.jpg"
+        classify_image(test_url, is_url=test_url.startswith(("http://", "https://")), top_k=args.top_k, backend=args.backend,
+                       use_cache=not args.no_cache)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+ConvNeXt 的 ONNX 导出、int8 静态量化与 CPU 推理 (ONNX export, int8 static quantization and CPU runtime for ConvNeXt)
+
+1. export_onnx: 把 Hugging Face 模型导出为批维度可变的 ONNX (输入 pixel_values，输出 logits 与池化特征 pooled)，
+   同时写出 <模型>.json，记录类别标签与预处理参数，推理时无需 transformers。
+2. quantize_int8: 用样例图像目录校准激活范围，生成 int8 静态量化 (QDQ) 模型。
+   只量化 Conv / MatMul / Gemm，LayerNorm 与 GELU 保持 fp32 以控制精度损失。
+3. OnnxClassifier: 基于 onnxruntime CPUExecutionProvider 的分类器，接口与 ConvNextClassifier 一致，
+   可通过 classify_image(..., backend="onnx" | "onnx-int8") 选用。
+
+用法 (Usage):
+    python convnext_onnx.py export
+    python convnext_onnx.py export --quantize --calibration-dir samples/ --calibration-images 256
+    python convnext_example.py photo.jpg --backend onnx-int8
+
+模型默认保存在 $CONVNEXT_ONNX_DIR (默认 ~/.cache/convnext-onnx) 下。
+"""
+
+import os
+import json
+import logging
+import argparse
+import tempfile
+from dataclasses import asdict
+from typing import List, Optional, Any, Dict, Iterator
+
+import numpy as np
+
+from convnext_service import DEFAULT_MODEL, BatchImageClassifier
+from image_preprocessing import PreprocessConfig, iter_batches, list_images
+
+logger = logging.getLogger("ConvNeXtApp")
+
+ONNX_DIR_ENV = "CONVNEXT_ONNX_DIR"
+DEFAULT_OPSET = 17
+CALIBRATION_METHODS = ("minmax", "entropy", "percentile")
+
+
+def onnx_model_path(model_name: str = DEFAULT_MODEL, quantized: bool = False) -> str:
+    """模型的默认保存路径 (Default location of an exported model)"""
+    root = os.environ.get(ONNX_DIR_ENV) or os.path.join(os.path.expanduser("~"), ".cache", "convnext-onnx")
+    return os.path.join(root, model_name.replace("/", "__"), "model.int8.onnx" if quantized else "model.onnx")
+
+
+def _metadata_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def _write_metadata(model_path: str, metadata: Dict[str, Any]) -> None:
+    with open(_metadata_path(model_path), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+
+def _read_metadata(model_path: str) -> Dict[str, Any]:
+    with open(_metadata_path(model_path), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _preprocess_config(metadata: Dict[str, Any]) -> PreprocessConfig:
+    preprocess = metadata["preprocess"]
+    return PreprocessConfig(**{**preprocess, "mean": tuple(preprocess["mean"]), "std": tuple(preprocess["std"])})
+
+
+def export_onnx(model_name: str = DEFAULT_MODEL, output_path: Optional[str] = None, opset: int = DEFAULT_OPSET) -> str:
+    """
+    把 Hugging Face ConvNeXt 模型导出为 ONNX (Export a Hugging Face ConvNeXt model to ONNX)
+
+    :param model_name: Hugging Face 模型名称 (Model name)
+    :param output_path: 输出路径，默认 onnx_model_path(model_name) (Output path)
+    :param opset: ONNX opset 版本 (ONNX opset version)
+    :return: 导出的模型路径 (Path of the exported model)
+    """
+    import torch
+    from convnext_service import ConvNextClassifier
+
+    output_path = output_path or onnx_model_path(model_name)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    classifier = ConvNextClassifier(model_name)
+    config = classifier.preprocess_config
+
+    class _LogitsAndFeatures(torch.nn.Module):
+        def __init__(self, model: torch.nn.Module):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values: torch.Tensor):
+            pooled = self.model.convnext(pixel_values=pixel_values).pooler_output
+            return self.model.classifier(pooled), pooled
+
+    logger.info(f"正在导出 ONNX 模型: {output_path}")
+    dummy = torch.zeros(1, 3, config.size, config.size, dtype=torch.float32)
+    with torch.inference_mode():
+        torch.onnx.export(
+            _LogitsAndFeatures(classifier.model).eval(),
+            (dummy,),
+            output_path,
+            input_names=["pixel_values"],
+            output_names=["logits", "pooled"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}, "pooled": {0: "batch"}},
+            opset_version=opset,
+            do_constant_folding=True
+        )
+    _write_metadata(output_path, {
+        "model_name": model_name,
+        "quantized": False,
+        "id2label": {str(k): v for k, v in classifier.id2label.items()},
+        "preprocess": asdict(config),
+    })
+    return output_path
+
+
+class _FolderCalibrationReader:
+    """
+    从图像目录按批提供校准输入 (Feeds calibration batches from an image folder)
+
+    实现 onnxruntime.quantization.CalibrationDataReader 的 get_next 协议。
+    """
+
+    def __init__(self, paths: List[str], config: PreprocessConfig, input_name: str, batch_size: int):
+        self._batches: Iterator[np.ndarray] = (
+            batch.pixel_values.copy() for batch in iter_batches(paths, config, batch_size=batch_size) if batch.sources
+        )
+        self.input_name = input_name
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        pixel_values = next(self._batches, None)
+        return None if pixel_values is None else {self.input_name: pixel_values}
+
+
+def quantize_int8(
+    calibration_dir: str,
+    model_name: str = DEFAULT_MODEL,
+    fp32_path: Optional[str] = None,
+    output_path: Optional[str] = None,
+    calibration_images: int = 128,
+    batch_size: int = 16,
+    method: str = "minmax",
+    per_channel: bool = True
+) -> str:
+    """
+    int8 静态量化，激活范围在样例图像上校准 (int8 static quantization calibrated on sample images)
+
+    :param calibration_dir: 校准图像目录，应与线上图像分布相近 (Calibration images, close to production data)
+    :param model_name: Hugging Face 模型名称 (Model name)
+    :param fp32_path: fp32 ONNX 模型路径，不存在时先导出 (fp32 ONNX model; exported first if missing)
+    :param output_path: 输出路径，默认 onnx_model_path(model_name, quantized=True) (Output path)
+    :param calibration_images: 最多使用的校准图像数 (Max calibration images)
+    :param batch_size: 校准批大小 (Calibration batch size)
+    :param method: 校准方法 minmax / entropy / percentile (Calibration method)
+    :param per_channel: 权重按输出通道量化 (Per-channel weight quantization)
+    :return: 量化模型路径 (Path of the quantized model)
+    """
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if method not in CALIBRATION_METHODS:
+        raise ValueError(f"不支持的校准方法: {method} (Unsupported calibration method, expected one of {CALIBRATION_METHODS})")
+    fp32_path = fp32_path or onnx_model_path(model_name)
+    if not os.path.exists(fp32_path):
+        export_onnx(model_name, fp32_path)
+    output_path = output_path or onnx_model_path(model_name, quantized=True)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    metadata = _read_metadata(fp32_path)
+    config = _preprocess_config(metadata)
+    paths = list_images(calibration_dir)[:calibration_images]
+    if not paths:
+        raise ValueError(f"校准目录中没有图像: {calibration_dir} (No calibration images found)")
+    logger.info(f"正在用 {len(paths)} 张图像校准 int8 量化 ({method})...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 量化前做形状推断与图优化 (Shape inference and graph optimization before quantization)
+        prepared_path = os.path.join(tmp, "prepared.onnx")
+        quant_pre_process(fp32_path, prepared_path)
+        quantize_static(
+            prepared_path,
+            output_path,
+            _FolderCalibrationReader(paths, config, "pixel_values", batch_size),
+            quant_format=QuantFormat.QDQ,
+            op_types_to_quantize=["Conv", "MatMul", "Gemm"],
+            per_channel=per_channel,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method={
+                "minmax": CalibrationMethod.MinMax,
+                "entropy": CalibrationMethod.Entropy,
+                "percentile": CalibrationMethod.Percentile,
+            }[method]
+        )
+    _write_metadata(output_path, {
+        **metadata,
+        "quantized": True,
+        "calibration": {"images": len(paths), "method": method, "per_channel": per_channel},
+    })
+    return output_path
+
+
+class OnnxClassifier(BatchImageClassifier):
+    """
+    onnxruntime CPU 分类器 (onnxruntime CPU classifier)
+    """
+
+    def __init__(self, model_path: str, threads: Optional[int] = None):
+        """
+        :param model_path: export_onnx / quantize_int8 生成的模型 (Model from export_onnx / quantize_int8)
+        :param threads: 算子内线程数，默认由 onnxruntime 按物理核数决定 (Intra-op threads; onnxruntime picks by default)
+        """
+        import onnxruntime as ort
+
+        metadata = _read_metadata(model_path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        logger.info(f"正在加载 ONNX 模型: {model_path}")
+        self.model_name = metadata["model_name"]
+        self.model_path = model_path
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+        self._output_names = {output.name for output in self.session.get_outputs()}
+        self.id2label = {int(k): v for k, v in metadata["id2label"].items()}
+        self._init_preprocessing(_preprocess_config(metadata))
+
+    def predict_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        logits = self.session.run(["logits"], {self._input_name: np.ascontiguousarray(pixel_values, dtype=np.float32)})[0]
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        probabilities = np.exp(logits)
+        return probabilities / probabilities.sum(axis=-1, keepdims=True)
+
+    def embed_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        if "pooled" not in self._output_names:
+            raise ValueError(f"{self.model_path} 没有 pooled 输出，请重新导出 (Model lacks the pooled output; re-export it)")
+        return self.session.run(["pooled"], {self._input_name: np.ascontiguousarray(pixel_values, dtype=np.float32)})[0]
+
+
+def load_onnx_classifier(model_name: str = DEFAULT_MODEL, quantized: bool = False, threads: Optional[int] = None) -> OnnxClassifier:
+    """
+    加载默认路径下的 ONNX 模型；fp32 模型不存在时自动导出
+    (Load the ONNX model from its default path; the fp32 model is exported on first use)
+    """
+    path = onnx_model_path(model_name, quantized)
+    if not os.path.exists(path):
+        if quantized:
+            raise FileNotFoundError(
+                f"未找到 int8 模型 {path}，请先运行: python convnext_onnx.py export --quantize --calibration-dir <图像目录> "
+                f"(Quantized model missing; export it with calibration images first)"
+            )
+        export_onnx(model_name, path)
+    return OnnxClassifier(path, threads)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ConvNeXt ONNX export & int8 quantization")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="Export to ONNX and optionally quantize to int8")
+    export.add_argument("--model", type=str, default=DEFAULT_MODEL, help="Hugging Face model name")
+    export.add_argument("--output-dir", type=str, default=None, help=f"Output directory (default: ${ONNX_DIR_ENV})")
+    export.add_argument("--opset", type=int, default=DEFAULT_OPSET, help="ONNX opset version")
+    export.add_argument("--quantize", action="store_true", help="Also produce an int8 static-quantized model")
+    export.add_argument("--calibration-dir", type=str, default=None, help="Sample image folder for calibration")
+    export.add_argument("--calibration-images", type=int, default=128, help="Max calibration images")
+    export.add_argument("--calibration-method", type=str, default="minmax", choices=CALIBRATION_METHODS)
+    return parser.parse_args()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    if args.output_dir:
+        os.environ[ONNX_DIR_ENV] = args.output_dir
+    if args.quantize and not args.calibration_dir:
+        raise SystemExit("--quantize 需要 --calibration-dir (--quantize requires --calibration-dir)")
+
+    fp32_path = export_onnx(args.model, opset=args.opset)
+    print(f"fp32: {fp32_path}")
+    if args.quantize:
+        int8_path = quantize_int8(
+            args.calibration_dir,
+            model_name=args.model,
+            fp32_path=fp32_path,
+            calibration_images=args.calibration_images,
+            method=args.calibration_method
+        )
+        size_mb = {path: os.path.getsize(path) / 2 ** 20 for path in (fp32_path, int8_path)}
+        print(f"int8: {int8_path} ({size_mb[int8_path]:.1f} MB, fp32 {size_mb[fp32_path]:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+常驻 ConvNeXt 分类服务 (Persistent, batched ConvNeXt classification service)
+
+模型与特征提取器在进程内只加载一次；并发的分类请求进入队列，由后台线程
+合并为动态批次：凑满 max_batch_size 张图像或首张图像等待超过 max_wait_ms 后，
+整批做一次预处理与前向计算，再把 top-k 标签与概率按请求拆分返回。
+
+用法 (Usage):
+    from convnext_service import get_classifier_service, load_image
+    service = get_classifier_service()
+    predictions = service.classify([load_image(url)], top_k=3)
+
+    # 作为 Agent 工具 (As an agent tool)
+    from convnext_service import image_classifier_tool
+
+    # 目录模式 (Directory mode)
+    for path, predictions in classify_directory("photos/", batch_size=32):
+        ...
+
+推理后端 (Backends): "torch" (eager fp32)、"onnx"、"onnx-int8" (见 convnext_onnx.py)；
+Agent 工具使用的后端由环境变量 CONVNEXT_BACKEND 指定。
+(The agent tool's backend comes from the CONVNEXT_BACKEND environment variable.)
+"""
+
+import os
+import abc
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Any, Dict, Callable, Iterator, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.tools import tool
+
+from image_preprocessing import PreprocessConfig, BatchNormalizer, open_image, prepare_image, iter_batches, list_images
+
+logger = logging.getLogger("ConvNeXtApp")
+
+DEFAULT_MODEL = "facebook/convnext-base-224"
+BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_BACKEND = os.environ.get("CONVNEXT_BACKEND", "torch")
+
+
+@dataclass
+class Prediction:
+    """单个预测类别 (A single predicted class)"""
+    index: int
+    label: str
+    probability: float
+
+
+def load_image(image_source: str, is_url: Optional[bool] = None) -> Any:
+    """
+    读取 URL 或本地路径的图像并转换为 RGB (Load an image from a URL or local path as RGB)
+
+    :param image_source: 图像的 URL 或本地路径
+    :param is_url: 是否为 URL，None 时按前缀判断 (None = infer from the scheme)
+    """
+    return open_image(image_source, is_url).convert("RGB")
+
+
+class BatchImageClassifier(abc.ABC):
+    """
+    分类器基类：子类设置 id2label、preprocess_config 并实现 predict_pixels 与 embed_pixels
+    (Classifier base: subclasses set id2label and preprocess_config and implement predict_pixels and embed_pixels)
+    """
+
+    model_name: str
+    id2label: Dict[int, str]
+    preprocess_config: PreprocessConfig
+
+    def _init_preprocessing(self, config: PreprocessConfig) -> None:
+        self.preprocess_config = config
+        self._normalizer = BatchNormalizer(config)
+        self._normalizer_lock = threading.Lock()
+
+    @abc.abstractmethod
+    def predict_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        """
+        对已归一化的 NCHW 批张量推理，返回类别概率 (Run inference on a normalized NCHW batch; returns class probabilities)
+        """
+
+    @abc.abstractmethod
+    def embed_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        """
+        返回分类头之前的池化特征，形状 (图像数, 特征维度) (Pooled features before the classifier head, shape (images, dim))
+        """
+
+    def _run_on_images(self, images: Sequence[Any], fn: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        prepared = [
+            image if isinstance(image, np.ndarray) else prepare_image(image, self.preprocess_config)
+            for image in images
+        ]
+        with self._normalizer_lock:
+            return fn(self._normalizer(prepared))
+
+    def predict_proba(self, images: Sequence[Any]) -> np.ndarray:
+        """
+        返回每张图像的类别概率，形状 (图像数, 类别数) (Class probabilities, shape (images, classes))
+
+        :param images: PIL 图像，或 prepare_image 得到的 uint8 数组 (PIL images or uint8 arrays from prepare_image)
+        """
+        return self._run_on_images(images, self.predict_pixels)
+
+    def embed_images(self, images: Sequence[Any]) -> np.ndarray:
+        """返回每张图像的池化特征 (Pooled features for each image)"""
+        return self._run_on_images(images, self.embed_pixels)
+
+
+class ConvNextClassifier(BatchImageClassifier):
+    """
+    已加载的 ConvNeXt 模型 (eager PyTorch)，对一批图像做一次前向计算
+    (A loaded eager-PyTorch ConvNeXt model that runs one forward pass per batch)
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, device: str = "cpu"):
+        import torch
+        from transformers import ConvNextFeatureExtractor, ConvNextForImageClassification
+
+        # 第一次运行会自动从 Hugging Face 下载模型文件 (Approx. 350MB)
+        logger.info(f"正在加载 ConvNeXt 模型和特征提取器: {model_name}")
+        self.model_name = model_name
+        self.device = device
+        self._torch = torch
+        self.feature_extractor = ConvNextFeatureExtractor.from_pretrained(model_name)
+        self.model = ConvNextForImageClassification.from_pretrained(model_name).to(device).eval()
+        self.id2label = self.model.config.id2label
+        self._init_preprocessing(PreprocessConfig.from_feature_extractor(self.feature_extractor))
+
+    def predict_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        with self._torch.inference_mode():
+            logits = self.model(pixel_values=self._torch.from_numpy(pixel_values).to(self.device)).logits
+            return logits.softmax(-1).float().cpu().numpy()
+
+    def embed_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        with self._torch.inference_mode():
+            outputs = self.model.convnext(pixel_values=self._torch.from_numpy(pixel_values).to(self.device))
+            return outputs.pooler_output.float().cpu().numpy()
+
+
+def load_classifier(model_name: str = DEFAULT_MODEL, backend: str = "torch") -> BatchImageClassifier:
+    """
+    按后端加载分类器 (Load a classifier for a backend)
+
+    :param model_name: Hugging Face 模型名称 (Model name)
+    :param backend: "torch"、"onnx" 或 "onnx-int8" (int8 模型需先用 convnext_onnx.py 校准导出)
+                    ("torch", "onnx" or "onnx-int8"; the int8 model must be exported with calibration first)
+    """
+    if backend == "torch":
+        return ConvNextClassifier(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        from convnext_onnx import load_onnx_classifier
+
+        return load_onnx_classifier(model_name, quantized=backend == "onnx-int8")
+    raise ValueError(f"不支持的推理后端: {backend} (Unsupported backend, expected one of {BACKENDS})")
+
+
+def top_k_predictions(probabilities: np.ndarray, id2label: Dict[int, str], top_k: int = 5) -> List[Prediction]:
+    """从一行概率中取 top-k 类别 (Top-k classes from one row of probabilities)"""
+    top_k = min(top_k, len(probabilities))
+    best = np.argpartition(-probabilities, top_k - 1)[:top_k]
+    best = best[np.argsort(-probabilities[best])]
+    return [Prediction(index=int(i), label=id2label[int(i)], probability=float(probabilities[i])) for i in best]
+
+
+class ClassifierService:
+    """
+    动态批处理的分类服务 (Dynamically batched classification service)
+
+    模型在第一次请求 (或 preload=True) 时加载，之后所有请求共享同一个模型。
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL,
+        classifier_loader: Callable[[str], BatchImageClassifier] = ConvNextClassifier,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10.0,
+        preload: bool = False
+    ):
+        """
+        :param model_name: Hugging Face 模型名称 (Model name)
+        :param classifier_loader: 加载分类器的函数 (Classifier loader)
+        :param max_batch_size: 每批最多图像数 (Max images per batch)
+        :param max_wait_ms: 首张图像的最长等待时间 (Max wait for the first image in a batch)
+        :param preload: 创建时立即加载模型 (Load the model immediately)
+        """
+        self.model_name = model_name
+        self.classifier_loader = classifier_loader
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._classifier: Optional[BatchImageClassifier] = None
+        self._load_lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[Any, int, Future]]" = queue.Queue()
+        self.batches = 0
+        self.images = 0
+        self._thread = threading.Thread(target=self._run, name="convnext-batcher", daemon=True)
+        self._thread.start()
+        if preload:
+            self.classifier
+
+    @property
+    def classifier(self) -> BatchImageClassifier:
+        with self._load_lock:
+            if self._classifier is None:
+                self._classifier = self.classifier_loader(self.model_name)
+            return self._classifier
+
+    @property
+    def preprocess_config(self) -> PreprocessConfig:
+        return self.classifier.preprocess_config
+
+    def submit(self, image: Any, top_k: int = 5) -> Future:
+        """
+        提交一张图像，返回结果为 List[Prediction] 的 Future (Submit one image; the Future yields List[Prediction])
+
+        :param image: PIL 图像，或 decode_image 得到的 uint8 数组；后者在调用方线程完成了解码与裁剪
+                      (PIL image, or a uint8 array from decode_image whose decoding already ran in the caller's thread)
+        """
+        if top_k < 1:
+            raise ValueError(f"top_k 必须是正整数: {top_k} (top_k must be a positive integer)")
+        future: Future = Future()
+        self._queue.put((image, top_k, future))
+        return future
+
+    def classify(self, images: Sequence[Any], top_k: int = 5, timeout: Optional[float] = None) -> List[List[Prediction]]:
+        """
+        分类多张图像；与其他线程的请求合并成批 (Classify images, batched together with other threads' requests)
+        """
+        futures = [self.submit(image, top_k) for image in images]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            try:
+                deadline = time.monotonic() + self.max_wait_ms / 1000
+                while len(batch) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                self._execute(batch)
+            except Exception as e:
+                # 后台线程不能退出，否则之后的请求永远得不到结果 (The batcher must survive, or later requests never resolve)
+                logger.exception(f"分类批次处理失败: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _execute(self, batch: List[Tuple[Any, int, Future]]) -> None:
+        try:
+            classifier = self.classifier
+            probabilities = classifier.predict_proba([image for image, _, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.images += len(batch)
+        for row, (_, top_k, future) in enumerate(batch):
+            try:
+                future.set_result(top_k_predictions(probabilities[row], classifier.id2label, top_k))
+            except Exception as e:
+                future.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "loaded": self._classifier is not None,
+            "batches": self.batches,
+            "images": self.images,
+            "mean_batch_size": self.images / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+
+_services: Dict[Tuple[str, str], ClassifierService] = {}
+_services_lock = threading.Lock()
+
+
+def get_classifier_service(model_name: str = DEFAULT_MODEL, backend: Optional[str] = None, **kwargs: Any) -> ClassifierService:
+    """
+    获取进程内共享的分类服务，每个 (模型, 后端) 一个 (Get the process-wide service for a (model, backend))
+
+    :param backend: 推理后端，默认 DEFAULT_BACKEND (Inference backend, default DEFAULT_BACKEND)
+    :param kwargs: 首次创建时传给 ClassifierService 的参数 (Arguments for ClassifierService on first creation)
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"不支持的推理后端: {backend} (Unsupported backend, expected one of {BACKENDS})")
+    with _services_lock:
+        service = _services.get((model_name, backend))
+        if service is None:
+            kwargs.setdefault("classifier_loader", lambda name: load_classifier(name, backend))
+            service = _services[(model_name, backend)] = ClassifierService(model_name, **kwargs)
+        return service
+
+
+def classify_directory(
+    directory: str,
+    model_name: str = DEFAULT_MODEL,
+    top_k: int = 5,
+    batch_size: int = 32,
+    workers: Optional[int] = None,
+    recursive: bool = True,
+    backend: Optional[str] = None
+) -> Iterator[Tuple[str, Union[List[Prediction], str]]]:
+    """
+    分类目录中的全部本地图像，按路径顺序产出结果 (Classify all local images in a directory, in path order)
+
+    解码与预处理在线程池中进行，批次凑满即送入共享的模型，二者流水线重叠。
+    (Decoding runs in a thread pool and full batches go to the shared model, so the two overlap.)
+
+    :param directory: 图像目录 (Image directory)
+    :param model_name: Hugging Face 模型名称 (Model name)
+    :param top_k: 每张图像返回的类别数 (Classes per image)
+    :param batch_size: 每批图像数 (Images per batch)
+    :param workers: 解码线程数 (Decode threads)
+    :param recursive: 是否包含子目录 (Include subdirectories)
+    :param backend: 推理后端 (Inference backend)
+    :return: (路径, 预测列表) 或解码失败时 (路径, 错误信息) ((path, predictions) or (path, error) for decode failures)
+    """
+    classifier = get_classifier_service(model_name, backend).classifier
+    paths = list_images(directory, recursive)
+    logger.info(f"目录模式: {directory} 中共 {len(paths)} 张图像")
+    start, done = time.perf_counter(), 0
+    for batch in iter_batches(paths, classifier.preprocess_config, batch_size=batch_size, workers=workers):
+        for path, error in batch.failures:
+            yield path, error
+        if not batch.sources:
+            continue
+        probabilities = classifier.predict_pixels(batch.pixel_values)
+        for path, row in zip(batch.sources, probabilities):
+            yield path, top_k_predictions(row, classifier.id2label, top_k)
+        done += len(batch.sources)
+    elapsed = time.perf_counter() - start
+    logger.info(f"目录模式完成: {done} 张图像, {done / elapsed if elapsed else 0.0:.1f} 张/秒")
+
+
+@tool("image_classifier")
+def image_classifier_tool(image_sources: List[str], top_k: int = 3) -> str:
+    """
+    识别图像中的物体内容，支持多个 URL 或本地路径，返回每张图像的 top-k 类别与概率
+    (Classify the objects in one or more images given as URLs or local paths; returns top-k labels with probabilities)
+    """
+    from image_cache import get_cached_classifier
+
+    classifier = get_cached_classifier()
+    lines: Dict[str, str] = {}
+    # 并行下载与解码 (命中缓存时跳过)，推理请求在批处理线程中合并
+    # (Download and decode in parallel, skipped on cache hits; inference requests are merged by the batcher)
+    with ThreadPoolExecutor(max_workers=min(8, len(image_sources) or 1), thread_name_prefix="image-decode") as executor:
+        futures = {source: executor.submit(classifier.classify, source, top_k) for source in image_sources}
+        for source, future in futures.items():
+            try:
+                labels = ", ".join(f"{p.label} ({p.probability:.1%})" for p in future.result())
+                lines[source] = f"{source}: {labels}"
+            except Exception as e:
+                lines[source] = f"{source}: 无法读取图像 ({e})"
+    return "\n".join(lines[source] for source in image_sources)
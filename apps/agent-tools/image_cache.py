@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+图像分类结果缓存 (Content-hash result cache for image classification)
+
+Agent 经常重复分类同一个 URL 或文件。本模块在分类服务之前加一层缓存：
+1. 结果以 (模型, 后端, 图像字节的 SHA-256) 为键保存在磁盘 SQLite 中，
+   总大小超过上限时按最近最少使用 (LRU) 淘汰。
+2. 同一键的并发请求共享一次进行中的计算 (single-flight)，同一 URL 的并发下载也只进行一次。
+3. URL 记录 ETag / Last-Modified 与内容哈希，再次请求时发送条件请求，
+   服务器返回 304 时直接使用已缓存的结果，无需重新下载。
+
+用法 (Usage):
+    from image_cache import get_cached_classifier
+    predictions = get_cached_classifier().classify("http://images.cocodataset.org/val2017/000000039769.jpg", top_k=3)
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import List, Optional, Any, Dict, Callable, Hashable, Tuple
+
+from convnext_service import DEFAULT_MODEL, DEFAULT_BACKEND, Prediction, ClassifierService, get_classifier_service
+from image_preprocessing import DOWNLOAD_TIMEOUT, decode_image
+
+logger = logging.getLogger("ConvNeXtApp")
+
+CACHE_DIR_ENV = "CONVNEXT_CACHE_DIR"
+# 每个条目保存的类别数；请求更多时绕过缓存 (Classes stored per entry; larger requests bypass the cache)
+CACHED_TOP_K = 10
+
+
+def default_cache_path() -> str:
+    directory = os.environ.get(CACHE_DIR_ENV) or os.path.join(os.path.expanduser("~"), ".cache", "convnext-results")
+    return os.path.join(directory, "results.sqlite3")
+
+
+@dataclass
+class UrlRecord:
+    """URL 的校验信息与内容哈希 (Validators and content hash of a URL)"""
+    etag: Optional[str]
+    last_modified: Optional[str]
+    digest: str
+
+
+class ClassificationCache:
+    """
+    磁盘上按大小限制的 LRU 结果缓存 (On-disk, size-bounded LRU result cache)
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = 64 * 2 ** 20, max_urls: int = 100_000):
+        """
+        :param path: SQLite 文件路径，":memory:" 表示仅内存 (SQLite path, ":memory:" for in-memory)
+        :param max_bytes: 结果的总字节数上限 (Max total bytes of stored results)
+        :param max_urls: 最多记录的 URL 数 (Max URL records)
+        """
+        self.path = path or default_cache_path()
+        self.max_bytes = max_bytes
+        self.max_urls = max_urls
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            if self.path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, payload TEXT, size INTEGER, last_access REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_lru ON results (last_access)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, digest TEXT, last_access REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS urls_lru ON urls (last_access)")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[List[Prediction]]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return [Prediction(index=index, label=label, probability=probability) for index, label, probability in json.loads(row[0])]
+
+    def put(self, key: str, predictions: List[Prediction]) -> None:
+        payload = json.dumps([[p.index, p.label, p.probability] for p in predictions], ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, payload, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, len(payload.encode("utf-8")), time.time())
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 淘汰到上限的 90%，避免每次写入都触发淘汰 (Evict down to 90% so every put doesn't trigger eviction)
+        target = total - int(self.max_bytes * 0.9)
+        freed, victims = 0, []
+        for key, size in self._conn.execute("SELECT key, size FROM results ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM results WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def get_url(self, url: str) -> Optional[UrlRecord]:
+        with self._lock:
+            row = self._conn.execute("SELECT etag, last_modified, digest FROM urls WHERE url = ?", (url,)).fetchone()
+        return UrlRecord(*row) if row else None
+
+    def put_url(self, url: str, record: UrlRecord) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO urls (url, etag, last_modified, digest, last_access) VALUES (?, ?, ?, ?, ?)",
+                (url, record.etag, record.last_modified, record.digest, time.time())
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+            if count > self.max_urls:
+                self._conn.execute(
+                    "DELETE FROM urls WHERE url IN (SELECT url FROM urls ORDER BY last_access LIMIT ?)",
+                    (count - self.max_urls,)
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            urls = self._conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        return {
+            "entries": entries,
+            "bytes": size,
+            "urls": urls,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SingleFlight:
+    """
+    同一键的并发调用共享一次执行 (Concurrent calls with the same key share one execution)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result()
+
+
+class CachedImageClassifier:
+    """
+    带结果缓存的分类器 (Classifier fronted by the result cache)
+    """
+
+    def __init__(self, service: ClassifierService, cache: ClassificationCache, backend: str = "torch"):
+        self.service = service
+        self.cache = cache
+        self.backend = backend
+        self.revalidated = 0
+        self.downloads = 0
+        self._flight = SingleFlight()
+
+    def _key(self, digest: str) -> str:
+        return f"{self.service.model_name}|{self.backend}|{digest}"
+
+    def classify(self, image_source: str, top_k: int = 5, is_url: Optional[bool] = None) -> List[Prediction]:
+        """
+        分类 URL 或本地路径的图像，优先使用缓存 (Classify an image URL or path, using the cache when possible)
+        """
+        if is_url is None:
+            is_url = image_source.startswith(("http://", "https://"))
+        if top_k > CACHED_TOP_K:
+            # 超出缓存保存的类别数，直接计算 (More classes than the cache stores; compute directly)
+            return self.service.submit(decode_image(image_source, self.service.preprocess_config, is_url), top_k).result()
+        if is_url:
+            predictions = self._flight.do(("url", image_source), lambda: self._classify_url(image_source))
+        else:
+            with open(image_source, "rb") as f:
+                data = f.read()
+            predictions = self._classify_bytes(hashlib.sha256(data).hexdigest(), data)
+        return predictions[:top_k]
+
+    def _classify_bytes(self, digest: str, data: Optional[bytes]) -> Optional[List[Prediction]]:
+        key = self._key(digest)
+        cached = self.cache.get(key)
+        if cached is not None or data is None:
+            return cached
+
+        def compute() -> List[Prediction]:
+            image = decode_image(data, self.service.preprocess_config)
+            predictions = self.service.submit(image, CACHED_TOP_K).result()
+            self.cache.put(key, predictions)
+            return predictions
+
+        return self._flight.do(key, compute)
+
+    def _classify_url(self, url: str) -> List[Prediction]:
+        import requests
+
+        record = self.cache.get_url(url)
+        if record is not None:
+            headers = {}
+            if record.etag:
+                headers["If-None-Match"] = record.etag
+            if record.last_modified:
+                headers["If-Modified-Since"] = record.last_modified
+            if headers:
+                response = requests.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+                if response.status_code == 304:
+                    cached = self._classify_bytes(record.digest, None)
+                    if cached is not None:
+                        self.revalidated += 1
+                        return cached
+                    # 结果已被淘汰，需要重新下载图像 (The result was evicted, so the image is needed again)
+                    response = requests.get(url, timeout=DOWNLOAD_TIMEOUT)
+            else:
+                response = requests.get(url, timeout=DOWNLOAD_TIMEOUT)
+        else:
+            response = requests.get(url, timeout=DOWNLOAD_TIMEOUT)
+
+        response.raise_for_status()
+        self.downloads += 1
+        data = response.content
+        digest = hashlib.sha256(data).hexdigest()
+        self.cache.put_url(url, UrlRecord(response.headers.get("ETag"), response.headers.get("Last-Modified"), digest))
+        return self._classify_bytes(digest, data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.cache.stats(), "revalidated": self.revalidated, "downloads": self.downloads}
+
+
+_cache: Optional[ClassificationCache] = None
+_classifiers: Dict[Tuple[str, str], CachedImageClassifier] = {}
+_classifiers_lock = threading.Lock()
+
+
+def get_cached_classifier(model_name: str = DEFAULT_MODEL, backend: Optional[str] = None) -> CachedImageClassifier:
+    """
+    获取进程内共享的带缓存分类器，所有模型共用一个缓存文件 (Get the shared cached classifier; all models share one cache file)
+    """
+    global _cache
+    backend = backend or DEFAULT_BACKEND
+    service = get_classifier_service(model_name, backend)
+    with _classifiers_lock:
+        if _cache is None:
+            _cache = ClassificationCache()
+        classifier = _classifiers.get((model_name, backend))
+        if classifier is None:
+            classifier = _classifiers[(model_name, backend)] = CachedImageClassifier(service, _cache, backend)
+        return classifier
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+图像特征嵌入与相似图像检索 (Image feature embeddings and similar-image search)
+
+ConvNeXt 分类头之前的池化特征可用于重复图像与相似图像检索：
+1. 特征按图像内容的 SHA-256 存储：features.f32 为只追加的 float32 矩阵 (已 L2 归一化)，
+   hashes.bin 为对应的 32 字节摘要，两者都以内存映射读取。
+2. paths.json 记录每个路径的 (哈希, 大小, 修改时间)。重新运行时大小与修改时间未变的文件
+   直接跳过；内容已存在的文件 (复制或移动) 只更新路径映射，不再推理。
+3. 检索时分块计算查询向量与全部特征的余弦相似度并取 top-k，内存占用与块大小相关。
+
+用法 (Usage):
+    python image_features.py index photos/ --index-dir ~/.cache/convnext-features
+    python image_features.py search query.jpg --index-dir ~/.cache/convnext-features --k 10
+"""
+
+import os
+import json
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Any, Dict, Tuple
+
+import numpy as np
+from langchain_core.tools import tool
+
+from convnext_service import DEFAULT_MODEL, get_classifier_service
+from image_preprocessing import decode_image, iter_batches, list_images
+
+logger = logging.getLogger("ConvNeXtApp")
+
+INDEX_DIR_ENV = "CONVNEXT_FEATURE_INDEX"
+FEATURES_FILE = "features.f32"
+HASHES_FILE = "hashes.bin"
+PATHS_FILE = "paths.json"
+META_FILE = "meta.json"
+_DIGEST_SIZE = 32
+_SEARCH_BLOCK = 16384
+
+
+def default_index_dir() -> str:
+    return os.environ.get(INDEX_DIR_ENV) or os.path.join(os.path.expanduser("~"), ".cache", "convnext-features")
+
+
+def content_hash(path: str) -> str:
+    """文件内容的 SHA-256 (SHA-256 of a file's content)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+@dataclass
+class SimilarImage:
+    """检索结果 (A search hit)"""
+    hash: str
+    score: float
+    paths: List[str] = field(default_factory=list)
+
+
+@dataclass
+class IndexReport:
+    """索引统计 (Indexing report)"""
+    scanned: int = 0
+    unchanged: int = 0
+    known_content: int = 0
+    embedded: int = 0
+    failed: int = 0
+    removed: int = 0
+
+
+class ImageFeatureIndex:
+    """
+    按内容哈希存储的图像特征索引 (Image feature index keyed by content hash)
+    """
+
+    def __init__(self, directory: str, model_name: str = DEFAULT_MODEL):
+        """
+        :param directory: 索引目录 (Index directory)
+        :param model_name: 生成特征的模型；与已有索引不一致时报错，避免混用不同模型的特征
+                           (Model producing the features; must match an existing index so features are never mixed)
+        """
+        self.directory = directory
+        self.model_name = model_name
+        os.makedirs(directory, exist_ok=True)
+        self.dim: Optional[int] = None
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["model_name"] != model_name:
+                raise ValueError(
+                    f"索引由 {meta['model_name']} 生成，与 {model_name} 不一致 (Index was built with a different model)"
+                )
+            self.dim = meta["dim"]
+
+        self._paths: Dict[str, Dict[str, Any]] = {}
+        paths_path = os.path.join(directory, PATHS_FILE)
+        if os.path.exists(paths_path):
+            with open(paths_path, "r", encoding="utf-8") as f:
+                self._paths = json.load(f)
+
+        self._features = np.zeros((0, self.dim or 0), dtype=np.float32)
+        self._hashes = np.zeros((0, _DIGEST_SIZE), dtype=np.uint8)
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if self.dim:
+            self._recover()
+
+    @property
+    def features_path(self) -> str:
+        return os.path.join(self.directory, FEATURES_FILE)
+
+    @property
+    def hashes_path(self) -> str:
+        return os.path.join(self.directory, HASHES_FILE)
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self._rows
+
+    def _recover(self) -> None:
+        """
+        打开已有文件；丢弃没有对应哈希的尾部特征 (Open existing files; drop trailing features without a hash)
+        """
+        for path in (self.features_path, self.hashes_path):
+            if not os.path.exists(path):
+                open(path, "wb").close()
+        hashes_size = os.path.getsize(self.hashes_path)
+        if hashes_size % _DIGEST_SIZE:
+            os.truncate(self.hashes_path, hashes_size - hashes_size % _DIGEST_SIZE)
+        # 特征先于哈希写入，多出的特征属于未提交的记录 (Features are written before hashes; extras are uncommitted)
+        committed = os.path.getsize(self.hashes_path) // _DIGEST_SIZE * self.dim * 4
+        if os.path.getsize(self.features_path) > committed:
+            os.truncate(self.features_path, committed)
+        self._remap()
+        self._rows = {self._hashes[row].tobytes().hex(): row for row in range(len(self._hashes))}
+
+    def _remap(self) -> None:
+        count = os.path.getsize(self.hashes_path) // _DIGEST_SIZE
+        if count:
+            self._hashes = np.memmap(self.hashes_path, dtype=np.uint8, mode="r", shape=(count, _DIGEST_SIZE))
+            self._features = np.memmap(self.features_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+        else:
+            self._hashes = np.zeros((0, _DIGEST_SIZE), dtype=np.uint8)
+            self._features = np.zeros((0, self.dim), dtype=np.float32)
+
+    def add(self, digests: List[str], vectors: np.ndarray) -> None:
+        """
+        追加一批特征，已存在的哈希被忽略 (Append features; digests already present are ignored)
+        """
+        vectors = _normalize_rows(vectors)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(os.path.join(self.directory, META_FILE), "w", encoding="utf-8") as f:
+                    json.dump({"model_name": self.model_name, "dim": self.dim}, f)
+                self._recover()
+            keep = [row for row, digest in enumerate(digests) if digest not in self._rows]
+            if not keep:
+                return
+            with open(self.features_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors[keep]).tobytes())
+            with open(self.hashes_path, "ab") as f:
+                f.write(b"".join(bytes.fromhex(digests[row]) for row in keep))
+            start = len(self._rows)
+            self._rows.update((digests[row], start + i) for i, row in enumerate(keep))
+            self._remap()
+
+    def vector(self, digest: str) -> Optional[np.ndarray]:
+        row = self._rows.get(digest)
+        return None if row is None else np.array(self._features[row])
+
+    def paths_for(self, digests: List[str]) -> Dict[str, List[str]]:
+        """内容哈希 -> 路径列表 (Digest -> paths)"""
+        wanted = set(digests)
+        paths: Dict[str, List[str]] = {digest: [] for digest in digests}
+        for path, entry in self._paths.items():
+            if entry["hash"] in wanted:
+                paths[entry["hash"]].append(path)
+        return {digest: sorted(found) for digest, found in paths.items()}
+
+    def save_paths(self) -> None:
+        """原子地写出路径映射 (Atomically write the path map)"""
+        path = os.path.join(self.directory, PATHS_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._paths, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def search(self, vector: np.ndarray, k: int = 10, exclude: Optional[str] = None) -> List[SimilarImage]:
+        """
+        余弦相似度 top-k，分块扫描内存映射的特征 (Cosine top-k, scanning the memory-mapped features in blocks)
+
+        :param vector: 查询特征 (Query feature)
+        :param k: 返回数量 (Number of results)
+        :param exclude: 排除的内容哈希，通常是查询图像本身 (Digest to skip, usually the query image itself)
+        """
+        if len(self) == 0:
+            return []
+        query = _normalize_rows(np.asarray(vector).reshape(1, -1))[0]
+        exclude_row = self._rows.get(exclude, -1) if exclude else -1
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, len(self), _SEARCH_BLOCK):
+            scores = np.asarray(self._features[start:start + _SEARCH_BLOCK]) @ query
+            if start <= exclude_row < start + len(scores):
+                scores[exclude_row - start] = -np.inf
+            rows = np.arange(start, start + len(scores))
+            best_rows = np.concatenate([best_rows, rows])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_scores) > k:
+                top = np.argpartition(-best_scores, k - 1)[:k]
+                best_rows, best_scores = best_rows[top], best_scores[top]
+        order = np.argsort(-best_scores)
+        hits = [
+            (self._hashes[row].tobytes().hex(), float(score))
+            for row, score in zip(best_rows[order], best_scores[order]) if np.isfinite(score)
+        ]
+        paths = self.paths_for([digest for digest, _ in hits])
+        return [SimilarImage(hash=digest, score=score, paths=paths[digest]) for digest, score in hits]
+
+    def update_directory(
+        self,
+        directory: str,
+        backend: Optional[str] = None,
+        batch_size: int = 32,
+        workers: Optional[int] = None,
+        recursive: bool = True
+    ) -> IndexReport:
+        """
+        为目录中的图像生成特征，跳过未改变的文件与已知内容 (Embed a directory, skipping unchanged files and known content)
+
+        :param directory: 图像目录 (Image directory)
+        :param backend: 推理后端 (Inference backend)
+        :param batch_size: 每批图像数 (Images per batch)
+        :param workers: 读取与解码线程数 (Hashing and decode threads)
+        :param recursive: 是否包含子目录 (Include subdirectories)
+        """
+        report = IndexReport()
+        paths = [os.path.abspath(path) for path in list_images(directory, recursive)]
+        report.scanned = len(paths)
+
+        # 1. 大小与修改时间未变的文件直接跳过 (Skip files whose size and mtime are unchanged)
+        changed: List[Tuple[str, os.stat_result]] = []
+        for path in paths:
+            stat = os.stat(path)
+            entry = self._paths.get(path)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime and entry["hash"] in self._rows:
+                report.unchanged += 1
+            else:
+                changed.append((path, stat))
+
+        # 2. 计算内容哈希，已知内容只更新路径 (Hash contents; known content only updates the path map)
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4, thread_name_prefix="image-hash") as executor:
+            digests = list(executor.map(content_hash, [path for path, _ in changed]))
+        pending: Dict[str, str] = {}
+        for (path, stat), digest in zip(changed, digests):
+            self._paths[path] = {"hash": digest, "size": stat.st_size, "mtime": stat.st_mtime}
+            if digest in self._rows or digest in pending:
+                report.known_content += 1
+            else:
+                pending[digest] = path
+
+        # 3. 只对新内容推理 (Run the model only on new content)
+        if pending:
+            classifier = get_classifier_service(self.model_name, backend).classifier
+            digest_of = {path: digest for digest, path in pending.items()}
+            for batch in iter_batches(list(pending.values()), classifier.preprocess_config, batch_size=batch_size, workers=workers):
+                for path, error in batch.failures:
+                    self._paths.pop(path, None)
+                    report.failed += 1
+                if batch.sources:
+                    self.add([digest_of[path] for path in batch.sources], classifier.embed_pixels(batch.pixel_values))
+                    report.embedded += len(batch.sources)
+
+        # 4. 删除目录中已不存在的路径 (Forget paths that no longer exist under the directory)
+        root = os.path.abspath(directory) + os.sep
+        present = set(paths)
+        for path in [p for p in self._paths if p.startswith(root) and p not in present]:
+            del self._paths[path]
+            report.removed += 1
+        self.save_paths()
+        logger.info(f"特征索引更新完成: {report}")
+        return report
+
+    def search_image(
+        self,
+        image_source: str,
+        k: int = 10,
+        backend: Optional[str] = None,
+        include_self: bool = False
+    ) -> List[SimilarImage]:
+        """
+        检索与给定图像相似的图像；已索引的图像直接复用其特征 (Find images similar to one; indexed images reuse their feature)
+
+        :param image_source: 图像 URL 或本地路径 (Image URL or local path)
+        :param include_self: 结果中是否包含内容相同的图像 (Include the identical image in the results)
+        """
+        digest = None
+        vector = None
+        if os.path.exists(image_source):
+            digest = content_hash(image_source)
+            vector = self.vector(digest)
+        if vector is None:
+            classifier = get_classifier_service(self.model_name, backend).classifier
+            vector = classifier.embed_images([decode_image(image_source, classifier.preprocess_config)])[0]
+        return self.search(vector, k, exclude=None if include_self else digest)
+
+
+@tool("find_similar_images")
+def find_similar_images_tool(image_source: str, k: int = 5, index_dir: Optional[str] = None) -> str:
+    """
+    在已建立特征索引的图像库中查找与给定图像 (URL 或本地路径) 相似或重复的图像
+    (Find images similar to, or duplicates of, the given image URL or path in the indexed image library)
+    """
+    index = ImageFeatureIndex(index_dir or default_index_dir())
+    if len(index) == 0:
+        return "特征索引为空，请先运行 python image_features.py index <目录>。"
+    lines = []
+    for rank, hit in enumerate(index.search_image(image_source, k=k), start=1):
+        lines.append(f"[{rank}] score={hit.score:.3f} {', '.join(hit.paths) or hit.hash}")
+    return "\n".join(lines) or "没有找到相似图像。"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ConvNeXt image feature index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    index = subparsers.add_parser("index", help="Embed a folder of images into the index")
+    index.add_argument("directory", type=str, help="Image folder")
+    index.add_argument("--batch-size", type=int, default=32, help="Images per batch")
+    index.add_argument("--workers", type=int, default=None, help="Hashing and decode threads")
+    search = subparsers.add_parser("search", help="Find images similar to a query image")
+    search.add_argument("image", type=str, help="Query image URL or path")
+    search.add_argument("--k", type=int, default=10, help="Number of results")
+    for sub in (index, search):
+        sub.add_argument("--index-dir", type=str, default=None, help=f"Index directory (default: ${INDEX_DIR_ENV})")
+        sub.add_argument("--model", type=str, default=DEFAULT_MODEL, help="Hugging Face model name")
+        sub.add_argument("--backend", type=str, default=None, choices=["torch", "onnx", "onnx-int8"], help="Inference backend")
+    return parser.parse_args()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    index = ImageFeatureIndex(args.index_dir or default_index_dir(), args.model)
+    if args.command == "index":
+        print(index.update_directory(args.directory, backend=args.backend, batch_size=args.batch_size, workers=args.workers))
+    else:
+        for rank, hit in enumerate(index.search_image(args.image, k=args.k, backend=args.backend), start=1):
+            print(f"[{rank}] {hit.score:.3f} {', '.join(hit.paths) or hit.hash}")
+
+
+if __name__ == "__main__":
+    main()
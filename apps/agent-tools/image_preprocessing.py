@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+并行解码与向量化预处理 (Parallel image decode and vectorized preprocessing)
+
+与 ConvNextFeatureExtractor 的处理结果一致，但按以下方式拆分以便跟上 CPU 推理速度：
+1. 解码在线程池中进行 (PIL 解码时释放 GIL)。JPEG 使用 draft() 让解码器
+   直接输出 1/2、1/4 或 1/8 分辨率，大图的解码开销随之下降。
+2. 每个线程完成缩放与中心裁剪，得到固定尺寸的 uint8 数组。
+3. 归一化与 HWC -> CHW 转换以批为单位用 NumPy 完成，写入预先分配的批张量。
+4. 批次凑满即交给模型，同时线程池继续解码后续图像。
+"""
+
+import io
+import os
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Any, Iterable, Iterator, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger("ConvNeXtApp")
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff"}
+DOWNLOAD_TIMEOUT = 30
+
+
+@dataclass
+class PreprocessConfig:
+    """
+    预处理参数，默认值与 facebook/convnext-base-224 一致 (Preprocessing settings; defaults match facebook/convnext-base-224)
+
+    :param size: 输出边长 (Output side length)
+    :param crop_pct: size < 384 时先把短边缩放到 size / crop_pct 再中心裁剪
+                     (Below 384, resize the short side to size / crop_pct, then center crop)
+    :param draft: JPEG 以降低的分辨率解码，更快但与全分辨率结果略有差异
+                  (Decode JPEGs at reduced resolution; faster, slightly different from a full decode)
+    """
+    size: int = 224
+    crop_pct: float = 224 / 256
+    mean: Tuple[float, float, float] = IMAGENET_MEAN
+    std: Tuple[float, float, float] = IMAGENET_STD
+    draft: bool = True
+
+    @classmethod
+    def from_feature_extractor(cls, feature_extractor: Any) -> "PreprocessConfig":
+        """从 Hugging Face 特征提取器读取参数 (Read settings from a Hugging Face feature extractor)"""
+        size = feature_extractor.size
+        if isinstance(size, dict):
+            size = size.get("shortest_edge") or size.get("height")
+        return cls(
+            size=int(size),
+            crop_pct=float(getattr(feature_extractor, "crop_pct", None) or cls.crop_pct),
+            mean=tuple(feature_extractor.image_mean),
+            std=tuple(feature_extractor.image_std)
+        )
+
+    @property
+    def resize_to(self) -> int:
+        return int(self.size / self.crop_pct) if self.size < 384 else self.size
+
+
+def open_image(source: Union[str, bytes], is_url: Optional[bool] = None) -> Any:
+    """
+    打开 URL、本地路径或字节串中的图像，尚未解码像素 (Open an image from a URL, path or bytes without decoding pixels)
+    """
+    from PIL import Image
+
+    if isinstance(source, bytes):
+        return Image.open(io.BytesIO(source))
+    if is_url is None:
+        is_url = source.startswith(("http://", "https://"))
+    if is_url:
+        import requests
+
+        response = requests.get(source, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        return Image.open(io.BytesIO(response.content))
+    return Image.open(source)
+
+
+def prepare_image(image: Any, config: PreprocessConfig) -> np.ndarray:
+    """
+    缩放并中心裁剪为 (size, size, 3) 的 uint8 数组 (Resize and center-crop to a (size, size, 3) uint8 array)
+
+    对尚未解码的 JPEG 先调用 draft()，解码器直接输出不小于目标尺寸的缩小版本。
+    (For a not-yet-decoded JPEG, draft() makes the decoder emit a reduced version no smaller than the target.)
+    """
+    from PIL import Image
+
+    target = config.resize_to
+    if config.draft and getattr(image, "format", None) == "JPEG":
+        image.draft("RGB", (target, target))
+    image = image.convert("RGB")
+
+    if config.size >= 384:
+        image = image.resize((config.size, config.size), Image.BICUBIC)
+        return np.asarray(image, dtype=np.uint8)
+
+    width, height = image.size
+    scale = target / min(width, height)
+    resized = (max(target, round(width * scale)), max(target, round(height * scale)))
+    if resized != image.size:
+        image = image.resize(resized, Image.BICUBIC)
+    left = (resized[0] - config.size) // 2
+    top = (resized[1] - config.size) // 2
+    return np.asarray(image.crop((left, top, left + config.size, top + config.size)), dtype=np.uint8)
+
+
+def decode_image(source: Union[str, bytes], config: PreprocessConfig, is_url: Optional[bool] = None) -> np.ndarray:
+    """读取、解码并裁剪一张图像 (Open, decode and crop one image)"""
+    with open_image(source, is_url) as image:
+        return prepare_image(image, config)
+
+
+class BatchNormalizer:
+    """
+    把 uint8 图像批量归一化为 NCHW float32，输出写入复用的预分配缓冲区
+    (Normalize uint8 images into NCHW float32, writing into a reused preallocated buffer)
+
+    返回的数组是缓冲区的视图，下一次调用会覆盖它。
+    (The returned array is a view of the buffer and is overwritten by the next call.)
+    """
+
+    def __init__(self, config: PreprocessConfig, batch_size: int = 32):
+        self.config = config
+        std = np.asarray(config.std, dtype=np.float32).reshape(1, 3, 1, 1)
+        mean = np.asarray(config.mean, dtype=np.float32).reshape(1, 3, 1, 1)
+        # (x / 255 - mean) / std == x * scale - offset
+        self._scale = 1.0 / (255.0 * std)
+        self._offset = mean / std
+        self._allocate(batch_size)
+
+    def _allocate(self, batch_size: int) -> None:
+        size = self.config.size
+        self.capacity = batch_size
+        self._pixels = np.empty((batch_size, size, size, 3), dtype=np.uint8)
+        self._batch = np.empty((batch_size, 3, size, size), dtype=np.float32)
+
+    def __call__(self, images: Sequence[np.ndarray]) -> np.ndarray:
+        count = len(images)
+        if count > self.capacity:
+            self._allocate(count)
+        pixels = self._pixels[:count]
+        for row, image in enumerate(images):
+            pixels[row] = image
+        batch = self._batch[:count]
+        np.multiply(pixels.transpose(0, 3, 1, 2), self._scale, out=batch)
+        np.subtract(batch, self._offset, out=batch)
+        return batch
+
+
+@dataclass
+class PreprocessedBatch:
+    """一批预处理完成的图像 (A batch of preprocessed images)"""
+    sources: List[Any]
+    pixel_values: np.ndarray
+    failures: List[Tuple[Any, str]] = field(default_factory=list)
+
+
+def iter_batches(
+    sources: Iterable[Union[str, bytes]],
+    config: Optional[PreprocessConfig] = None,
+    batch_size: int = 32,
+    workers: Optional[int] = None,
+    prefetch_batches: int = 2
+) -> Iterator[PreprocessedBatch]:
+    """
+    在线程池中解码图像，按输入顺序凑成批次逐个产出 (Decode in a thread pool and yield ordered batches)
+
+    消费方处理当前批次时，线程池继续解码后续最多 prefetch_batches 个批次。
+    pixel_values 使用复用的缓冲区，需在请求下一批之前用完。
+    (While the consumer handles a batch, up to prefetch_batches further batches are decoded.
+    pixel_values lives in a reused buffer and must be consumed before requesting the next batch.)
+
+    :param sources: URL、本地路径或图像字节 (URLs, local paths or image bytes)
+    :param config: 预处理参数 (Preprocessing settings)
+    :param batch_size: 每批图像数 (Images per batch)
+    :param workers: 解码线程数，默认 CPU 核数 (Decode threads, default CPU count)
+    :param prefetch_batches: 预先解码的批次数 (Batches decoded ahead)
+    """
+    config = config or PreprocessConfig()
+    normalizer = BatchNormalizer(config, batch_size)
+    pending: "deque[Tuple[Any, Future]]" = deque()
+    window = batch_size * (prefetch_batches + 1)
+    batch_sources: List[Any] = []
+    batch_images: List[np.ndarray] = []
+    failures: List[Tuple[Any, str]] = []
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4, thread_name_prefix="image-decode") as executor:
+        iterator = iter(sources)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    source = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending.append((source, executor.submit(decode_image, source, config)))
+            if not pending:
+                break
+
+            source, future = pending.popleft()
+            try:
+                batch_images.append(future.result())
+                batch_sources.append(source)
+            except Exception as e:
+                logger.warning(f"图像解码失败: {source} ({e})")
+                failures.append((source, str(e)))
+
+            if len(batch_images) == batch_size or (not pending and (batch_images or failures)):
+                yield PreprocessedBatch(
+                    sources=batch_sources,
+                    pixel_values=normalizer(batch_images) if batch_images else np.zeros((0, 3, config.size, config.size), dtype=np.float32),
+                    failures=failures
+                )
+                batch_sources, batch_images, failures = [], [], []
+
+
+def list_images(directory: str, recursive: bool = True) -> List[str]:
+    """列出目录中的图像文件，按路径排序 (List image files under a directory, sorted)"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in files if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        if not recursive:
+            break
+    return sorted(paths)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+RAG 摄取与检索基准测试 (RAG ingestion & retrieval benchmark)
+
+完全离线运行：使用确定性的合成语料 (中英文混合、HTML 噪声、重复文档)
+和本地哈希嵌入 (或本地 Hugging Face 模型)，分别测量：
+1. clean_text_function / split_documents / 嵌入 / 写入 各阶段吞吐量
+2. 查询延迟分位数 (p50/p95/p99)
+3. 与暴力精确检索对比的 recall@k
+
+结果以 JSON 输出，便于跨版本比较。
+
+用法 (Usage):
+    python benchmark_rag.py --docs 2000 --output bench.json
+    python benchmark_rag.py --embedding /models/all-MiniLM-L6-v2 --quantization int8
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import platform
+from typing import List, Dict, Any, Callable, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from rag_pipeline import clean_text_function, split_documents
+from local_vector_store import LocalVectorStore
+
+EN_WORDS = (
+    "agent retrieval vector index latency throughput cluster kubernetes model token "
+    "embedding chunk document query answer cache shard memory network storage policy "
+    "deploy service gateway metric trace workflow prompt sandbox terminal pipeline"
+).split()
+ZH_PHRASES = (
+    "向量检索 文档分割 语义缓存 模型推理 知识库 工作流 智能体 数据清洗 "
+    "召回率 延迟 吞吐量 集群 部署 网关 监控 日志 提示词 沙箱 终端 流水线"
+).split()
+HTML_TAGS = ["div", "p", "span", "li", "td", "b", "a"]
+ZH_PUNCTUATION = ["，", "。", "！", "？", "：", "；"]
+
+
+# --- 合成语料 (Synthetic corpus) ---
+
+def _sentence(rng: random.Random) -> str:
+    if rng.random() < 0.5:
+        words = [rng.choice(EN_WORDS) for _ in range(rng.randint(6, 18))]
+        return " ".join(words).capitalize() + rng.choice([".", "!", "?"])
+    phrases = [rng.choice(ZH_PHRASES) for _ in range(rng.randint(3, 8))]
+    return rng.choice(ZH_PUNCTUATION[:2]).join(phrases) + rng.choice(ZH_PUNCTUATION)
+
+
+def _noisy_paragraph(rng: random.Random) -> str:
+    text = " ".join(_sentence(rng) for _ in range(rng.randint(3, 8)))
+    if rng.random() < 0.6:
+        tag = rng.choice(HTML_TAGS)
+        text = f'<{tag} class="c{rng.randint(0, 9)}">{text}</{tag}>'
+    if rng.random() < 0.2:
+        text += f"\n\x0bPage {rng.randint(1, 9)} of {rng.randint(10, 20)}\x07"
+    if rng.random() < 0.1:
+        text = "Confidential Document " + text
+    return text
+
+
+def generate_corpus(
+    num_docs: int = 1000,
+    duplicate_ratio: float = 0.15,
+    paragraphs: int = 12,
+    seed: int = 42
+) -> List[Document]:
+    """
+    生成确定性的合成语料 (Generate a deterministic synthetic corpus)
+
+    :param num_docs: 文档数量 (Number of documents)
+    :param duplicate_ratio: 近重复文档比例 (Fraction of near-duplicate documents)
+    :param paragraphs: 每篇文档的平均段落数 (Average paragraphs per document)
+    :param seed: 随机种子 (Random seed)
+    """
+    rng = random.Random(seed)
+    documents: List[Document] = []
+    for i in range(num_docs):
+        if documents and rng.random() < duplicate_ratio:
+            # 复制已有文档并做少量修改 (Copy an earlier document with a small edit)
+            original = rng.choice(documents)
+            content = original.page_content.replace(rng.choice(EN_WORDS), rng.choice(EN_WORDS), 1)
+        else:
+            content = "\n\n".join(_noisy_paragraph(rng) for _ in range(rng.randint(paragraphs // 2, paragraphs * 2)))
+        documents.append(Document(page_content=content, metadata={"source": f"synthetic/doc_{i:06d}.html"}))
+    return documents
+
+
+# --- 本地嵌入 (Local embeddings) ---
+
+class HashingEmbeddings(Embeddings):
+    """
+    基于字符 n-gram 特征哈希的确定性嵌入，无需下载模型
+    (Deterministic char n-gram feature-hashing embeddings; no model download needed)
+    """
+
+    def __init__(self, dim: int = 256, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for i in range(max(1, len(text) - self.ngram + 1)):
+            h = zlib.crc32(text[i:i + self.ngram].encode("utf-8"))
+            vector[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def load_embeddings(name: str) -> Embeddings:
+    """
+    "hashing" 使用内置哈希嵌入，否则按本地 Hugging Face 模型路径加载
+    ("hashing" uses the built-in embedder; anything else is a local HF model path)
+    """
+    if name == "hashing":
+        return HashingEmbeddings()
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=name)
+
+
+# --- 计时工具 (Timing helpers) ---
+
+def _timed(fn: Callable[[], Any]) -> Any:
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _throughput(items: int, seconds: float, nbytes: Optional[int] = None) -> Dict[str, float]:
+    stats = {"items": items, "seconds": seconds, "items_per_sec": items / seconds if seconds else 0.0}
+    if nbytes is not None:
+        stats["mb_per_sec"] = nbytes / 1e6 / seconds if seconds else 0.0
+    return stats
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, float]:
+    values = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+# --- 基准流程 (Benchmark run) ---
+
+def run_benchmark(
+    num_docs: int = 1000,
+    num_queries: int = 200,
+    k: int = 5,
+    embedding_name: str = "hashing",
+    nprobe_values: Optional[List[int]] = None,
+    quantization: Optional[str] = None,
+    dtype: str = "float32",
+    seed: int = 42
+) -> Dict[str, Any]:
+    """
+    运行完整基准 (Run the full benchmark)
+
+    :return: 可序列化为 JSON 的结果字典 (JSON-serializable results)
+    """
+    nprobe_values = nprobe_values or [1, 4, 16]
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "num_docs": num_docs,
+            "num_queries": num_queries,
+            "k": k,
+            "embedding": embedding_name,
+            "quantization": quantization,
+            "dtype": dtype,
+            "seed": seed,
+        },
+        "stages": {},
+        "query": {},
+    }
+
+    corpus = generate_corpus(num_docs, seed=seed)
+    raw_bytes = sum(len(d.page_content.encode("utf-8")) for d in corpus)
+
+    # 1. 清洗 (Cleaning)
+    cleaned, seconds = _timed(lambda: [
+        Document(page_content=clean_text_function(d.page_content), metadata=d.metadata) for d in corpus
+    ])
+    results["stages"]["clean_text"] = _throughput(len(corpus), seconds, raw_bytes)
+
+    # 2. 分割 (Splitting)
+    chunks, seconds = _timed(lambda: split_documents(cleaned))
+    results["stages"]["split_documents"] = _throughput(len(chunks), seconds)
+
+    # 3. 嵌入 (Embedding)
+    embeddings = load_embeddings(embedding_name)
+    texts = [c.page_content for c in chunks]
+    vectors, seconds = _timed(lambda: np.asarray(embeddings.embed_documents(texts), dtype=np.float32))
+    results["stages"]["embedding"] = _throughput(len(texts), seconds)
+
+    # 4. 写入与建索引 (Upsert & index build)
+    store = LocalVectorStore(embedding=embeddings, dtype=dtype, quantization=quantization)
+    ids = [f"chunk-{i}" for i in range(len(chunks))]
+    _, seconds = _timed(lambda: store.add_vectors(vectors, texts, [c.metadata for c in chunks], ids))
+    results["stages"]["upsert"] = _throughput(len(chunks), seconds)
+    _, seconds = _timed(store.build_index)
+    results["stages"]["index_build"] = {"seconds": seconds}
+
+    # 5. 查询延迟与召回 (Query latency & recall)
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(texts), min(num_queries, len(texts)), replace=False)
+    query_texts = [" ".join(texts[r].split()[:20]) for r in query_rows]
+    query_vectors = np.asarray(embeddings.embed_documents(query_texts), dtype=np.float32)
+    normalized = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    exact_top = []
+    for q in query_vectors:
+        scores = normalized @ (q / max(np.linalg.norm(q), 1e-12))
+        exact_top.append(set(np.argsort(-scores)[:k].tolist()))
+
+    for nprobe in nprobe_values:
+        latencies, recalls = [], []
+        for q, truth in zip(query_vectors, exact_top):
+            hits, seconds = _timed(lambda: store.search_by_vector_with_scores(q, k=k, nprobe=nprobe))
+            latencies.append(seconds)
+            recalls.append(len(truth & {row for row, _ in hits}) / len(truth))
+        results["query"][f"nprobe={nprobe}"] = {**_percentiles(latencies), f"recall@{k}": float(np.mean(recalls))}
+
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="RAG ingestion & retrieval benchmark")
+    parser.add_argument("--docs", type=int, default=1000, help="Number of synthetic documents")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=5, help="Top-k for latency and recall")
+    parser.add_argument("--embedding", type=str, default="hashing",
+                        help="'hashing' for the built-in offline embedder, or a local Hugging Face model path")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16], help="nprobe values to sweep")
+    parser.add_argument("--quantization", type=str, default=None, choices=["int8", "pq"], help="Vector quantization")
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "float16"], help="Vector dtype")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--output", type=str, default=None, help="Write JSON results to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = run_benchmark(
+        num_docs=args.docs,
+        num_queries=args.queries,
+        k=args.k,
+        embedding_name=args.embedding,
+        nprobe_values=args.nprobe,
+        quantization=args.quantization,
+        dtype=args.dtype,
+        seed=args.seed
+    )
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
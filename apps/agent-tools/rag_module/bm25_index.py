@@ -0,0 +1,222 @@
+"""
+BM25 关键词倒排索引 (BM25 keyword inverted index)
+
+为 search_docs 工具提供纯词法检索，不需要嵌入或 LLM 调用：
+1. 中日韩文本按单字 + 双字切分，拉丁文本按单词切分 (CJK-aware tokenization)。
+2. 倒排表在 finalize() 后压缩为连续的 numpy 数组。
+3. 用堆取 top-k，并可持久化到磁盘。
+4. 文本块保存在紧凑的 ChunkStore 中，检索只返回行号，命中结果才物化为 Document。
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import logging
+from collections import Counter
+from typing import List, Dict, Any, Tuple, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from chunk_store import ChunkStore, ChunkHandle
+
+logger = logging.getLogger("AgentTools")
+
+_CJK_PATTERN = "\u3400-\u4dbf\u4e00-\u9fff\u3040-\u30ff\uac00-\ud7af"
+_TOKEN_RE = re.compile(f"[{_CJK_PATTERN}]+|[a-z0-9\u00c0-\u024f]+")
+_CJK_RE = re.compile(f"[{_CJK_PATTERN}]")
+
+POSTINGS_FILE = "bm25_postings.npz"
+VOCAB_FILE = "bm25_vocab.json"
+CHUNKS_PREFIX = "bm25_chunks"
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中日韩字符生成单字与相邻双字，其他文字按单词切分
+    (CJK runs yield unigrams and bigrams; other scripts split into words)
+    """
+    tokens: List[str] = []
+    for match in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(match):
+            tokens.extend(match)
+            tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+        else:
+            tokens.append(match)
+    return tokens
+
+
+class BM25Index:
+    """
+    内存 BM25 倒排索引 (In-memory BM25 inverted index)
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # 所索引语料的版本，随索引一起保存 (Version of the indexed corpus, saved with the index)
+        self.version: Optional[str] = None
+        self._chunks = ChunkStore()
+        self._pending: Dict[str, List[Tuple[int, int]]] = {}
+        self._doc_lengths: List[int] = []
+
+        self._vocab: Dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._postings_docs = np.zeros(0, dtype=np.int32)
+        self._postings_tfs = np.zeros(0, dtype=np.uint16)
+        self._doc_norms = np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def add_documents(self, documents: Sequence[Document]) -> None:
+        """
+        添加文档；检索前需要调用 finalize() (Add documents; call finalize() before searching)
+        """
+        if not self._pending and self._vocab:
+            self._unpack()
+        documents = list(documents)
+        rows = self._chunks.append(
+            [doc.page_content for doc in documents],
+            [doc.metadata for doc in documents],
+            [doc.id or str(len(self._chunks) + i) for i, doc in enumerate(documents)]
+        )
+        for doc_id, doc in zip(rows, documents):
+            counts = Counter(tokenize(doc.page_content))
+            for term, tf in counts.items():
+                self._pending.setdefault(term, []).append((doc_id, tf))
+            self._doc_lengths.append(sum(counts.values()))
+
+    def _unpack(self) -> None:
+        """把压缩倒排表还原为可追加的形式 (Expand compact postings back into appendable lists)"""
+        for term, term_id in self._vocab.items():
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            self._pending[term] = list(zip(self._postings_docs[start:end].tolist(), self._postings_tfs[start:end].tolist()))
+        self._vocab = {}
+
+    def finalize(self) -> "BM25Index":
+        """
+        把倒排表压缩为连续数组并预计算文档长度归一项
+        (Pack postings into contiguous arrays and precompute length normalization)
+        """
+        if self._pending:
+            terms = sorted(self._pending)
+            self._vocab = {term: i for i, term in enumerate(terms)}
+            lengths = [len(self._pending[t]) for t in terms]
+            self._offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            self._postings_docs = np.fromiter(
+                (d for t in terms for d, _ in self._pending[t]), dtype=np.int32, count=int(self._offsets[-1])
+            )
+            self._postings_tfs = np.fromiter(
+                (min(tf, 65535) for t in terms for _, tf in self._pending[t]), dtype=np.uint16, count=int(self._offsets[-1])
+            )
+            self._pending = {}
+
+        lengths = np.asarray(self._doc_lengths, dtype=np.float32)
+        avg_length = float(lengths.mean()) if len(lengths) else 0.0
+        self._doc_norms = self.k1 * (1 - self.b + self.b * lengths / max(avg_length, 1e-9))
+        return self
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """
+        BM25 检索 (BM25 search)
+
+        :param query: 查询语句 (Query string)
+        :param k: 返回数量 (Number of results)
+        :return: [(文档序号, 得分)] 按得分降序 ([(doc index, score)] descending)
+        """
+        if self._pending:
+            self.finalize()
+        total = len(self._chunks)
+        if total == 0:
+            return []
+
+        scores = np.zeros(total, dtype=np.float32)
+        touched = []
+        for term in set(tokenize(query)):
+            term_id = self._vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            docs = self._postings_docs[start:end]
+            tfs = self._postings_tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            # 同一词项的倒排表中文档不重复，可直接累加 (Doc ids are unique within a posting list)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self._doc_norms[docs])
+            touched.append(docs)
+
+        if not touched:
+            return []
+        touched_count = sum(len(docs) for docs in touched)
+        if touched_count * 8 < total:
+            # 候选较少时用堆 (Few candidates: heap over the touched documents)
+            candidates = np.unique(np.concatenate(touched))
+            best = heapq.nlargest(k, candidates.tolist(), key=scores.__getitem__)
+        else:
+            # 高频词命中大部分文档时，向量化的部分排序更快 (Frequent terms: vectorized partial sort)
+            top = np.argpartition(-scores, k)[:k] if k < total else np.arange(total)
+            best = [int(i) for i in top[np.argsort(-scores[top])] if scores[i] > 0]
+        return [(i, float(scores[i])) for i in best]
+
+    def get_document(self, index: int) -> Document:
+        return self._chunks.get_document(index)
+
+    def search_handles(self, query: str, k: int = 5) -> List[ChunkHandle]:
+        """检索并返回轻量句柄，正文按需读取 (Search returning lightweight handles; text is read on demand)"""
+        return [self._chunks.handle(i, score) for i, score in self.search(query, k)]
+
+    def search_documents(self, query: str, k: int = 5) -> List[Tuple[Document, float]]:
+        return [(self.get_document(i), score) for i, score in self.search(query, k)]
+
+    # --- 持久化 (Persistence) ---
+
+    def save(self, directory: str) -> None:
+        """
+        保存索引到目录 (Save the index to a directory)
+        """
+        self.finalize()
+        os.makedirs(directory, exist_ok=True)
+        np.savez(
+            os.path.join(directory, POSTINGS_FILE),
+            offsets=self._offsets,
+            docs=self._postings_docs,
+            tfs=self._postings_tfs,
+            doc_lengths=np.asarray(self._doc_lengths, dtype=np.int32)
+        )
+        with open(os.path.join(directory, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "version": self.version, "terms": sorted(self._vocab, key=self._vocab.get)}, f, ensure_ascii=False)
+        self._chunks.copy_to(directory, CHUNKS_PREFIX)
+        logger.info(f"BM25 索引已保存到 {directory} ({len(self)} 个文档, {len(self._vocab)} 个词项)。")
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        """
+        从目录加载索引 (Load the index from a directory)
+        """
+        with open(os.path.join(directory, VOCAB_FILE), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        index = cls(k1=vocab["k1"], b=vocab["b"])
+        index.version = vocab.get("version")
+        index._vocab = {term: i for i, term in enumerate(vocab["terms"])}
+        with np.load(os.path.join(directory, POSTINGS_FILE)) as data:
+            index._offsets = data["offsets"]
+            index._postings_docs = data["docs"]
+            index._postings_tfs = data["tfs"]
+            index._doc_lengths = data["doc_lengths"].tolist()
+        # 文本块以内存映射方式打开 (Chunks are opened memory-mapped)
+        index._chunks = ChunkStore(directory, prefix=CHUNKS_PREFIX)
+        return index.finalize()
+
+    @classmethod
+    def exists(cls, directory: Optional[str]) -> bool:
+        """判断目录中是否已保存索引 (Whether an index is saved in the directory)"""
+        return bool(directory) and os.path.exists(os.path.join(directory, VOCAB_FILE))
+
+    @classmethod
+    def from_documents(cls, documents: Sequence[Document], **kwargs: Any) -> "BM25Index":
+        index = cls(**kwargs)
+        index.add_documents(documents)
+        return index.finalize()
@@ -0,0 +1,282 @@
+"""
+内存映射的文本块存储 (Memory-mapped chunk text store)
+
+文本块的 id、metadata 和正文以紧凑的二进制记录追加写入单个数据文件，
+另有一个只追加的 int64 偏移文件记录每条记录的结束位置。读取时两个文件
+都以内存映射打开，只有被请求的记录才会解码为 Python 对象。
+
+检索结果以 ChunkHandle (行号 + 得分) 的形式传递，只有最终 top-k 才调用
+to_document() 物化为 Document，因此常驻内存随查询工作集增长，而不是随语料规模增长。
+
+记录格式 (Record layout):
+    <u4 id 字节数> <u4 metadata 字节数> <id (UTF-8)> <metadata (JSON, UTF-8)> <正文 (UTF-8)>
+"""
+
+import os
+import json
+import mmap
+import struct
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional, Any, Dict, Iterable, Iterator, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger("AgentTools")
+
+_HEADER = struct.Struct("<II")
+DATA_SUFFIX = ".bin"
+OFFSETS_SUFFIX = ".offsets"
+
+
+@dataclass
+class ChunkHandle:
+    """
+    文本块的轻量句柄，正文和 metadata 按需读取 (Lightweight chunk reference; text and metadata are read on demand)
+    """
+    row: int
+    score: float = 0.0
+    store: "ChunkStore" = field(default=None, repr=False, compare=False)
+
+    @property
+    def id(self) -> str:
+        return self.store.get_id(self.row)
+
+    @property
+    def text(self) -> str:
+        return self.store.get_text(self.row)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.store.get_metadata(self.row)
+
+    def to_document(self) -> Document:
+        return self.store.get_document(self.row)
+
+
+class ChunkStore:
+    """
+    只追加的文本块存储 (Append-only chunk store)
+
+    directory 为 None 时数据保存在进程内缓冲区；否则写入
+    {directory}/{prefix}.bin 与 {directory}/{prefix}.offsets 并以 mmap 读取。
+    """
+
+    def __init__(self, directory: Optional[str] = None, prefix: str = "chunks", truncate: bool = False):
+        """
+        :param directory: 存储目录，None 表示仅内存 (Storage directory, None for in-memory)
+        :param prefix: 文件名前缀，允许多个存储共用一个目录 (File prefix, so several stores can share a directory)
+        :param truncate: 清空已有文件重新开始 (Discard existing files and start empty)
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self._buffer = bytearray()
+        self._ends = np.zeros(0, dtype=np.int64)
+        self._data_map: Optional[mmap.mmap] = None
+        self._data_file = None
+        self._id_rows: Optional[Dict[str, int]] = None
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            if truncate:
+                for path in (self.data_path, self.offsets_path):
+                    open(path, "wb").close()
+            self._recover()
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.directory, self.prefix + DATA_SUFFIX)
+
+    @property
+    def offsets_path(self) -> str:
+        return os.path.join(self.directory, self.prefix + OFFSETS_SUFFIX)
+
+    @classmethod
+    def exists(cls, directory: Optional[str], prefix: str = "chunks") -> bool:
+        """判断目录中是否已有该存储 (Whether the store exists in a directory)"""
+        return bool(directory) and os.path.exists(os.path.join(directory, prefix + OFFSETS_SUFFIX))
+
+    def _recover(self) -> None:
+        """
+        打开已有文件；丢弃未写完偏移的尾部记录 (Open existing files; drop a torn trailing record)
+        """
+        for path in (self.data_path, self.offsets_path):
+            if not os.path.exists(path):
+                open(path, "wb").close()
+        # 偏移文件按 8 字节对齐截断 (Truncate the offsets file to whole int64 entries)
+        offsets_size = os.path.getsize(self.offsets_path)
+        if offsets_size % 8:
+            os.truncate(self.offsets_path, offsets_size - offsets_size % 8)
+        self._remap()
+        committed = int(self._ends[-1]) if len(self._ends) else 0
+        if os.path.getsize(self.data_path) > committed:
+            # 数据先于偏移写入，多出的字节属于未提交的记录 (Data is written before offsets; extra bytes are uncommitted)
+            self._close_maps()
+            os.truncate(self.data_path, committed)
+            self._remap()
+
+    def _remap(self) -> None:
+        """重新映射文件以看到新追加的记录 (Re-map files so newly appended records are visible)"""
+        self._close_maps()
+        if os.path.getsize(self.offsets_path):
+            self._ends = np.memmap(self.offsets_path, dtype="<i8", mode="r")
+        else:
+            self._ends = np.zeros(0, dtype=np.int64)
+        if os.path.getsize(self.data_path):
+            self._data_file = open(self.data_path, "rb")
+            self._data_map = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _close_maps(self) -> None:
+        # memmap 在最后一个引用释放时关闭 (A memmap closes when its last reference is dropped)
+        self._ends = np.zeros(0, dtype=np.int64)
+        if self._data_map is not None:
+            self._data_map.close()
+            self._data_file.close()
+            self._data_map = None
+            self._data_file = None
+
+    def close(self) -> None:
+        """释放内存映射 (Release the memory maps)"""
+        self._close_maps()
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    # --- 写入 (Write path) ---
+
+    def append(
+        self,
+        texts: Sequence[str],
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+        ids: Optional[Sequence[str]] = None
+    ) -> range:
+        """
+        追加一批文本块 (Append a batch of chunks)
+
+        :return: 新记录的行号范围 (Row range of the new records)
+        """
+        start_row = len(self)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(start_row + i) for i in range(len(texts))]
+        base = int(self._ends[-1]) if len(self._ends) else 0
+
+        records, ends = [], []
+        position = base
+        for doc_id, text, metadata in zip(ids, texts, metadatas):
+            id_bytes = str(doc_id).encode("utf-8")
+            meta_bytes = json.dumps(metadata, ensure_ascii=False, default=str).encode("utf-8")
+            record = _HEADER.pack(len(id_bytes), len(meta_bytes)) + id_bytes + meta_bytes + text.encode("utf-8")
+            records.append(record)
+            position += len(record)
+            ends.append(position)
+        ends = np.asarray(ends, dtype="<i8")
+
+        if self.directory:
+            with open(self.data_path, "ab") as f:
+                f.write(b"".join(records))
+            with open(self.offsets_path, "ab") as f:
+                f.write(ends.tobytes())
+            self._remap()
+        else:
+            self._buffer.extend(b"".join(records))
+            self._ends = np.concatenate([self._ends, ends])
+
+        if self._id_rows is not None:
+            self._id_rows.update((str(doc_id), start_row + i) for i, doc_id in enumerate(ids))
+        return range(start_row, len(self))
+
+    def truncate(self, count: int) -> None:
+        """
+        只保留前 count 条记录 (Keep only the first count records)
+
+        先截断偏移文件再截断数据，中途崩溃也能由 _recover() 修复
+        (Offsets are cut before data, so a crash in between is repaired by _recover())
+        """
+        if count >= len(self):
+            return
+        size = int(self._ends[count - 1]) if count else 0
+        if self.directory:
+            self._close_maps()
+            os.truncate(self.offsets_path, count * 8)
+            os.truncate(self.data_path, size)
+            self._remap()
+        else:
+            del self._buffer[size:]
+            self._ends = self._ends[:count].copy()
+        self._id_rows = None
+
+    def copy_to(self, directory: str, prefix: Optional[str] = None) -> None:
+        """
+        把全部记录写入另一个目录 (Write all records to another directory)
+        """
+        prefix = prefix or self.prefix
+        os.makedirs(directory, exist_ok=True)
+        data_path = os.path.join(directory, prefix + DATA_SUFFIX)
+        offsets_path = os.path.join(directory, prefix + OFFSETS_SUFFIX)
+        if self.directory and os.path.abspath(data_path) == os.path.abspath(self.data_path):
+            return
+        size = int(self._ends[-1]) if len(self._ends) else 0
+        for path, payload in ((data_path, self._view()[:size]), (offsets_path, np.asarray(self._ends, dtype="<i8").tobytes())):
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+
+    # --- 读取 (Read path) ---
+
+    def _view(self):
+        return self._data_map if self._data_map is not None else self._buffer
+
+    def _record(self, row: int):
+        if row < 0 or row >= len(self):
+            raise IndexError(f"文本块行号越界: {row} (Chunk row out of range)")
+        start = int(self._ends[row - 1]) if row else 0
+        end = int(self._ends[row])
+        view = self._view()
+        id_len, meta_len = _HEADER.unpack_from(view, start)
+        body = start + _HEADER.size
+        return view, body, body + id_len, body + id_len + meta_len, end
+
+    def get_id(self, row: int) -> str:
+        view, id_start, meta_start, _, _ = self._record(row)
+        return bytes(view[id_start:meta_start]).decode("utf-8")
+
+    def get_metadata(self, row: int) -> Dict[str, Any]:
+        view, _, meta_start, text_start, _ = self._record(row)
+        return json.loads(bytes(view[meta_start:text_start]).decode("utf-8"))
+
+    def get_text(self, row: int) -> str:
+        view, _, _, text_start, end = self._record(row)
+        return bytes(view[text_start:end]).decode("utf-8")
+
+    def get_document(self, row: int) -> Document:
+        view, id_start, meta_start, text_start, end = self._record(row)
+        return Document(
+            page_content=bytes(view[text_start:end]).decode("utf-8"),
+            metadata=json.loads(bytes(view[meta_start:text_start]).decode("utf-8")),
+            id=bytes(view[id_start:meta_start]).decode("utf-8")
+        )
+
+    def get_documents(self, rows: Iterable[int]) -> List[Document]:
+        return [self.get_document(row) for row in rows]
+
+    def handle(self, row: int, score: float = 0.0) -> ChunkHandle:
+        return ChunkHandle(row=int(row), score=float(score), store=self)
+
+    def row_of(self, doc_id: str) -> Optional[int]:
+        """
+        按 id 查找行号；首次调用时扫描一遍建立映射 (Look up a row by id; the map is built on first use)
+        """
+        if self._id_rows is None:
+            self._id_rows = {self.get_id(row): row for row in range(len(self))}
+        return self._id_rows.get(doc_id)
+
+    def iter_texts(self) -> Iterator[str]:
+        """按行顺序流式读取正文，不保留引用 (Stream texts in row order without retaining them)"""
+        for row in range(len(self)):
+            yield self.get_text(row)
+
+    def nbytes(self) -> int:
+        """数据文件大小 (Size of the record data)"""
+        return int(self._ends[-1]) if len(self._ends) else 0
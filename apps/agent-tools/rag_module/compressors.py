@@ -0,0 +1,213 @@
+"""
+文档压缩器 (Document compressors)
+
+用于 ContextualCompressionRetriever 的本地压缩/重排实现：
+- CrossEncoderReranker: 本地交叉编码器，一次批量前向计算为所有 (问题, 文本块) 打分。
+- ConcurrentLLMChainExtractor: 并发执行逐文档的 LLM 抽取，带并发上限和整体截止时间。
+"""
+
+import asyncio
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, Awaitable, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.language_models import BaseLanguageModel
+from langchain.retrievers.document_compressors import LLMChainExtractor
+
+logger = logging.getLogger("AgentTools")
+
+DEFAULT_RERANKER_MODEL = "BAAI/bge-reranker-base"
+
+
+@lru_cache(maxsize=4)
+def load_cross_encoder(model_name: str, quantize: bool = False) -> Tuple[Any, Any]:
+    """
+    加载并缓存交叉编码器，同一进程内只加载一次 (Load and cache a cross-encoder once per process)
+
+    :param model_name: Hugging Face 模型名称或本地路径 (Model name or local path)
+    :param quantize: 是否对 Linear 层做 int8 动态量化 (Apply int8 dynamic quantization to Linear layers)
+    :return: (tokenizer, model)
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+    logger.info(f"正在加载交叉编码器: {model_name} (量化: {quantize})")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.eval()
+
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return tokenizer, model
+
+
+class CrossEncoderReranker(BaseDocumentCompressor):
+    """
+    本地交叉编码器重排器 (Local cross-encoder reranker)
+
+    与 LLMChainExtractor 每个文档调用一次 LLM 不同，这里在 CPU 上对所有候选
+    一次性批量打分，只保留得分最高的 top_n 个文档。
+    """
+
+    model_name: str = DEFAULT_RERANKER_MODEL
+    top_n: int = 5
+    batch_size: int = 64
+    max_length: int = 512
+    quantize: bool = False
+    score_threshold: Optional[float] = None
+
+    def score(self, query: str, texts: Sequence[str]) -> list:
+        """
+        为 (问题, 文本) 对打分 (Score (query, text) pairs)
+
+        :param query: 用户问题 (User question)
+        :param texts: 候选文本 (Candidate texts)
+        :return: 与 texts 对齐的相关性得分 (Relevance scores aligned with texts)
+        """
+        import torch
+
+        tokenizer, model = load_cross_encoder(self.model_name, self.quantize)
+        scores = []
+        with torch.inference_mode():
+            for start in range(0, len(texts), self.batch_size):
+                batch = list(texts[start:start + self.batch_size])
+                inputs = tokenizer(
+                    [query] * len(batch),
+                    batch,
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors="pt"
+                )
+                logits = model(**inputs).logits
+                # 单输出头为相关性 logit；双输出头取正类 (Single-logit head, or positive class of a 2-way head)
+                batch_scores = logits[:, -1] if logits.shape[-1] > 1 else logits.squeeze(-1)
+                scores.extend(batch_scores.float().tolist())
+        return scores
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None
+    ) -> Sequence[Document]:
+        """
+        重排并截取 top_n 文档，得分写入 metadata["relevance_score"]
+        (Rerank and keep top_n documents; scores go to metadata["relevance_score"])
+        """
+        if not documents:
+            return []
+
+        scores = self.score(query, [doc.page_content for doc in documents])
+        ranked = sorted(zip(documents, scores), key=lambda pair: pair[1], reverse=True)
+
+        results = []
+        for doc, score in ranked[:self.top_n]:
+            if self.score_threshold is not None and score < self.score_threshold:
+                break
+            results.append(Document(
+                page_content=doc.page_content,
+                metadata={**doc.metadata, "relevance_score": score},
+                id=doc.id
+            ))
+        return results
+
+
+def run_coroutine_sync(coro: Awaitable[Any]) -> Any:
+    """
+    在同步代码中运行协程；若当前线程已有事件循环，则在独立线程中运行
+    (Run a coroutine from sync code; use a helper thread if a loop is already running)
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result: dict = {}
+
+    def runner():
+        try:
+            result["value"] = asyncio.run(coro)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=runner, daemon=True)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+class ConcurrentLLMChainExtractor(BaseDocumentCompressor):
+    """
+    并发 LLM 抽取压缩器 (Concurrent LLM extraction compressor)
+
+    对每个候选文档并发调用 LLMChainExtractor，最多同时 max_concurrency 个请求。
+    到达 deadline_seconds 时立即返回：已完成的文档使用抽取结果，
+    未完成或失败的文档回退为原始文本块，结果保持检索顺序。
+    """
+
+    extractor: LLMChainExtractor
+    max_concurrency: int = 8
+    deadline_seconds: Optional[float] = 15.0
+    per_document_timeout: Optional[float] = None
+
+    @classmethod
+    def from_llm(cls, llm: BaseLanguageModel, **kwargs: Any) -> "ConcurrentLLMChainExtractor":
+        """
+        基于 LLM 创建并发抽取器 (Create from an LLM)
+        """
+        return cls(extractor=LLMChainExtractor.from_llm(llm), **kwargs)
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def compress_one(doc: Document) -> Sequence[Document]:
+            async with semaphore:
+                call = self.extractor.acompress_documents([doc], query, callbacks)
+                if self.per_document_timeout:
+                    return await asyncio.wait_for(call, self.per_document_timeout)
+                return await call
+
+        tasks = [asyncio.ensure_future(compress_one(doc)) for doc in documents]
+        done, pending = await asyncio.wait(tasks, timeout=self.deadline_seconds)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"压缩截止时间已到: {len(pending)}/{len(tasks)} 个文档回退为原始文本块。")
+
+        results: List[Document] = []
+        for doc, task in zip(documents, tasks):
+            if task in done and task.exception() is None:
+                # 空结果表示 LLM 判定不相关，直接丢弃 (Empty output means the LLM judged it irrelevant)
+                results.extend(task.result())
+                continue
+            if task in done:
+                logger.warning(f"文档压缩失败，回退为原始文本块: {task.exception()}")
+            results.append(Document(
+                page_content=doc.page_content,
+                metadata={**doc.metadata, "compression_fallback": True},
+                id=doc.id
+            ))
+        return results
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None
+    ) -> Sequence[Document]:
+        return run_coroutine_sync(self.acompress_documents(documents, query, callbacks))
@@ -0,0 +1,214 @@
+"""
+按 token 预算组装上下文 (Token-budget-aware context packing)
+
+"stuff" 链会把所有检索结果原样拼进提示词。本模块在调用 LLM 前：
+1. 用缓存的分词器统计 token 数 (tiktoken 不可用时按字符估算)。
+2. 去除同一来源相邻文本块之间的重叠部分 (分割时的 chunk_overlap)。
+3. 按得分从高到低贪心装入给定的 token 预算，最后一块可截断以填满预算。
+"""
+
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Any, Callable, Sequence, Tuple
+
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import Document, BaseDocumentCompressor
+
+logger = logging.getLogger("AgentTools")
+
+DEFAULT_TOKEN_BUDGET = 3000
+DEFAULT_ENCODING = "cl100k_base"
+# 每个文档之间的分隔符开销 (Separator overhead between documents in the stuffed prompt)
+_SEPARATOR_TOKENS = 2
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(encoding_name: str = DEFAULT_ENCODING) -> Callable[[str], int]:
+    """
+    获取带缓存的 token 计数函数 (Get a cached token-counting function)
+
+    优先使用 tiktoken；未安装或编码文件无法获取 (离线环境) 时按
+    "中日韩字符 1 token，其他约 4 字符 1 token" 估算。
+    (Uses tiktoken when installed and its encoding can be loaded — it is downloaded on first use,
+    so offline hosts may fail; otherwise estimates 1 token per CJK char and ~4 chars per token elsewhere.)
+    """
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(encoding_name)
+
+        def count(text: str) -> int:
+            return len(encoding.encode(text, disallowed_special=()))
+    except Exception as e:
+        logger.warning(f"tiktoken 不可用 ({type(e).__name__})，token 数将按字符估算 (estimating tokens from characters)")
+
+        def count(text: str) -> int:
+            cjk = sum(1 for ch in text if "\u3400" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af")
+            return cjk + (len(text) - cjk + 3) // 4
+
+    # 同一文本块会在多次提问中反复出现 (The same chunks recur across questions)
+    return lru_cache(maxsize=4096)(count)
+
+
+def _overlap_length(left: str, right: str, min_overlap: int, max_overlap: int) -> int:
+    """left 的后缀与 right 的前缀重叠的最大长度 (Longest suffix of left that is a prefix of right)"""
+    limit = min(len(left), len(right), max_overlap)
+    for size in range(limit, min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def strip_overlap(text: str, selected: Sequence[str], min_overlap: int = 32, max_overlap: int = 400) -> str:
+    """
+    去掉 text 中与已选文本重叠的开头或结尾 (Remove the head or tail of text that overlaps already selected text)
+
+    :param text: 候选文本 (Candidate text)
+    :param selected: 同一来源中已选入的文本 (Already selected texts from the same source)
+    :param min_overlap: 视为重叠的最小字符数 (Minimum chars counted as overlap)
+    :param max_overlap: 检查的最大重叠字符数，应不小于分割时的 chunk_overlap
+                        (Max overlap checked; should be at least the splitter's chunk_overlap)
+    :return: 去重叠后的文本，完全被包含时返回空串 (Trimmed text; empty if fully contained)
+    """
+    for other in selected:
+        if text in other:
+            return ""
+        head = _overlap_length(other, text, min_overlap, max_overlap)
+        if head:
+            text = text[head:]
+        tail = _overlap_length(text, other, min_overlap, max_overlap)
+        if tail:
+            text = text[:-tail]
+    return text.strip()
+
+
+def _truncate_to_budget(text: str, budget: int, count: Callable[[str], int]) -> str:
+    """二分查找不超过预算的最长前缀，并尽量在句子边界截断 (Longest prefix within budget, cut at a sentence boundary if possible)"""
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    prefix = text[:low]
+    boundary = max(prefix.rfind(mark) for mark in ("。", "！", "？", ". ", "! ", "? ", "\n"))
+    return prefix[:boundary + 1] if boundary > len(prefix) // 2 else prefix
+
+
+@dataclass
+class PackingReport:
+    """上下文组装统计 (Context packing report)"""
+    input_documents: int
+    output_documents: int
+    input_tokens: int
+    output_tokens: int
+    overlap_chars_removed: int
+    truncated: bool
+
+    @property
+    def token_reduction_ratio(self) -> float:
+        return 1 - self.output_tokens / self.input_tokens if self.input_tokens else 0.0
+
+
+def pack_documents(
+    documents: Sequence[Document],
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    encoding_name: str = DEFAULT_ENCODING,
+    min_overlap: int = 32,
+    max_overlap: int = 400,
+    min_fragment_tokens: int = 32
+) -> Tuple[List[Document], PackingReport]:
+    """
+    按得分把文档装入 token 预算 (Pack documents into a token budget by score)
+
+    得分取 metadata["relevance_score"] (重排器给出)，缺失时按检索排名。
+    (Scores come from metadata["relevance_score"] set by the reranker, else the retrieval rank.)
+
+    :param documents: 检索/压缩后的文档 (Retrieved or compressed documents)
+    :param token_budget: 上下文 token 上限，不含提示词模板 (Context token limit, excluding the prompt template)
+    :param encoding_name: tiktoken 编码名称 (tiktoken encoding name)
+    :param min_overlap: 视为重叠的最小字符数 (Minimum chars counted as overlap)
+    :param max_overlap: 检查的最大重叠字符数 (Max overlap chars checked)
+    :param min_fragment_tokens: 剩余预算低于此值时不再截断装入 (Don't truncate into less than this many tokens)
+    :return: (装入的文档, 统计报告) ((packed documents, report))
+    """
+    count = get_token_counter(encoding_name)
+    ranked = sorted(
+        enumerate(documents),
+        key=lambda item: (-item[1].metadata.get("relevance_score", float("-inf")), item[0])
+    )
+
+    packed: List[Document] = []
+    selected_by_source: dict = {}
+    used = removed = input_tokens = 0
+    truncated = False
+    for _, doc in ranked:
+        input_tokens += count(doc.page_content) + _SEPARATOR_TOKENS
+        remaining = token_budget - used
+        if remaining <= _SEPARATOR_TOKENS:
+            continue
+
+        source = doc.metadata.get("source")
+        text = doc.page_content
+        if source is not None:
+            text = strip_overlap(text, selected_by_source.get(source, []), min_overlap, max_overlap)
+            removed += len(doc.page_content) - len(text)
+        if not text:
+            continue
+
+        tokens = count(text)
+        if tokens + _SEPARATOR_TOKENS > remaining:
+            if remaining - _SEPARATOR_TOKENS < min_fragment_tokens:
+                continue
+            text = _truncate_to_budget(text, remaining - _SEPARATOR_TOKENS, count)
+            tokens = count(text)
+            truncated = True
+            if not text:
+                continue
+
+        used += tokens + _SEPARATOR_TOKENS
+        selected_by_source.setdefault(source, []).append(text)
+        packed.append(Document(page_content=text, metadata={**doc.metadata, "context_tokens": tokens}, id=doc.id))
+
+    report = PackingReport(
+        input_documents=len(documents),
+        output_documents=len(packed),
+        input_tokens=input_tokens,
+        output_tokens=used,
+        overlap_chars_removed=removed,
+        truncated=truncated
+    )
+    logger.info(
+        f"上下文组装: {report.input_documents} -> {report.output_documents} 个文档, "
+        f"{report.input_tokens} -> {report.output_tokens} tokens (预算 {token_budget})。"
+    )
+    return packed, report
+
+
+class ContextPackingCompressor(BaseDocumentCompressor):
+    """
+    以文档压缩器形式提供的上下文组装，可接在任何检索器之后
+    (Context packing as a document compressor, so it can follow any retriever)
+    """
+
+    token_budget: int = DEFAULT_TOKEN_BUDGET
+    encoding_name: str = DEFAULT_ENCODING
+    min_overlap: int = 32
+    max_overlap: int = 400
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+        **kwargs: Any
+    ) -> Sequence[Document]:
+        packed, _ = pack_documents(
+            documents,
+            token_budget=self.token_budget,
+            encoding_name=self.encoding_name,
+            min_overlap=self.min_overlap,
+            max_overlap=self.max_overlap
+        )
+        return packed
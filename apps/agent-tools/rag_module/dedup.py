@@ -0,0 +1,186 @@
+"""
+近重复文本块消除 (Near-duplicate chunk elimination)
+
+在分割之后、嵌入之前，使用 MinHash 签名 + LSH 分桶找出近似重复的文本块
+(模板、版本副本、大量样板内容的页面)，只保留每组中的第一个块，
+并把被合并块的来源记录到保留块的 metadata 中。
+"""
+
+import zlib
+import logging
+from dataclasses import dataclass
+from typing import List, Tuple, Dict, Any
+
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger("AgentTools")
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+@dataclass
+class DedupReport:
+    """去重统计 (Deduplication report)"""
+    input_chunks: int
+    output_chunks: int
+    duplicate_groups: int
+
+    @property
+    def removed(self) -> int:
+        return self.input_chunks - self.output_chunks
+
+    @property
+    def reduction_ratio(self) -> float:
+        return self.removed / self.input_chunks if self.input_chunks else 0.0
+
+
+class MinHasher:
+    """
+    MinHash 签名生成器 (MinHash signature generator)
+
+    使用字符 n-gram 作为 shingle，中英文文本均适用 (Character n-gram shingles work for both zh and en).
+    """
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 42):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # a, b < 2^32 保证 a * x + b 不会溢出 uint64 (Keeps a * x + b within uint64)
+        self._a = rng.integers(1, _MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """文本的 shingle 哈希集合 (Hashed shingle set of a text)"""
+        text = " ".join(text.lower().split())
+        n = self.shingle_size
+        if len(text) <= n:
+            grams = {text}
+        else:
+            grams = {text[i:i + n] for i in range(len(text) - n + 1)}
+        return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        """计算 MinHash 签名 (Compute the MinHash signature)"""
+        hashes = self.shingles(text)
+        permuted = (self._a[:, np.newaxis] * hashes[np.newaxis, :] + self._b[:, np.newaxis]) % _MERSENNE_PRIME
+        return permuted.min(axis=1)
+
+
+def _find(parent: List[int], i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def find_duplicate_groups(
+    texts: List[str],
+    threshold: float = 0.85,
+    num_perm: int = 128,
+    bands: int = 32,
+    shingle_size: int = 5
+) -> List[List[int]]:
+    """
+    返回近重复分组 (每组按原顺序排列的下标) (Return near-duplicate groups as ordered index lists)
+
+    :param texts: 文本列表 (Texts)
+    :param threshold: 估计 Jaccard 相似度阈值 (Estimated Jaccard similarity threshold)
+    :param num_perm: MinHash 置换数量 (Number of MinHash permutations)
+    :param bands: LSH 分带数量，需整除 num_perm (LSH bands; must divide num_perm)
+    :param shingle_size: 字符 n-gram 长度 (Character n-gram length)
+    """
+    if num_perm % bands != 0:
+        raise ValueError(f"bands ({bands}) 必须整除 num_perm ({num_perm})")
+    rows = num_perm // bands
+
+    hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+    signatures = np.stack([hasher.signature(t) for t in texts]) if texts else np.zeros((0, num_perm), dtype=np.uint64)
+
+    parent = list(range(len(texts)))
+    for band in range(bands):
+        buckets: Dict[bytes, List[int]] = {}
+        band_slice = signatures[:, band * rows:(band + 1) * rows]
+        for i in range(len(texts)):
+            buckets.setdefault(band_slice[i].tobytes(), []).append(i)
+
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            head = members[0]
+            for other in members[1:]:
+                root_head, root_other = _find(parent, head), _find(parent, other)
+                if root_head == root_other:
+                    continue
+                # 用完整签名校验，过滤 LSH 误报 (Verify with the full signature to filter LSH false positives)
+                similarity = float(np.mean(signatures[head] == signatures[other]))
+                if similarity >= threshold:
+                    parent[max(root_head, root_other)] = min(root_head, root_other)
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(texts)):
+        groups.setdefault(_find(parent, i), []).append(i)
+    return list(groups.values())
+
+
+def deduplicate_chunks(
+    chunks: List[Document],
+    threshold: float = 0.85,
+    strategy: str = "merge",
+    num_perm: int = 128,
+    bands: int = 32,
+    shingle_size: int = 5
+) -> Tuple[List[Document], DedupReport]:
+    """
+    消除近重复文本块 (Drop near-duplicate chunks)
+
+    :param chunks: 分割后的文档块 (Split chunks)
+    :param threshold: 估计 Jaccard 相似度阈值 (Similarity threshold)
+    :param strategy: "merge" 在保留块中记录重复来源；"drop" 直接丢弃
+                     ("merge" records duplicate sources on the kept chunk; "drop" just discards)
+    :return: (去重后的块, 统计报告) ((deduplicated chunks, report))
+    """
+    if strategy not in ("merge", "drop"):
+        raise ValueError(f"不支持的去重策略: {strategy} (Unsupported strategy)")
+
+    groups = find_duplicate_groups(
+        [chunk.page_content for chunk in chunks],
+        threshold=threshold,
+        num_perm=num_perm,
+        bands=bands,
+        shingle_size=shingle_size
+    )
+
+    kept: Dict[int, Document] = {}
+    duplicate_groups = 0
+    for members in groups:
+        head = chunks[members[0]]
+        if len(members) == 1 or strategy == "drop":
+            kept[members[0]] = head
+            duplicate_groups += len(members) > 1
+            continue
+
+        duplicate_groups += 1
+        own_source = head.metadata.get("source")
+        duplicate_sources = sorted({
+            str(chunks[i].metadata.get("source"))
+            for i in members[1:]
+            if chunks[i].metadata.get("source") not in (None, own_source)
+        })
+        metadata: Dict[str, Any] = {**head.metadata, "duplicate_count": len(members) - 1}
+        if duplicate_sources:
+            metadata["duplicate_sources"] = duplicate_sources
+        kept[members[0]] = Document(page_content=head.page_content, metadata=metadata, id=head.id)
+
+    deduplicated = [kept[i] for i in sorted(kept)]
+    report = DedupReport(
+        input_chunks=len(chunks),
+        output_chunks=len(deduplicated),
+        duplicate_groups=duplicate_groups
+    )
+    logger.info(
+        f"去重完成: {report.input_chunks} -> {report.output_chunks} 个文本块 "
+        f"(减少 {report.reduction_ratio:.1%}, {report.duplicate_groups} 个重复组)。"
+    )
+    return deduplicated, report
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+共享本地嵌入服务 (Shared local embedding server)
+
+每个模型在服务进程中只加载一次，所有客户端 (摄取与查询) 的嵌入请求
+被合并为动态批次：批次在达到 max_batch_size 条文本或等待 max_wait_ms 后提交，
+从而降低每个 worker 的内存占用，并用更大的批次提高吞吐量。
+
+服务通过 HTTP 提供，可监听 TCP 端口或 Unix 套接字：
+    POST /embed   {"model": "huggingface", "texts": [...], "kind": "documents" | "query"}
+                  -> {"embeddings": [[...], ...]}
+    GET  /health  -> 已加载模型与批处理统计 (Loaded models and batching stats)
+
+用法 (Usage):
+    python embedding_server.py --socket /tmp/rag-embed.sock
+    python embedding_server.py --port 8765 --model huggingface --max-batch-size 128 --max-wait-ms 5
+
+客户端 (Client):
+    setup_vector_store(chunks, embedding_name="remote:huggingface")
+    # 服务地址由 RAG_EMBEDDING_SERVER 指定，默认 http://127.0.0.1:8765
+    # (Server address comes from RAG_EMBEDDING_SERVER, default http://127.0.0.1:8765)
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import logging
+import argparse
+import threading
+import http.client
+import socketserver
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Any, Dict, Callable, Tuple
+from urllib.parse import urlparse
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("AgentTools")
+
+DEFAULT_ENDPOINT = "http://127.0.0.1:8765"
+ENDPOINT_ENV = "RAG_EMBEDDING_SERVER"
+
+
+# --- 服务端 (Server) ---
+
+class DynamicBatcher:
+    """
+    动态批处理器 (Dynamic batcher)
+
+    后台线程从队列取请求，凑满 max_batch_size 条文本或首个请求等待超过
+    max_wait_ms 后，对整批文本做一次前向计算，再把结果按请求拆分返回。
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]], max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        """
+        :param embed_fn: 批量嵌入函数 (Batch embedding function)
+        :param max_batch_size: 每批最多文本数 (Max texts per batch)
+        :param max_wait_ms: 首个请求的最长等待时间 (Max wait for the first request in a batch)
+        """
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        self._queue.put((texts, future))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._execute(batch)
+
+    def _execute(self, batch: List[Tuple[List[str], Future]]) -> None:
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        try:
+            vectors = self.embed_fn(texts) if texts else []
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.texts += len(texts)
+        start = 0
+        for request_texts, future in batch:
+            future.set_result(vectors[start:start + len(request_texts)])
+            start += len(request_texts)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+
+def _default_model_loader(model_name: str) -> Embeddings:
+    from rag_pipeline import build_embeddings
+
+    if model_name.lower().startswith("remote"):
+        raise ValueError(f"嵌入服务不能加载远程模型: {model_name} (The server cannot load a remote model)")
+    return build_embeddings(model_name)
+
+
+def _query_batch_fn(model: Embeddings) -> Callable[[List[str]], List[List[float]]]:
+    """
+    查询批处理函数 (Batch function for queries)
+
+    查询与文档分开批处理。模型声明了查询专用设置 (指令前缀或编码参数) 时逐条调用
+    embed_query，否则查询与文档编码相同，整批走 embed_documents。
+    (Queries are batched apart from documents. Models with query-specific settings call
+    embed_query per text; otherwise queries encode like documents and go through embed_documents.)
+    """
+    if any(getattr(model, attr, None) for attr in ("query_encode_kwargs", "query_instruction")):
+        return lambda texts: [model.embed_query(text) for text in texts]
+    return model.embed_documents
+
+
+class EmbeddingService:
+    """
+    模型注册表：每个模型加载一次，每个 (模型, 类型) 一个批处理器
+    (Model registry: each model is loaded once, with one batcher per (model, kind))
+    """
+
+    def __init__(
+        self,
+        model_loader: Callable[[str], Embeddings] = _default_model_loader,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        preload: Optional[List[str]] = None
+    ):
+        self.model_loader = model_loader
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._models: Dict[str, Embeddings] = {}
+        self._batchers: Dict[Tuple[str, str], DynamicBatcher] = {}
+        self._lock = threading.Lock()
+        for model_name in preload or []:
+            self._get_batcher(model_name, "documents")
+
+    def _get_batcher(self, model_name: str, kind: str) -> DynamicBatcher:
+        with self._lock:
+            batcher = self._batchers.get((model_name, kind))
+            if batcher is not None:
+                return batcher
+            model = self._models.get(model_name)
+            if model is None:
+                logger.info(f"嵌入服务正在加载模型: {model_name}")
+                model = self._models[model_name] = self.model_loader(model_name)
+            embed_fn = _query_batch_fn(model) if kind == "query" else model.embed_documents
+            batcher = self._batchers[(model_name, kind)] = DynamicBatcher(embed_fn, self.max_batch_size, self.max_wait_ms)
+            return batcher
+
+    def embed(self, model_name: str, texts: List[str], kind: str = "documents", timeout: Optional[float] = None) -> List[List[float]]:
+        if kind not in ("documents", "query"):
+            raise ValueError(f"不支持的嵌入类型: {kind} (Unsupported embedding kind)")
+        return self._get_batcher(model_name, kind).submit(texts).result(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "models": sorted(self._models),
+            "batchers": {f"{name}/{kind}": batcher.stats() for (name, kind), batcher in self._batchers.items()},
+        }
+
+
+class _EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service: EmbeddingService = None
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path != "/health":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        self._send_json(200, {"status": "ok", **self.service.stats()})
+
+    def do_POST(self) -> None:
+        if self.path != "/embed":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            vectors = self.service.embed(request["model"], list(request["texts"]), request.get("kind", "documents"))
+        except KeyError as e:
+            self._send_json(400, {"error": f"missing field {e}"})
+            return
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            logger.error(f"嵌入请求失败: {e}")
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, {"embeddings": [list(map(float, v)) for v in vectors]})
+
+    def address_string(self) -> str:
+        # Unix 套接字没有客户端地址 (Unix sockets have no client address)
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("embedding-server %s - %s", self.address_string(), format % args)
+
+
+# 默认 listen 队列只有 5，大量 worker 同时连接时会被拒绝 (The default backlog of 5 refuses bursts of workers)
+_LISTEN_BACKLOG = 128
+
+
+class _TCPHTTPServer(ThreadingHTTPServer):
+    request_queue_size = _LISTEN_BACKLOG
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = _LISTEN_BACKLOG
+
+
+def create_server(
+    service: EmbeddingService,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: Optional[str] = None
+) -> socketserver.BaseServer:
+    """
+    创建 HTTP 服务 (Create the HTTP server); 指定 socket_path 时监听 Unix 套接字
+    """
+    handler = type("EmbeddingRequestHandler", (_EmbeddingRequestHandler,), {"service": service})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return _UnixHTTPServer(socket_path, handler)
+    return _TCPHTTPServer((host, port), handler)
+
+
+# --- 客户端 (Client) ---
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RemoteEmbeddings(Embeddings):
+    """
+    共享嵌入服务的客户端 (Client for the shared embedding server)
+
+    :param model_name: 服务端模型名称 (Model name on the server), 如 "huggingface" 或本地模型路径
+    :param endpoint: "http://host:port" 或 "unix:///path/to.sock"，默认读取 RAG_EMBEDDING_SERVER
+    :param request_size: 每个请求最多携带的文本数，大批量摄取会被拆分，以便与查询交错
+                         (Max texts per request; large ingests are split so queries can interleave)
+    :param timeout: 请求超时秒数 (Request timeout in seconds)
+    """
+
+    def __init__(self, model_name: str = "huggingface", endpoint: Optional[str] = None, request_size: int = 256, timeout: float = 60.0):
+        self.model_name = model_name
+        self.endpoint = endpoint or os.environ.get(ENDPOINT_ENV, DEFAULT_ENDPOINT)
+        self.request_size = request_size
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        # 每个线程复用一个长连接 (One keep-alive connection per thread)
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            parsed = urlparse(self.endpoint)
+            if parsed.scheme == "unix":
+                connection = _UnixHTTPConnection(parsed.path, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _post(self, texts: List[str], kind: str) -> List[List[float]]:
+        body = json.dumps({"model": self.model_name, "texts": texts, "kind": kind})
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request("POST", "/embed", body=body, headers={"Content-Type": "application/json"})
+                response = connection.getresponse()
+                payload = json.loads(response.read())
+                break
+            except (ConnectionError, http.client.HTTPException):
+                # 服务端关闭了空闲连接时重连一次 (Reconnect once if the server closed an idle connection)
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise RuntimeError(f"嵌入服务返回错误 {response.status}: {payload.get('error')}")
+        return payload["embeddings"]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.request_size):
+            vectors.extend(self._post(texts[start:start + self.request_size], "documents"))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._post([text], "query")[0]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Shared local embedding server with dynamic batching")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="TCP host")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port")
+    parser.add_argument("--socket", type=str, default=None, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--model", type=str, nargs="*", default=["huggingface"], help="Models to preload")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="Max texts per batch")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Max wait before a partial batch is run")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    service = EmbeddingService(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, preload=args.model)
+    server = create_server(service, args.host, args.port, args.socket)
+    logger.info(f"嵌入服务已启动: {args.socket or f'{args.host}:{args.port}'} (模型: {args.model})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
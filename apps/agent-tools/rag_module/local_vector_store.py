@@ -0,0 +1,587 @@
+"""
+本地进程内 ANN 向量索引 (In-process ANN vector index)
+
+基于 IVF (倒排文件) 的轻量向量存储，作为 Chroma 的替代后端：
+1. 向量以连续的 float32/float16 数组存储，检索时直接做矩阵运算。
+2. 持久化为 .npy 文件，加载时使用内存映射 (mmap)，几乎零启动成本。
+3. 每次查询可通过 nprobe 调整召回率与延迟的权衡。
+4. 可选 int8 / PQ 量化：用压缩编码做近似打分，再用全精度向量精排前若干候选。
+   全精度向量仍然保存在磁盘上供精排使用，量化缩小的是扫描时常驻内存的工作集，
+   不是磁盘占用；加载后全精度向量经 mmap 按需读取。
+5. 文本块正文与 metadata 存放在内存映射的 ChunkStore 中，只有最终结果才物化为 Document。
+6. 可按 metadata (路径前缀、扩展名、修改时间、租户) 预先过滤，只对候选行打分。
+
+实现了 LangChain 的 VectorStore 接口，因此 as_retriever() 等用法与 Chroma 一致。
+"""
+
+import os
+import json
+import uuid
+import shutil
+import logging
+from typing import List, Optional, Any, Dict, Iterable, Tuple, Callable, Union
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from quantization import QUANTIZERS, create_quantizer
+from chunk_store import ChunkStore, ChunkHandle
+from metadata_index import MetadataIndex, MetadataFilter
+
+logger = logging.getLogger("AgentTools")
+
+INDEX_META_FILE = "index.json"
+CHUNKS_PREFIX = "chunks"
+VECTORS_FILE = "vectors.npy"
+CENTROIDS_FILE = "centroids.npy"
+LIST_OFFSETS_FILE = "list_offsets.npy"
+LIST_MEMBERS_FILE = "list_members.npy"
+CODES_FILE = "codes.npy"
+QUANTIZER_FILE = "quantizer.npz"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2 归一化，使内积等价于余弦相似度 (L2-normalize so inner product equals cosine similarity)"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    """原子写入 .npy 文件 (Atomically write a .npy file)"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回得分最高的 k 个下标，按得分降序 (Indices of the k highest scores, descending)"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part])]
+
+
+def train_kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    n_iter: int = 20,
+    sample_size: int = 65536,
+    seed: int = 42
+) -> np.ndarray:
+    """
+    球面 K-Means 训练 IVF 质心 (Spherical k-means for IVF centroids)
+
+    :param vectors: 已归一化的向量 (Normalized vectors)
+    :param n_clusters: 质心数量 (Number of centroids)
+    :param n_iter: 迭代次数 (Lloyd iterations)
+    :param sample_size: 训练采样上限 (Max training sample size)
+    :param seed: 随机种子 (Random seed)
+    :return: 归一化的质心矩阵 (Normalized centroid matrix), shape (n_clusters, dim)
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(vectors, dtype=np.float32)
+    if len(data) > sample_size:
+        data = data[rng.choice(len(data), sample_size, replace=False)]
+
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = np.argmax(data @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        # 空簇重新随机初始化 (Re-seed empty clusters)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids.astype(np.float32)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    本地 IVF 向量存储 (Local IVF vector store)
+
+    向量量少于 min_index_size 时使用精确暴力检索；否则构建 IVF 索引，
+    查询时只扫描与查询最接近的 nprobe 个倒排列表。
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        persist_directory: Optional[str] = None,
+        dtype: str = "float32",
+        n_lists: Optional[int] = None,
+        nprobe: int = 8,
+        min_index_size: int = 1024,
+        quantization: Optional[str] = None,
+        pq_subspaces: int = 8,
+        rerank_factor: int = 4
+    ):
+        """
+        :param embedding: 嵌入模型 (Embedding model)
+        :param persist_directory: 持久化目录，None 表示仅内存 (Persistence directory, None for in-memory)
+        :param dtype: 向量存储精度 (Storage precision). "float32" 或 "float16"。
+        :param n_lists: IVF 倒排列表数量，None 时按 sqrt(N) 自动选择 (Number of IVF lists, auto if None)
+        :param nprobe: 默认每次查询扫描的列表数 (Default lists probed per query)
+        :param min_index_size: 低于此数量时不建索引 (Below this size, use exact search)
+        :param quantization: 量化方式 (Quantization). None, "int8" 或 "pq"。
+        :param pq_subspaces: PQ 子空间数量，即每个向量的编码字节数 (PQ subspaces = bytes per vector)
+        :param rerank_factor: 量化打分后取 k * rerank_factor 个候选用全精度精排，0 表示不精排
+                              (Exact re-score of the top k * rerank_factor approximate hits; 0 disables)
+        """
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"不支持的 dtype: {dtype} (Unsupported dtype)")
+        if quantization is not None and quantization not in QUANTIZERS:
+            raise ValueError(f"不支持的量化方式: {quantization} (Unsupported quantization)")
+        self._embedding = embedding
+        self.persist_directory = persist_directory
+        self.dtype = np.dtype(dtype)
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.min_index_size = min_index_size
+        self.quantization = quantization
+        self.pq_subspaces = pq_subspaces
+        self.rerank_factor = rerank_factor
+
+        if self.exists(persist_directory):
+            # 清空文本块会让已有的向量和 index.json 对不上 (Truncating the chunks would orphan the existing vectors)
+            raise ValueError(
+                f"目录中已有向量存储，请使用 LocalVectorStore.load(): {persist_directory} "
+                f"(Directory already holds a vector store; use LocalVectorStore.load())"
+            )
+
+        self._vectors = np.zeros((0, 0), dtype=self.dtype)
+        # 新建的存储从空文件开始；load() 会替换为已有的文本块存储
+        # (A new store starts from empty files; load() swaps in the existing chunk store)
+        self._chunks = ChunkStore(persist_directory, prefix=CHUNKS_PREFIX, truncate=True) if persist_directory else ChunkStore()
+        self._centroids: Optional[np.ndarray] = None
+        self._list_offsets: Optional[np.ndarray] = None
+        self._list_members: Optional[np.ndarray] = None
+        self._quantizer: Optional[Any] = None
+        self._codes: Optional[np.ndarray] = None
+        self._metadata_index: Optional[MetadataIndex] = None
+        self._index_dirty = False
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    # --- 写入 (Write path) ---
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        """
+        嵌入并添加文本 (Embed and add texts)
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+
+        vectors = np.asarray(self._embedding.embed_documents(texts), dtype=np.float32)
+        self.add_vectors(vectors, texts, metadatas, ids)
+        return ids
+
+    def add_vectors(
+        self,
+        vectors: np.ndarray,
+        texts: List[str],
+        metadatas: List[Dict[str, Any]],
+        ids: List[str]
+    ) -> None:
+        """
+        直接添加已计算好的向量 (Add precomputed vectors)
+
+        只标记索引待重建；写完一批后调用 persist() 落盘
+        (Only marks the index dirty; call persist() once after a batch of writes)
+        """
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32)).astype(self.dtype)
+        if len(self._vectors) == 0:
+            self._vectors = np.ascontiguousarray(vectors)
+        else:
+            self._vectors = np.concatenate([np.asarray(self._vectors), vectors], axis=0)
+        self._chunks.append(texts, metadatas, ids)
+        self._metadata_index = None
+        self._index_dirty = True
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> "LocalVectorStore":
+        """
+        从文本构建向量存储 (Build the store from texts)
+        """
+        store = cls(embedding=embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        if store.persist_directory:
+            store.persist()
+        return store
+
+    # --- 索引构建 (Index build) ---
+
+    def build_index(self) -> None:
+        """
+        构建 IVF 索引与量化编码 (Build the IVF index and quantized codes)
+        """
+        self._build_ivf()
+        self._build_quantizer()
+        self._index_dirty = False
+
+    def _build_quantizer(self) -> None:
+        """训练量化器并编码全部向量 (Train the quantizer and encode all vectors)"""
+        if self.quantization is None or len(self._vectors) == 0:
+            self._quantizer = None
+            self._codes = None
+            return
+        logger.info(f"正在训练 {self.quantization} 量化器: {len(self._vectors)} 个向量...")
+        self._quantizer = create_quantizer(self.quantization, self.pq_subspaces).train(self._vectors)
+        self._codes = self._quantizer.encode(self._vectors)
+
+    def _build_ivf(self) -> None:
+        """
+        训练 IVF 质心并按列表重排成员 (Train IVF centroids and group members by list)
+        """
+        count = len(self._vectors)
+        if count < self.min_index_size:
+            self._centroids = None
+            self._list_offsets = None
+            self._list_members = None
+            return
+
+        n_lists = self.n_lists or max(1, int(np.sqrt(count)))
+        n_lists = min(n_lists, count)
+        logger.info(f"正在构建 IVF 索引: {count} 个向量, {n_lists} 个列表...")
+
+        centroids = train_kmeans(self._vectors, n_lists)
+        assignments = np.empty(count, dtype=np.int64)
+        # 分批分配，避免一次性生成 N x L 的大矩阵 (Assign in batches to bound memory)
+        for start in range(0, count, 8192):
+            block = np.asarray(self._vectors[start:start + 8192], dtype=np.float32)
+            assignments[start:start + 8192] = np.argmax(block @ centroids.T, axis=1)
+
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+        self._centroids = centroids
+        self._list_members = order.astype(np.int64)
+        self._list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def _ensure_index(self) -> None:
+        if self._index_dirty:
+            self.build_index()
+
+    # --- 检索 (Search path) ---
+
+    def _candidate_ids(self, query: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        """
+        返回 nprobe 个最近列表中的候选下标；None 表示需要全量扫描
+        (Candidate row ids from the nprobe nearest lists; None means scan everything)
+        """
+        if self._centroids is None or nprobe >= len(self._centroids):
+            return None
+        probe = _top_k(self._centroids @ query, nprobe)
+        return np.concatenate([
+            self._list_members[self._list_offsets[i]:self._list_offsets[i + 1]] for i in probe
+        ])
+
+    @staticmethod
+    def _score(vectors: np.ndarray, query: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        """
+        计算内积得分；float16 按块转为 float32 以使用 BLAS
+        (Inner-product scores; float16 is upcast block by block so BLAS is used)
+        """
+        if vectors.dtype == np.float32:
+            return vectors @ query
+        scores = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), block_size):
+            block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+            scores[start:start + block_size] = block @ query
+        return scores
+
+    def _rank(self, query: np.ndarray, k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        在候选行中取前 k 个 (Top-k among candidate rows)
+
+        启用量化时先用编码做非对称近似打分，再从 mmap 的全精度向量中
+        读取前 k * rerank_factor 个候选精确重排。
+        (With quantization, score the codes asymmetrically, then exactly re-score
+        the top k * rerank_factor candidates from the full-precision vectors.)
+
+        :return: (行号, 得分) ((rows, scores))
+        """
+        if self._quantizer is None:
+            vectors = self._vectors if rows is None else self._vectors[rows]
+            scores = self._score(vectors, query)
+            best = _top_k(scores, k)
+            return (best if rows is None else rows[best]), scores[best]
+
+        codes = self._codes if rows is None else self._codes[rows]
+        approx = self._quantizer.score(codes, query)
+        if self.rerank_factor <= 0:
+            best = _top_k(approx, k)
+            return (best if rows is None else rows[best]), approx[best]
+
+        shortlist = _top_k(approx, k * self.rerank_factor)
+        # 排序后按顺序读取 mmap，减少随机 I/O (Sorted rows give sequential mmap reads)
+        shortlist_rows = np.sort(shortlist if rows is None else rows[shortlist])
+        exact = self._score(self._vectors[shortlist_rows], query)
+        best = _top_k(exact, k)
+        return shortlist_rows[best], exact[best]
+
+    @property
+    def metadata_index(self) -> MetadataIndex:
+        """metadata 索引，首次过滤查询时构建 (Metadata index, built on the first filtered query)"""
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex(self._chunks.get_metadata(row) for row in range(len(self._chunks)))
+        return self._metadata_index
+
+    def search_by_vector_with_scores(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        nprobe: Optional[int] = None,
+        candidate_ids: Optional[np.ndarray] = None,
+        filter: Optional[Union[MetadataFilter, Dict[str, Any]]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        按向量检索，返回 (行号, 余弦相似度) (Search by vector, returning (row, cosine similarity))
+
+        :param embedding: 查询向量 (Query vector)
+        :param k: 返回数量 (Number of results)
+        :param nprobe: 本次查询扫描的列表数，越大召回越高但越慢 (Lists to probe; higher = better recall, slower)
+        :param candidate_ids: 限定候选行号 (Restrict the search to these rows)
+        :param filter: metadata 过滤条件；命中的行直接精确打分，不经过 IVF
+                       (Metadata filter; matching rows are scored exactly, bypassing IVF)
+        """
+        if len(self) == 0:
+            return []
+        self._ensure_index()
+
+        filtered = self.metadata_index.candidates(filter) if filter is not None else None
+        if filtered is not None:
+            candidate_ids = filtered if candidate_ids is None else np.intersect1d(filtered, candidate_ids)
+
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        if candidate_ids is None:
+            candidate_ids = self._candidate_ids(query, nprobe or self.nprobe)
+
+        if candidate_ids is not None and len(candidate_ids) == 0:
+            return []
+        rows, scores = self._rank(query, k, candidate_ids)
+        return [(int(row), float(score)) for row, score in zip(rows, scores)]
+
+    def _to_document(self, row: int) -> Document:
+        return self._chunks.get_document(row)
+
+    def similarity_search_handles(self, query: str, k: int = 4, **kwargs: Any) -> List[ChunkHandle]:
+        """
+        返回轻量句柄 (行号 + 余弦相似度)，正文在调用 to_document() 时才读取
+        (Returns lightweight handles (row + cosine similarity); text is read only on to_document())
+        """
+        embedding = self._embedding.embed_query(query)
+        return [self._chunks.handle(row, score) for row, score in self.search_by_vector_with_scores(embedding, k, **kwargs)]
+
+    def get_by_ids(self, ids: List[str], /) -> List[Document]:
+        rows = (self._chunks.row_of(doc_id) for doc_id in ids)
+        return [self._to_document(row) for row in rows if row is not None]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [self._to_document(row) for row, _ in self.search_by_vector_with_scores(embedding, k, **kwargs)]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        """
+        返回 (文档, 余弦距离)，距离越小越相似，与 Chroma 的语义一致
+        (Returns (document, cosine distance); lower is closer, matching Chroma)
+        """
+        return [
+            (self._to_document(row), max(0.0, 1.0 - score))
+            for row, score in self.search_by_vector_with_scores(embedding, k, **kwargs)
+        ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    # --- 持久化 (Persistence) ---
+
+    def persist(self, persist_directory: Optional[str] = None) -> None:
+        """
+        将向量、索引和文档写入磁盘 (Write vectors, index and documents to disk)
+        """
+        directory = persist_directory or self.persist_directory
+        if not directory:
+            raise ValueError("未指定持久化目录 (No persist directory configured)")
+        os.makedirs(directory, exist_ok=True)
+        self._ensure_index()
+
+        _save_array(os.path.join(directory, VECTORS_FILE), self._vectors)
+        if self._centroids is not None:
+            _save_array(os.path.join(directory, CENTROIDS_FILE), self._centroids)
+            _save_array(os.path.join(directory, LIST_OFFSETS_FILE), self._list_offsets)
+            _save_array(os.path.join(directory, LIST_MEMBERS_FILE), self._list_members)
+        if self._quantizer is not None:
+            _save_array(os.path.join(directory, CODES_FILE), self._codes)
+            np.savez(os.path.join(directory, QUANTIZER_FILE), **self._quantizer.state())
+
+        # 持久化目录中的文本块在写入时已追加到磁盘 (Chunks in the persist directory were appended on write)
+        self._chunks.copy_to(directory, CHUNKS_PREFIX)
+
+        meta = {
+            "count": len(self),
+            "dim": int(self._vectors.shape[1]) if self._vectors.ndim == 2 else 0,
+            "dtype": self.dtype.name,
+            "n_lists": 0 if self._centroids is None else len(self._centroids),
+            "nprobe": self.nprobe,
+            "min_index_size": self.min_index_size,
+            "quantization": self.quantization,
+            "pq_subspaces": self.pq_subspaces,
+            "rerank_factor": self.rerank_factor,
+        }
+        with open(os.path.join(directory, INDEX_META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        logger.info(f"本地向量索引已持久化到 {directory} ({meta['count']} 个向量)。")
+
+    @classmethod
+    def load(cls, persist_directory: str, embedding: Embeddings, mmap: bool = True) -> "LocalVectorStore":
+        """
+        从磁盘加载向量存储 (Load the store from disk)
+
+        :param persist_directory: 持久化目录 (Persistence directory)
+        :param embedding: 嵌入模型 (Embedding model)
+        :param mmap: 是否以内存映射方式打开向量 (Open vectors as memory-mapped arrays)
+        """
+        with open(os.path.join(persist_directory, INDEX_META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        store = cls(
+            embedding=embedding,
+            dtype=meta["dtype"],
+            n_lists=meta["n_lists"] or None,
+            nprobe=meta["nprobe"],
+            min_index_size=meta["min_index_size"],
+            quantization=meta.get("quantization"),
+            pq_subspaces=meta.get("pq_subspaces", 8),
+            rerank_factor=meta.get("rerank_factor", 4)
+        )
+        store.persist_directory = persist_directory
+        mmap_mode = "r" if mmap else None
+        store._vectors = np.load(os.path.join(persist_directory, VECTORS_FILE), mmap_mode=mmap_mode)
+        if meta["n_lists"]:
+            store._centroids = np.load(os.path.join(persist_directory, CENTROIDS_FILE))
+            store._list_offsets = np.load(os.path.join(persist_directory, LIST_OFFSETS_FILE))
+            store._list_members = np.load(os.path.join(persist_directory, LIST_MEMBERS_FILE), mmap_mode=mmap_mode)
+        if store.quantization:
+            # 编码常驻内存，全精度向量仅在精排时经 mmap 读取 (Codes stay resident; full vectors are read via mmap for re-scoring)
+            store._codes = np.load(os.path.join(persist_directory, CODES_FILE))
+            with np.load(os.path.join(persist_directory, QUANTIZER_FILE)) as state:
+                store._quantizer = QUANTIZERS[store.quantization].from_state(dict(state))
+
+        store._chunks = ChunkStore(persist_directory, prefix=CHUNKS_PREFIX)
+        if len(store._chunks) > meta["count"]:
+            # 文本块写入即落盘，向量要到 persist() 才写入；丢弃上次未持久化的尾部
+            # (Chunks hit disk on append but vectors only on persist(); drop the unpersisted tail)
+            logger.warning(
+                f"丢弃 {len(store._chunks) - meta['count']} 个未持久化的文本块 ({persist_directory})"
+            )
+            store._chunks.truncate(meta["count"])
+        if len(store._chunks) != meta["count"]:
+            raise ValueError(
+                f"文本块数量 {len(store._chunks)} 与向量数量 {meta['count']} 不一致 (Chunk count does not match vector count)"
+            )
+        return store
+
+    def delete_collection(self) -> None:
+        """
+        删除持久化目录中的全部文件 (Delete everything in the persist directory)
+
+        与 Chroma 同名方法对应，分片重建时先清掉旧分片 (Mirrors Chroma so a shard rebuild can clear the old shard)
+        """
+        self._chunks.close()
+        if self.persist_directory and os.path.isdir(self.persist_directory):
+            shutil.rmtree(self.persist_directory)
+
+    @classmethod
+    def exists(cls, persist_directory: Optional[str]) -> bool:
+        """判断目录中是否已有持久化索引 (Whether a persisted index exists)"""
+        return bool(persist_directory) and os.path.exists(os.path.join(persist_directory, INDEX_META_FILE))
+
+    # --- 量化评估 (Quantization report) ---
+
+    def quantization_report(self, k: int = 10, n_queries: int = 100, seed: int = 42) -> Dict[str, Any]:
+        """
+        评估量化的召回率与内存节省 (Report recall@k and memory savings of the quantized store)
+
+        以库中随机向量为查询，与全精度暴力检索结果比较。
+        (Samples stored vectors as queries and compares against exact brute-force search.)
+
+        全精度向量为精排而保留，所以只有扫描工作集按 scan_compression_ratio 缩小；
+        resident_bytes 和 disk_bytes 给出包含保留向量在内的实际占用。
+        (Full vectors are kept for re-scoring, so only the scan working set shrinks by
+        scan_compression_ratio; resident_bytes and disk_bytes include the retained vectors.)
+
+        :param k: 召回评估的 k (k for recall@k)
+        :param n_queries: 查询样本数 (Number of sample queries)
+        :return: 包含 recall、内存与磁盘占用和压缩比的字典 (Dict with recall, memory and disk usage and compression ratios)
+        """
+        self._ensure_index()
+        if self._quantizer is None:
+            raise ValueError("未启用量化 (Quantization is not enabled)")
+
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(len(self._vectors), min(n_queries, len(self._vectors)), replace=False)
+        recall_approx, recall_rescored = [], []
+        for row in sample:
+            query = np.asarray(self._vectors[row], dtype=np.float32)
+            exact = set(_top_k(self._score(self._vectors, query), k).tolist())
+            approx = set(_top_k(self._quantizer.score(self._codes, query), k).tolist())
+            rescored = set(self._rank(query, k)[0].tolist())
+            recall_approx.append(len(exact & approx) / len(exact))
+            recall_rescored.append(len(exact & rescored) / len(exact))
+
+        full_bytes = int(len(self._vectors) * self._vectors.shape[1] * np.dtype(np.float32).itemsize)
+        stored_bytes = int(self._vectors.nbytes)
+        code_bytes = int(self._codes.nbytes + sum(v.nbytes for v in self._quantizer.state().values()))
+        # 加载后的全精度向量经 mmap 按需读取，不计入常驻内存 (Memory-mapped vectors are paged in on demand, not resident)
+        resident_bytes = code_bytes + (0 if isinstance(self._vectors, np.memmap) else stored_bytes)
+        disk_bytes = stored_bytes + code_bytes
+        report = {
+            "quantization": self.quantization,
+            "k": k,
+            "queries": len(sample),
+            f"recall@{k}": float(np.mean(recall_approx)),
+            f"recall@{k}_rescored": float(np.mean(recall_rescored)),
+            "float32_bytes": full_bytes,
+            "stored_vector_bytes": stored_bytes,
+            "code_bytes": code_bytes,
+            "resident_bytes": resident_bytes,
+            "disk_bytes": disk_bytes,
+            "scan_compression_ratio": full_bytes / code_bytes if code_bytes else 0.0,
+            "resident_compression_ratio": full_bytes / resident_bytes if resident_bytes else 0.0,
+            "disk_ratio": disk_bytes / full_bytes if full_bytes else 0.0,
+        }
+        logger.info(f"量化评估: {report}")
+        return report
@@ -0,0 +1,216 @@
+"""
+文本块 metadata 索引 (Chunk metadata index)
+
+在向量打分之前按 metadata 缩小候选集合，使带过滤条件的查询耗时与候选数量成正比：
+1. 来源路径前缀：行号按来源路径排序，前缀对应其中一段连续区间 (二分查找)。
+2. 修改时间范围：行号按 mtime 排序，时间范围同样是一段连续区间。
+3. 扩展名、租户：每个取值一个有序行号数组 (倒排表)。
+各条件的结果按从小到大的顺序求交集。
+"""
+
+import os
+import bisect
+import logging
+from datetime import datetime
+from dataclasses import dataclass
+from typing import List, Optional, Any, Dict, Iterable, Union
+
+import numpy as np
+
+logger = logging.getLogger("AgentTools")
+
+# 路径前缀上界的哨兵字符 (Sentinel for the upper bound of a path-prefix range)
+_PREFIX_END = "\U0010ffff"
+
+
+def _to_timestamp(value: Union[None, float, int, str]) -> Optional[float]:
+    """接受时间戳或 ISO 日期字符串 (Accept a timestamp or an ISO date string)"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def _normalize_extension(extension: str) -> str:
+    extension = extension.strip().lower()
+    return extension if extension.startswith(".") else "." + extension
+
+
+@dataclass
+class MetadataFilter:
+    """
+    metadata 过滤条件，各字段为 None 时不限制 (Metadata filter; None fields are unconstrained)
+
+    :param source_prefix: 来源路径前缀，如 "docs/ops/" (Source path prefix)
+    :param extensions: 允许的扩展名，如 [".md", "pdf"] (Allowed file extensions)
+    :param modified_after: 最早修改时间，时间戳或 ISO 日期 (Earliest mtime, timestamp or ISO date)
+    :param modified_before: 最晚修改时间 (Latest mtime)
+    :param tenant: 租户 (Tenant)
+    """
+    source_prefix: Optional[str] = None
+    extensions: Optional[List[str]] = None
+    modified_after: Union[None, float, str] = None
+    modified_before: Union[None, float, str] = None
+    tenant: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, value: Union["MetadataFilter", Dict[str, Any], None]) -> Optional["MetadataFilter"]:
+        if value is None or isinstance(value, cls):
+            return value
+        return cls(**value)
+
+    def is_empty(self) -> bool:
+        return not (self.source_prefix or self.extensions or self.tenant
+                    or self.modified_after not in (None, "") or self.modified_before not in (None, ""))
+
+    def cache_key(self) -> str:
+        """用于区分缓存命名空间的稳定字符串 (Stable string for cache namespaces)"""
+        if self.is_empty():
+            return ""
+        extensions = ",".join(sorted(_normalize_extension(e) for e in self.extensions or []))
+        return f"prefix={self.source_prefix or ''}|ext={extensions}|after={self.modified_after or ''}|before={self.modified_before or ''}|tenant={self.tenant or ''}"
+
+    def to_chroma_where(self) -> Optional[Dict[str, Any]]:
+        """
+        转换为 Chroma 的 where 条件 (Convert to a Chroma where clause)
+
+        Chroma 不支持字符串前缀匹配，source_prefix 需使用本地后端。
+        (Chroma has no string prefix operator; source_prefix needs the local backend.)
+        """
+        if self.source_prefix:
+            raise ValueError("Chroma 后端不支持 source_prefix 过滤，请使用本地后端 (source_prefix requires the local backend)")
+        clauses: List[Dict[str, Any]] = []
+        if self.extensions:
+            clauses.append({"extension": {"$in": [_normalize_extension(e) for e in self.extensions]}})
+        if self.tenant:
+            clauses.append({"tenant": {"$eq": self.tenant}})
+        if _to_timestamp(self.modified_after) is not None:
+            clauses.append({"mtime": {"$gte": _to_timestamp(self.modified_after)}})
+        if _to_timestamp(self.modified_before) is not None:
+            clauses.append({"mtime": {"$lte": _to_timestamp(self.modified_before)}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def file_metadata(source: str) -> Dict[str, Any]:
+    """
+    来源文件的可过滤属性：扩展名与修改时间 (Filterable file attributes: extension and mtime)
+    """
+    metadata: Dict[str, Any] = {"extension": os.path.splitext(source)[1].lower()}
+    try:
+        metadata["mtime"] = os.path.getmtime(source)
+    except OSError:
+        pass
+    return metadata
+
+
+class MetadataIndex:
+    """
+    文本块 metadata 的只读索引 (Read-only index over chunk metadata)
+    """
+
+    def __init__(self, metadatas: Iterable[Dict[str, Any]], tenant_key: str = "tenant"):
+        """
+        :param metadatas: 按行号顺序的 metadata (Metadata in row order)
+        :param tenant_key: 租户字段名 (Tenant metadata field)
+        """
+        sources: List[str] = []
+        mtimes: List[float] = []
+        categories: Dict[str, Dict[str, List[int]]] = {"extension": {}, "tenant": {}}
+        for row, metadata in enumerate(metadatas):
+            source = str(metadata.get("source", ""))
+            # 规范化路径，使 "./docs/a.txt" 与 "docs/a.txt" 一致 (Normalize so "./docs/a.txt" equals "docs/a.txt")
+            sources.append(os.path.normpath(source) if source else source)
+            mtimes.append(float(metadata.get("mtime", np.nan)))
+            extension = metadata.get("extension") or os.path.splitext(source)[1].lower()
+            categories["extension"].setdefault(extension, []).append(row)
+            tenant = metadata.get(tenant_key)
+            if tenant is not None:
+                categories["tenant"].setdefault(str(tenant), []).append(row)
+
+        self.size = len(sources)
+        # 按来源排序的行号，以及每个不同来源的起止位置 (Rows ordered by source, with per-source boundaries)
+        self._source_order = np.asarray(sorted(range(self.size), key=sources.__getitem__), dtype=np.int64)
+        self._unique_sources: List[str] = []
+        bounds: List[int] = []
+        for position, row in enumerate(self._source_order.tolist()):
+            if not self._unique_sources or sources[row] != self._unique_sources[-1]:
+                self._unique_sources.append(sources[row])
+                bounds.append(position)
+        bounds.append(self.size)
+        self._source_bounds = np.asarray(bounds, dtype=np.int64)
+
+        mtime_array = np.asarray(mtimes, dtype=np.float64)
+        known = np.flatnonzero(~np.isnan(mtime_array))
+        self._mtime_order = known[np.argsort(mtime_array[known], kind="stable")]
+        self._mtimes_sorted = mtime_array[self._mtime_order]
+
+        self._postings = {
+            field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.items()}
+            for field, values in categories.items()
+        }
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _source_range(self, low: str, high: str) -> np.ndarray:
+        start = bisect.bisect_left(self._unique_sources, low)
+        end = bisect.bisect_left(self._unique_sources, high)
+        return self._source_order[self._source_bounds[start]:self._source_bounds[end]]
+
+    def _source_prefix_rows(self, prefix: str) -> np.ndarray:
+        """
+        来源等于 prefix 或位于其目录下的行，按路径组件匹配 (Rows whose source is prefix or lies under it, matched by path component)
+
+        "ops" 匹配 "ops/a.txt"，但不匹配 "opsfoo/a.txt"。(“ops” matches “ops/a.txt” but not “opsfoo/a.txt”.)
+        """
+        prefix = os.path.normpath(prefix)
+        if prefix == os.curdir:
+            return self._source_order
+        directory = prefix if prefix.endswith(os.sep) else prefix + os.sep
+        under = self._source_range(directory, directory + _PREFIX_END)
+        if directory == prefix:
+            return under
+        return np.concatenate([self._source_range(prefix, prefix + "\0"), under])
+
+    def _mtime_rows(self, after: Optional[float], before: Optional[float]) -> np.ndarray:
+        start = 0 if after is None else np.searchsorted(self._mtimes_sorted, after, side="left")
+        end = len(self._mtimes_sorted) if before is None else np.searchsorted(self._mtimes_sorted, before, side="right")
+        return self._mtime_order[start:end]
+
+    def _category_rows(self, field: str, values: Iterable[str]) -> np.ndarray:
+        postings = [self._postings[field][v] for v in values if v in self._postings[field]]
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+        return postings[0] if len(postings) == 1 else np.concatenate(postings)
+
+    def candidates(self, metadata_filter: Union[MetadataFilter, Dict[str, Any], None]) -> Optional[np.ndarray]:
+        """
+        返回满足条件的有序行号；None 表示没有过滤条件
+        (Sorted rows matching the filter; None means no filter was given)
+        """
+        metadata_filter = MetadataFilter.from_dict(metadata_filter)
+        if metadata_filter is None or metadata_filter.is_empty():
+            return None
+
+        sets: List[np.ndarray] = []
+        if metadata_filter.source_prefix:
+            sets.append(self._source_prefix_rows(metadata_filter.source_prefix))
+        if metadata_filter.extensions:
+            sets.append(self._category_rows("extension", {_normalize_extension(e) for e in metadata_filter.extensions}))
+        if metadata_filter.tenant:
+            sets.append(self._category_rows("tenant", [metadata_filter.tenant]))
+        after, before = _to_timestamp(metadata_filter.modified_after), _to_timestamp(metadata_filter.modified_before)
+        if after is not None or before is not None:
+            sets.append(self._mtime_rows(after, before))
+
+        # 从最小的集合开始求交集 (Intersect starting from the smallest set)
+        sets.sort(key=len)
+        result = np.sort(sets[0])
+        for rows in sets[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, rows, assume_unique=True)
+        return result
@@ -0,0 +1,187 @@
+"""
+向量量化 (Vector quantization)
+
+为 LocalVectorStore 提供压缩存储：
+- ScalarQuantizer: 按维度的 8 位标量量化，编码约为 float32 的 1/4。
+- ProductQuantizer: 乘积量化，每个子空间 256 个码字，编码为 float32 的 1/8~1/16 以下。
+
+两者都使用非对称距离计算 (ADC)：查询保持全精度，只有库中向量被量化。
+全精度向量仍然保留用于精排，压缩的是扫描工作集而不是磁盘占用。
+"""
+
+import logging
+from typing import Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger("AgentTools")
+
+
+def train_kmeans_l2(
+    data: np.ndarray,
+    n_clusters: int,
+    n_iter: int = 20,
+    sample_size: int = 65536,
+    seed: int = 42
+) -> np.ndarray:
+    """
+    欧氏距离 K-Means (Euclidean k-means)
+
+    :param data: 训练数据 (Training data), shape (N, dim)
+    :param n_clusters: 质心数量 (Number of centroids)
+    :return: 质心矩阵 (Centroid matrix), shape (n_clusters, dim)
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    if len(data) > sample_size:
+        data = data[rng.choice(len(data), sample_size, replace=False)]
+
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    data_sq = np.sum(data ** 2, axis=1, keepdims=True)
+    for _ in range(n_iter):
+        distances = data_sq - 2 * data @ centroids.T + np.sum(centroids ** 2, axis=1)
+        assignments = np.argmin(distances, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+            counts[empty] = 1
+        centroids = sums / counts[:, np.newaxis]
+    return centroids.astype(np.float32)
+
+
+class ScalarQuantizer:
+    """
+    按维度 8 位标量量化 (Per-dimension 8-bit scalar quantizer)
+
+    x ≈ vmin + scale * code，因此 q·x ≈ q·vmin + (q * scale)·code。
+    """
+
+    kind = "int8"
+
+    def __init__(self, vmin: Optional[np.ndarray] = None, scale: Optional[np.ndarray] = None):
+        self.vmin = vmin
+        self.scale = scale
+
+    def train(self, vectors: np.ndarray) -> "ScalarQuantizer":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.vmin = vectors.min(axis=0)
+        vmax = vectors.max(axis=0)
+        self.scale = np.maximum(vmax - self.vmin, 1e-12) / 255.0
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes = np.rint((vectors - self.vmin) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.vmin + codes.astype(np.float32) * self.scale
+
+    def score(self, codes: np.ndarray, query: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        """
+        非对称内积得分 (Asymmetric inner-product scores)
+        """
+        offset = float(query @ self.vmin)
+        weights = (query * self.scale).astype(np.float32)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), block_size):
+            block = np.asarray(codes[start:start + block_size], dtype=np.float32)
+            scores[start:start + block_size] = block @ weights + offset
+        return scores
+
+    def code_size(self, dim: int) -> int:
+        """每个向量的编码字节数 (Bytes per encoded vector)"""
+        return dim
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"vmin": self.vmin, "scale": self.scale}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "ScalarQuantizer":
+        return cls(vmin=state["vmin"], scale=state["scale"])
+
+
+class ProductQuantizer:
+    """
+    乘积量化 (Product quantizer)
+
+    把向量切成 n_subspaces 段，每段用 256 个码字中最近的一个 (1 字节) 表示。
+    查询时先为每段计算 查询段·码字 的查找表，得分为各段查表结果之和。
+    """
+
+    kind = "pq"
+
+    def __init__(self, n_subspaces: int = 8, codebooks: Optional[np.ndarray] = None):
+        self.n_subspaces = n_subspaces
+        self.codebooks = codebooks
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        n, dim = vectors.shape
+        if dim % self.n_subspaces != 0:
+            raise ValueError(f"向量维度 {dim} 必须能被子空间数 {self.n_subspaces} 整除 (dim must divide evenly)")
+        return vectors.reshape(n, self.n_subspaces, dim // self.n_subspaces)
+
+    def train(self, vectors: np.ndarray) -> "ProductQuantizer":
+        parts = self._split(np.asarray(vectors, dtype=np.float32))
+        n_codes = min(256, len(parts))
+        self.codebooks = np.stack([
+            train_kmeans_l2(parts[:, j, :], n_codes, seed=42 + j) for j in range(self.n_subspaces)
+        ])
+        return self
+
+    def encode(self, vectors: np.ndarray, block_size: int = 16384) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes = np.empty((len(vectors), self.n_subspaces), dtype=np.uint8)
+        codebook_sq = np.sum(self.codebooks ** 2, axis=2)
+        for start in range(0, len(vectors), block_size):
+            parts = self._split(vectors[start:start + block_size])
+            for j in range(self.n_subspaces):
+                distances = codebook_sq[j] - 2 * parts[:, j, :] @ self.codebooks[j].T
+                codes[start:start + block_size, j] = np.argmin(distances, axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = self.codebooks[np.arange(self.n_subspaces), codes]
+        return parts.reshape(len(codes), -1)
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        非对称内积得分 (ADC inner-product scores via per-subspace lookup tables)
+        """
+        query_parts = self._split(query[np.newaxis, :])[0]
+        table = np.einsum("jcd,jd->jc", self.codebooks, query_parts)
+        return table[np.arange(self.n_subspaces), np.asarray(codes)].sum(axis=1, dtype=np.float32)
+
+    def code_size(self, dim: int) -> int:
+        return self.n_subspaces
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "ProductQuantizer":
+        codebooks = state["codebooks"]
+        return cls(n_subspaces=codebooks.shape[0], codebooks=codebooks)
+
+
+QUANTIZERS = {
+    ScalarQuantizer.kind: ScalarQuantizer,
+    ProductQuantizer.kind: ProductQuantizer,
+}
+
+
+def create_quantizer(kind: str, n_subspaces: int = 8):
+    """
+    按名称创建量化器 (Create a quantizer by name)
+
+    :param kind: "int8" 或 "pq"
+    :param n_subspaces: PQ 子空间数量 (Number of PQ subspaces)
+    """
+    if kind == ScalarQuantizer.kind:
+        return ScalarQuantizer()
+    if kind == ProductQuantizer.kind:
+        return ProductQuantizer(n_subspaces=n_subspaces)
+    raise ValueError(f"不支持的量化方式: {kind} (Unsupported quantization)")
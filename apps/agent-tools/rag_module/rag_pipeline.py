@@ -1,20 +1,29 @@
+from __future__ import annotations
+
 import re
 import os
+import sys
+import time
 import logging
-from typing import List, Optional, Any, Dict, Union
-from langchain_community.document_loaders import DirectoryLoader
+from typing import TYPE_CHECKING, List, Optional, Any, Dict, Union, Tuple
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import LLMChainExtractor
-from langchain.chains import RetrievalQA
-from langchain_core.prompts import PromptTemplate
-from langchain.tools import tool
-from langchain_core.messages import ToolMessage
-from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.tools import tool
+
+# 重型依赖 (langchain_openai, langchain_huggingface, Chroma, 检索器等) 在首次使用时才导入，
+# 使仅需 clean_text_function 等轻量函数的短生命周期进程快速启动。
+# (Heavy backends are imported on first use so short-lived workers start fast.)
+if TYPE_CHECKING:
+    from langchain_core.vectorstores import VectorStore
+    from langchain.retrievers import ContextualCompressionRetriever
+    from langchain.chains import RetrievalQA
+    from local_vector_store import LocalVectorStore
+    from sharded_store import ShardedVectorStore
+    from semantic_cache import SemanticAnswerCache
+    from bm25_index import BM25Index
+    from metadata_index import MetadataFilter
+
+# 同目录下的扩展模块 (Sibling modules in this directory)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # 配置日志 (Configure Logging)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -74,7 +83,13 @@ def clean_text_function(text: str) -> str:
 def load_and_clean_documents(directory_path: str) -> List[Document]:
     """
     加载并清洗文档 (Load and clean documents)
+
+    metadata 中会补充扩展名 (extension) 和修改时间 (mtime)，供检索时过滤。
+    (Adds extension and mtime to metadata for filtered retrieval.)
     """
+    from langchain_community.document_loaders import DirectoryLoader
+    from metadata_index import file_metadata
+
     logger.info(f"正在从 {directory_path} 加载文档...")
     loader = DirectoryLoader(directory_path, glob="**/*", silent_errors=True)
     documents = loader.load()
@@ -82,7 +97,8 @@ def load_and_clean_documents(directory_path: str) -> List[Document]:
     cleaned_documents = []
     for doc in documents:
         cleaned_content = clean_text_function(doc.page_content)
-        cleaned_documents.append(Document(page_content=cleaned_content, metadata=doc.metadata))
+        metadata = {**file_metadata(doc.metadata.get("source", "")), **doc.metadata}
+        cleaned_documents.append(Document(page_content=cleaned_content, metadata=metadata))
         
     logger.info(f"已加载并清洗 {len(cleaned_documents)} 个文档。")
     return cleaned_documents
@@ -105,6 +121,8 @@ def split_documents(
                                若为 None，则使用默认的递归分割逻辑 ["\n\n", "\n", " ", ""].
     :return: 分割后的文档块 (Split document chunks)
     """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     separators = separator_priority if separator_priority else ["\n\n", "\n", " ", ""]
     
     text_splitter = RecursiveCharacterTextSplitter(
@@ -122,47 +140,200 @@ def split_documents(
 
 # --- 3. Vector Store & Compression (向量存储与压缩) ---
 
+def build_embeddings(embedding_name: str = "openai") -> Any:
+    """
+    根据名称创建嵌入模型 (Create an embedding model by name)
+
+    :param embedding_name: 嵌入模型名称 (Embedding model name). 支持 "openai", "huggingface" 或自定义路径。
+                           "remote" 或 "remote:<模型>" 使用共享嵌入服务 (embedding_server.py)，
+                           地址由 RAG_EMBEDDING_SERVER 环境变量指定。
+                           ("remote" or "remote:<model>" uses the shared embedding server at RAG_EMBEDDING_SERVER.)
+    :return: Embeddings 实例 (Embeddings instance)
+    """
+    logger.info(f"正在初始化嵌入模型: {embedding_name}")
+
+    if embedding_name.lower().split(":", 1)[0] == "remote":
+        from embedding_server import RemoteEmbeddings
+        _, _, model_name = embedding_name.partition(":")
+        return RemoteEmbeddings(model_name=model_name or "huggingface")
+
+    if embedding_name.lower() == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings()
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    if embedding_name.lower() == "huggingface":
+        return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    else:
+        # 尝试作为本地路径加载 (Try loading as local path)
+        return HuggingFaceEmbeddings(model_name=embedding_name)
+
 def setup_vector_store(
     chunks: List[Document], 
     embedding_name: str = "openai",
     persist_directory: Optional[str] = None,
-    collection_name: str = "agent_knowledge_base"
-) -> Chroma:
+    collection_name: str = "agent_knowledge_base",
+    backend: str = "chroma",
+    backend_kwargs: Optional[Dict[str, Any]] = None,
+    shard_by: Optional[str] = None,
+    shard_options: Optional[Dict[str, Any]] = None,
+    shard_timeout: Optional[float] = 5.0
+) -> VectorStore:
     """
     设置向量存储 (Setup Vector Store)
     
     :param chunks: 文档块 (Document chunks)
-    :param embedding_name: 嵌入模型名称 (Embedding model name). 支持 "openai", "huggingface" 或自定义路径。
+    :param embedding_name: 嵌入模型名称 (Embedding model name). 支持 "openai", "huggingface", "remote:<模型>" 或自定义路径。
     :param persist_directory: 持久化目录 (Persistence directory).
     :param collection_name: 集合名称 (Collection name).
-    :return: Chroma 实例 (Chroma instance)
+    :param backend: 向量存储后端 (Vector store backend).
+                    - "chroma": Chroma 客户端 (Chroma client)
+                    - "local": 进程内 IVF 索引，mmap 持久化 (In-process IVF index with mmap persistence)
+    :param backend_kwargs: 传给后端的额外参数 (Extra backend arguments), 如 {"dtype": "float16", "nprobe": 8}。
+                           本地后端可用 {"quantization": "int8"} 或 {"quantization": "pq", "pq_subspaces": 48} 压缩存储。
+    :param shard_by: 分片方式 (Sharding strategy). None 表示单一集合；"directory"、"tenant" 或 "hash"
+                     把知识库拆分为可独立重建、并行查询的分片。
+                     (None = one collection; "directory", "tenant" or "hash" split it into shards
+                     that are rebuilt independently and queried in parallel.)
+    :param shard_options: 分片键参数 (Shard-key options), 如 {"n_shards": 16} 或 {"tenant_key": "org"}。
+    :param shard_timeout: 单个分片的查询超时秒数 (Per-shard query timeout in seconds)
+    :return: VectorStore 实例 (VectorStore instance)
     """
-    logger.info(f"正在初始化嵌入模型: {embedding_name}")
-    
-    if embedding_name.lower() == "openai":
-        embeddings = OpenAIEmbeddings()
-    elif embedding_name.lower() == "huggingface":
-        embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    embeddings = build_embeddings(embedding_name)
+    backend_kwargs = backend_kwargs or {}
+
+    if shard_by is not None:
+        from sharded_store import ShardedVectorStore, make_shard_key
+
+        shard_options = shard_options or {}
+        vector_store = ShardedVectorStore(
+            embedding=embeddings,
+            shard_factory=_shard_factory(embeddings, backend, persist_directory, collection_name, backend_kwargs),
+            shard_key=make_shard_key(shard_by, **shard_options),
+            shard_timeout=shard_timeout,
+            persist_directory=os.path.join(persist_directory, collection_name) if persist_directory else None,
+            strategy=shard_by,
+            shard_options=shard_options
+        )
+        vector_store.add_documents(chunks)
+        logger.info(f"分片向量存储设置完成 (后端: {backend}, 分片方式: {shard_by}, {len(vector_store.shards)} 个分片)。")
+        return vector_store
+
+    if backend == "local":
+        from local_vector_store import LocalVectorStore
+
+        # 本地后端按集合名分子目录持久化 (Local backend persists each collection in its own subdirectory)
+        local_directory = os.path.join(persist_directory, collection_name) if persist_directory else None
+        vector_store = LocalVectorStore(embedding=embeddings, persist_directory=local_directory, **backend_kwargs)
+        vector_store.add_documents(chunks)
+        if local_directory:
+            vector_store.persist()
+    elif backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+
+        vector_store = Chroma.from_documents(
+            documents=chunks,
+            embedding=embeddings,
+            collection_name=collection_name,
+            persist_directory=persist_directory,
+            **backend_kwargs
+        )
     else:
-        # 尝试作为本地路径加载 (Try loading as local path)
-        embeddings = HuggingFaceEmbeddings(model_name=embedding_name)
+        raise ValueError(f"不支持的向量存储后端: {backend} (Unsupported vector store backend)")
     
-    vector_store = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        collection_name=collection_name,
-        persist_directory=persist_directory
-    )
-    
-    logger.info(f"向量存储设置完成 (持久化: {persist_directory})。")
+    logger.info(f"向量存储设置完成 (后端: {backend}, 持久化: {persist_directory})。")
     return vector_store
 
+def _shard_factory(
+    embeddings: Any,
+    backend: str,
+    persist_directory: Optional[str],
+    collection_name: str,
+    backend_kwargs: Dict[str, Any]
+) -> Any:
+    """
+    返回 存储名 -> 空 VectorStore 的构造函数 (Return a storage name -> empty VectorStore factory)
+
+    本地后端每个分片一个子目录；Chroma 每个分片一个集合 "<collection>__<shard>"。
+    (Local backend: one subdirectory per shard; Chroma: one collection "<collection>__<shard>" per shard.)
+    """
+    if backend == "local":
+        from local_vector_store import LocalVectorStore
+
+        def create_local_shard(name: str) -> VectorStore:
+            directory = os.path.join(persist_directory, collection_name, name) if persist_directory else None
+            return LocalVectorStore(embedding=embeddings, persist_directory=directory, **backend_kwargs)
+        return create_local_shard
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+
+        def create_chroma_shard(name: str) -> VectorStore:
+            return Chroma(
+                collection_name=f"{collection_name}__{name}",
+                embedding_function=embeddings,
+                persist_directory=persist_directory,
+                **backend_kwargs
+            )
+        return create_chroma_shard
+    raise ValueError(f"不支持的向量存储后端: {backend} (Unsupported vector store backend)")
+
+def load_vector_store(
+    persist_directory: str,
+    embedding_name: str = "openai",
+    collection_name: str = "agent_knowledge_base",
+    shard_timeout: Optional[float] = 5.0
+) -> Union[LocalVectorStore, ShardedVectorStore]:
+    """
+    以内存映射方式加载已持久化的本地向量存储 (Load a persisted local vector store via mmap)
+
+    若集合是分片存储，则按分片清单加载全部分片 (Sharded collections are loaded from their shard manifest).
+
+    :param persist_directory: 持久化目录 (Persistence directory)
+    :param embedding_name: 嵌入模型名称，需与构建时一致 (Embedding model name, must match the build)
+    :param collection_name: 集合名称 (Collection name)
+    :param shard_timeout: 分片存储的单分片查询超时 (Per-shard query timeout for sharded collections)
+    :return: LocalVectorStore 或 ShardedVectorStore 实例
+    """
+    from local_vector_store import LocalVectorStore
+    from sharded_store import ShardedVectorStore
+
+    embeddings = build_embeddings(embedding_name)
+    directory = os.path.join(persist_directory, collection_name)
+    if ShardedVectorStore.exists(directory):
+        return ShardedVectorStore.load(
+            directory,
+            embedding=embeddings,
+            shard_loader=lambda name: LocalVectorStore.load(os.path.join(directory, name), embedding=embeddings),
+            shard_factory=_shard_factory(embeddings, "local", persist_directory, collection_name, {}),
+            shard_timeout=shard_timeout
+        )
+    return LocalVectorStore.load(directory, embedding=embeddings)
+
+def _backend_filter(vector_store: VectorStore, metadata_filter: MetadataFilter) -> Any:
+    """
+    把过滤条件转换为后端的格式：本地后端直接使用 metadata 索引，Chroma 使用 where 条件
+    (Convert the filter for the backend: the local backend uses its metadata index, Chroma a where clause)
+    """
+    from sharded_store import ShardedVectorStore
+
+    if isinstance(vector_store, ShardedVectorStore) and vector_store.shards:
+        return _backend_filter(next(iter(vector_store.shards.values())), metadata_filter)
+    if hasattr(vector_store, "metadata_index"):
+        return metadata_filter
+    return metadata_filter.to_chroma_where()
+
 def setup_compression_retriever(
-    vector_store: Chroma, 
+    vector_store: VectorStore, 
     llm: Any, 
     compressor_type: str = "LLMChainExtractor",
     k: int = 5, 
-    fetch_k: int = 20
+    fetch_k: int = 20,
+    search_kwargs: Optional[Dict[str, Any]] = None,
+    reranker_model: Optional[str] = None,
+    quantize_reranker: bool = False,
+    max_concurrency: int = 8,
+    compression_deadline: Optional[float] = 15.0,
+    metadata_filter: Optional[MetadataFilter] = None
 ) -> ContextualCompressionRetriever:
     """
     设置压缩检索器 (Setup Compression Retriever)
@@ -172,37 +343,81 @@ def setup_compression_retriever(
     :param compressor_type: 压缩器类型 (Compressor type). 
                             - "LLMChainExtractor": 效果好但慢 (High quality, slow)
                             - "FlashRank": 速度快适合大规模 (Fast, suitable for large scale)
-                            - "BGE-Reranker": 精度极高 (Very high precision)
+                            - "BGE-Reranker": 本地交叉编码器，单次批量打分 (Local cross-encoder, one batched pass)
     :param k: 最终返回结果数量 (Final return count). 控制最终展示给 LLM 的上下文数量。
     :param fetch_k: 初始检索数量 (Initial fetch count). 控制从向量库初筛的候选数量。
+    :param search_kwargs: 额外检索参数 (Extra search kwargs), 例如本地后端的 {"nprobe": 16} 用于调节召回/延迟。
+    :param reranker_model: 交叉编码器模型，None 时使用 bge-reranker-base (Cross-encoder model name)
+    :param quantize_reranker: 是否对交叉编码器做 int8 动态量化 (Use int8 dynamic quantization for the reranker)
+    :param max_concurrency: LLM 抽取的并发上限，1 表示串行 (Max concurrent LLM extraction calls; 1 = serial)
+    :param compression_deadline: 每个问题的压缩截止秒数，超时的文档回退为原文 (Per-question deadline in seconds)
+    :param metadata_filter: metadata 预过滤条件 (路径前缀、扩展名、修改时间、租户)，在向量打分前缩小候选集合
+                            (Metadata pre-filter narrowing candidates before vector scoring)
     :return: ContextualCompressionRetriever 实例
     """
-    base_retriever = vector_store.as_retriever(search_kwargs={"k": fetch_k})
+    from langchain.retrievers import ContextualCompressionRetriever
+    from langchain.retrievers.document_compressors import LLMChainExtractor
+    from compressors import CrossEncoderReranker, ConcurrentLLMChainExtractor
+
+    search_kwargs = {"k": fetch_k, **(search_kwargs or {})}
+    if metadata_filter is not None and not metadata_filter.is_empty():
+        search_kwargs["filter"] = _backend_filter(vector_store, metadata_filter)
+    base_retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
     
     logger.info(f"正在配置压缩器: {compressor_type} (fetch_k={fetch_k}, k={k})")
     
+    def build_llm_extractor() -> Any:
+        if max_concurrency <= 1:
+            return LLMChainExtractor.from_llm(llm)
+        return ConcurrentLLMChainExtractor.from_llm(
+            llm,
+            max_concurrency=max_concurrency,
+            deadline_seconds=compression_deadline
+        )
+
     if compressor_type == "LLMChainExtractor":
-        compressor = LLMChainExtractor.from_llm(llm)
+        compressor = build_llm_extractor()
     elif compressor_type == "FlashRank":
         # 需要安装 flashrank (Requires flashrank)
         from langchain.retrievers.document_compressors import FlashrankRerank
         compressor = FlashrankRerank(top_n=k)
     elif compressor_type == "BGE-Reranker":
-        # 示例：使用自定义 BGE 压缩器 (Example: using custom BGE compressor)
-        # 这里仅作示意，实际需根据具体库实现 (Placeholder for actual BGE implementation)
-        compressor = LLMChainExtractor.from_llm(llm) 
+        # 本地交叉编码器，一次批量前向替代逐文档 LLM 调用 (Local cross-encoder: one batched pass instead of per-document LLM calls)
+        compressor = CrossEncoderReranker(
+            top_n=k,
+            quantize=quantize_reranker,
+            **({"model_name": reranker_model} if reranker_model else {})
+        )
     else:
-        compressor = LLMChainExtractor.from_llm(llm)
+        compressor = build_llm_extractor()
 
     return ContextualCompressionRetriever(
         base_compressor=compressor, 
         base_retriever=base_retriever
     )
 
-def create_rag_chain(retriever: ContextualCompressionRetriever, llm: Any) -> RetrievalQA:
+# ask_with_rag 提示词中上下文的 token 预算 (Context token budget for ask_with_rag prompts)
+CONTEXT_TOKEN_BUDGET = 3000
+
+def create_rag_chain(
+    retriever: ContextualCompressionRetriever,
+    llm: Any,
+    context_token_budget: Optional[int] = CONTEXT_TOKEN_BUDGET
+) -> RetrievalQA:
     """
     创建 RAG 链 (Create RAG Chain)
+
+    :param retriever: 检索器 (Retriever)
+    :param llm: 语言模型 (LLM)
+    :param context_token_budget: 上下文 token 预算；检索结果去除块间重叠后按得分装入预算，None 表示全部拼接
+                                 (Context token budget; retrieved chunks are de-overlapped and packed by score.
+                                 None stuffs everything.)
     """
+    from langchain.chains import RetrievalQA
+    from langchain.retrievers import ContextualCompressionRetriever
+    from langchain_core.prompts import PromptTemplate
+    from context_packing import ContextPackingCompressor
+
     template = """
     你是一个专业的问答助手，请根据提供的上下文信息来回答问题。
     如果上下文中没有足够的信息，请回答“根据提供的资料，我无法回答这个问题。”
@@ -216,6 +431,12 @@ def create_rag_chain(retriever: ContextualCompressionRetriever, llm: Any) -> Ret
     回答:
     """
     QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
+
+    if context_token_budget is not None:
+        retriever = ContextualCompressionRetriever(
+            base_compressor=ContextPackingCompressor(token_budget=context_token_budget),
+            base_retriever=retriever
+        )
     
     return RetrievalQA.from_chain_type(
         llm=llm,
@@ -225,60 +446,258 @@ def create_rag_chain(retriever: ContextualCompressionRetriever, llm: Any) -> Ret
         chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
     )
 
+# --- 3.5 Semantic Answer Cache (语义答案缓存) ---
+
+_answer_cache: Optional[SemanticAnswerCache] = None
+_answer_cache_enabled: bool = True
+
+def configure_answer_cache(
+    embedding_name: str = "openai",
+    similarity_threshold: float = 0.92,
+    ttl_seconds: Optional[float] = 3600,
+    max_entries: int = 1024,
+    enabled: bool = True
+) -> Optional[SemanticAnswerCache]:
+    """
+    配置 ask_with_rag 使用的语义答案缓存 (Configure the semantic answer cache used by ask_with_rag)
+
+    :param embedding_name: 问题嵌入模型名称 (Embedding model name for questions)
+    :param similarity_threshold: 命中所需的最小余弦相似度 (Minimum cosine similarity for a hit)
+    :param ttl_seconds: 条目存活时间 (Entry TTL in seconds)
+    :param max_entries: 最大条目数 (Maximum entries)
+    :param enabled: 是否启用缓存 (Whether caching is enabled)
+    :return: 缓存实例，禁用时为 None (Cache instance, None when disabled)
+    """
+    from semantic_cache import SemanticAnswerCache
+
+    global _answer_cache, _answer_cache_enabled
+    _answer_cache_enabled = enabled
+    _answer_cache = SemanticAnswerCache(
+        embedding=build_embeddings(embedding_name),
+        similarity_threshold=similarity_threshold,
+        ttl_seconds=ttl_seconds,
+        max_entries=max_entries
+    ) if enabled else None
+    return _answer_cache
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """
+    获取语义答案缓存，首次使用时按默认配置创建 (Get the cache, creating it with defaults on first use)
+    """
+    if _answer_cache is None and _answer_cache_enabled:
+        configure_answer_cache()
+    return _answer_cache
+
+# --- 3.6 Keyword Index (关键词索引) ---
+
+# 目录 -> (索引版本, BM25 索引, 上次校验时间) (Directory -> (index version, BM25 index, last validated at))
+_keyword_indexes: Dict[str, Tuple[str, BM25Index, float]] = {}
+# 目录指纹需要遍历并 stat 全部文件，未指定版本时最多每隔这么久校验一次
+# (Fingerprinting walks and stats every file, so without an explicit version it runs at most this often)
+KEYWORD_INDEX_REVALIDATE_SECONDS = 30.0
+
+def get_keyword_index(
+    directory_path: str,
+    chunks: Optional[List[Document]] = None,
+    index_version: Optional[str] = None,
+    persist_directory: Optional[str] = None
+) -> BM25Index:
+    """
+    获取目录对应的 BM25 索引，目录内容变化时重建 (Get the BM25 index for a directory, rebuilt when it changes)
+
+    :param directory_path: 文档目录 (Document directory)
+    :param chunks: 已清洗分割的文本块，None 时按 RAG 流程加载 (Cleaned chunks; loaded via the RAG pipeline if None)
+    :param index_version: 目录版本，None 时按 KEYWORD_INDEX_REVALIDATE_SECONDS 节流重新计算
+                          (Directory version; if None it is recomputed at most every KEYWORD_INDEX_REVALIDATE_SECONDS)
+    :param persist_directory: 索引的保存目录；版本一致时直接从这里加载，否则重建后保存到这里
+                              (Index directory: loaded from when its version matches, else rebuilt and saved here)
+    :return: BM25Index 实例
+    """
+    from bm25_index import BM25Index
+    from dedup import deduplicate_chunks
+    from semantic_cache import directory_fingerprint
+
+    now = time.monotonic()
+    cached = _keyword_indexes.get(directory_path)
+    if index_version is None and cached is not None and now - cached[2] < KEYWORD_INDEX_REVALIDATE_SECONDS:
+        return cached[1]
+    index_version = index_version or directory_fingerprint(directory_path)
+    if cached is not None and cached[0] == index_version:
+        _keyword_indexes[directory_path] = (index_version, cached[1], now)
+    else:
+        index = BM25Index.load(persist_directory) if BM25Index.exists(persist_directory) else None
+        if index is None or index.version != index_version:
+            if chunks is None:
+                chunks, _ = deduplicate_chunks(split_documents(load_and_clean_documents(directory_path)))
+            index = BM25Index.from_documents(chunks)
+            index.version = index_version
+            if persist_directory:
+                index.save(persist_directory)
+            logger.info(f"已为 {directory_path} 建立 BM25 索引 ({len(index)} 个文本块)。")
+        _keyword_indexes[directory_path] = (index_version, index, now)
+    return _keyword_indexes[directory_path][1]
+
 # --- 4. Tool Definitions (工具定义) ---
 
 @tool("search_docs")
-def search_documents(query: str, limit: int = 5) -> str:
+def search_documents(query: str, directory_path: str, limit: int = 5) -> str:
     """
-    在内部文档库中搜索匹配的记录 (Search for matching records in the internal document library).
+    在内部文档库中按关键词 (BM25) 搜索匹配的文本块 (Keyword (BM25) search over the internal document library).
     
     :param query: 搜索查询语句 (Search query string)
+    :param directory_path: 文档所在目录 (Directory path of documents)
     :param limit: 返回结果的最大数量 (Maximum number of results to return)
-    :return: 搜索状态描述 (Search status description)
+    :return: 匹配结果列表 (Matching results)
     """
-    logger.info(f"调用 search_documents: query='{query}', limit={limit}")
-    return f"Found {limit} results for '{query}'"
+    logger.info(f"调用 search_documents: query='{query}', directory='{directory_path}', limit={limit}")
+    results = get_keyword_index(directory_path).search_documents(query, k=limit)
+    if not results:
+        return f"未找到与 '{query}' 匹配的结果。"
+
+    lines = [f"Found {len(results)} results for '{query}':"]
+    for rank, (doc, score) in enumerate(results, start=1):
+        snippet = doc.page_content[:200]
+        lines.append(f"[{rank}] {doc.metadata.get('source', 'unknown')} (score={score:.2f}): {snippet}")
+    return "\n".join(lines)
 
 @tool("ask_with_rag")
-def ask_with_rag(question: str, directory_path: str, runtime: Optional[ToolRuntime] = None) -> str:
+def ask_with_rag(
+    question: str,
+    directory_path: str,
+    runtime: Optional[ToolRuntime] = None,
+    source_prefix: Optional[str] = None,
+    file_types: Optional[List[str]] = None,
+    modified_after: Optional[str] = None,
+    modified_before: Optional[str] = None
+) -> str:
     """
     使用检索增强生成 (RAG) 回答问题 (Answer questions using Retrieval-Augmented Generation).
     
     :param question: 用户问题 (User question)
     :param directory_path: 文档所在目录 (Directory path of documents)
     :param runtime: 运行时环境，用于获取会话状态 (Runtime environment for session state)
+    :param source_prefix: 只检索该子路径下的文件，相对 directory_path (Only search files under this subpath of directory_path)
+    :param file_types: 只检索这些扩展名，如 ["md", "pdf"] (Only search these file extensions)
+    :param modified_after: 只检索此日期之后修改的文件，ISO 格式 (Only files modified after this ISO date)
+    :param modified_before: 只检索此日期之前修改的文件，ISO 格式 (Only files modified before this ISO date)
     :return: 包含答案和引用数量的字符串 (Answer with source count)
     """
+    from langchain_openai import ChatOpenAI
+    from dedup import deduplicate_chunks
+    from metadata_index import MetadataFilter, MetadataIndex
+    from semantic_cache import directory_fingerprint
+    from rag_tracing import get_tracer, TokenUsageHandler
+    from context_packing import pack_documents
+
     logger.info(f"开始 RAG 流程: 问题='{question}', 目录='{directory_path}'")
+    metadata_filter = MetadataFilter(
+        source_prefix=os.path.join(directory_path, source_prefix) if source_prefix else None,
+        extensions=file_types,
+        modified_after=modified_after,
+        modified_before=modified_before
+    )
+    # 不同过滤条件的答案分开缓存 (Answers under different filters are cached separately)
+    cache_namespace = directory_path
+    if not metadata_filter.is_empty():
+        cache_namespace = f"{directory_path}|{metadata_filter.cache_key()}"
+    session_id = runtime.state.get("session_id", "unknown") if runtime and runtime.state else "unknown"
+    tracer = get_tracer()
     
     try:
-        # 1. 加载与清洗 (Load & Clean)
-        docs = load_and_clean_documents(directory_path)
-        if not docs:
-            return "目录中未发现有效文档，请检查路径。"
-
-        # 2. 分割 (Split)
-        chunks = split_documents(docs)
-
-        # 3. 向量存储与检索 (Vector Store & Retriever)
-        llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
-        vector_store = setup_vector_store(chunks)
-        retriever = setup_compression_retriever(vector_store, llm)
-
-        # 4. 执行链 (Execute Chain)
-        rag_chain = create_rag_chain(retriever, llm)
-        logger.info("正在执行 RAG 链查询...")
-        result = rag_chain({"query": question})
-        
-        answer = result["result"]
-        source_count = len(result["source_documents"])
-        
-        # 示例：使用 runtime 访问状态 (Example: accessing state via runtime)
-        if runtime and runtime.state:
-            session_id = runtime.state.get("session_id", "unknown")
-            logger.info(f"会话 {session_id} 的 RAG 查询完成。")
+        with tracer.session(session_id), tracer.span("ask_with_rag") as request_span:
+            # 0. 语义缓存查询 (Semantic cache lookup)
+            with tracer.span("cache_lookup") as span:
+                cache = get_answer_cache()
+                index_version = directory_fingerprint(directory_path)
+                cached = None
+                if cache is not None:
+                    cached = cache.lookup(question, namespace=cache_namespace, index_version=index_version)
+                span.attributes["hit"] = cached is not None
+            if cached is not None:
+                request_span.attributes["cache_hit"] = True
+                return f"回答: {cached.answer}\n(引用文档数量: {len(cached.sources)})"
+
+            # 1. 加载与清洗 (Load & Clean)
+            with tracer.span("load_and_clean_documents") as span:
+                docs = load_and_clean_documents(directory_path)
+                span.items = len(docs)
+            if not docs:
+                return "目录中未发现有效文档，请检查路径。"
+
+            # 2. 分割并去除近重复块 (Split & drop near-duplicate chunks)
+            with tracer.span("split_documents") as span:
+                chunks = split_documents(docs)
+                span.items = len(chunks)
+            with tracer.span("deduplicate_chunks") as span:
+                corpus_chunks, report = deduplicate_chunks(chunks)
+                span.items = len(corpus_chunks)
+                span.attributes["reduction_ratio"] = report.reduction_ratio
+            # 同步刷新 search_docs 使用的关键词索引 (Refresh the keyword index used by search_docs)
+            get_keyword_index(directory_path, corpus_chunks, index_version)
+
+            # 按 metadata 预过滤，只对候选块做嵌入与检索 (Pre-filter by metadata; only candidates are embedded and searched)
+            # 过滤在去重之前进行：去重只保留每组的首块，其余来源不再参与过滤
+            # (Filter before dedup: dedup keeps only each group's head, so the other sources could no longer match)
+            if metadata_filter.is_empty():
+                chunks = corpus_chunks
+            else:
+                with tracer.span("metadata_filter") as span:
+                    rows = MetadataIndex(chunk.metadata for chunk in chunks).candidates(metadata_filter)
+                    span.attributes["corpus_chunks"] = len(chunks)
+                    chunks = [chunks[row] for row in rows]
+                    span.items = len(chunks)
+                if not chunks:
+                    return "没有符合过滤条件的文档，请调整过滤条件。"
+                with tracer.span("deduplicate_candidates") as span:
+                    chunks, _ = deduplicate_chunks(chunks)
+                    span.items = len(chunks)
+
+            # 3. 向量存储与检索 (Vector Store & Retriever)
+            llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo")
+            with tracer.span("setup_vector_store") as span:
+                vector_store = setup_vector_store(chunks)
+                span.items = len(chunks)
+            retriever = setup_compression_retriever(vector_store, llm)
+            rag_chain = create_rag_chain(retriever, llm, context_token_budget=CONTEXT_TOKEN_BUDGET)
 
-        return f"回答: {answer}\n(引用文档数量: {source_count})"
+            # 4. 分阶段执行链：检索 -> 压缩 -> LLM (Run the chain stage by stage: retrieve -> compress -> LLM)
+            with tracer.span("retrieval") as span:
+                candidates = retriever.base_retriever.invoke(question)
+                span.items = len(candidates)
+            with tracer.span("compression") as span:
+                usage = TokenUsageHandler()
+                source_documents = retriever.base_compressor.compress_documents(candidates, question, callbacks=[usage])
+                span.items = len(source_documents)
+                span.add_tokens(usage)
+            with tracer.span("context_packing") as span:
+                context_documents, packing = pack_documents(source_documents, token_budget=CONTEXT_TOKEN_BUDGET)
+                span.items = len(context_documents)
+                span.attributes["input_tokens"] = packing.input_tokens
+                span.attributes["context_tokens"] = packing.output_tokens
+            with tracer.span("llm") as span:
+                usage = TokenUsageHandler()
+                logger.info("正在执行 RAG 链查询...")
+                answer = rag_chain.combine_documents_chain.run(
+                    input_documents=context_documents,
+                    question=question,
+                    callbacks=[usage]
+                )
+                span.items = len(context_documents)
+                span.add_tokens(usage)
+
+            source_count = len(source_documents)
+
+            if cache is not None:
+                cache.store(
+                    question,
+                    answer,
+                    sources=[doc.metadata for doc in source_documents],
+                    namespace=cache_namespace,
+                    index_version=index_version
+                )
+
+            logger.info(f"会话 {session_id} 的 RAG 查询完成。")
+            return f"回答: {answer}\n(引用文档数量: {source_count})"
 
     except Exception as e:
         logger.error(f"RAG 流程出错: {str(e)}")
@@ -301,6 +720,8 @@ def wrap_tool_call(tool_func):
     包装工具调用，捕获异常并返回 ToolMessage (Wrap tool call to catch exceptions and return ToolMessage)
     """
     def wrapper(*args, **kwargs):
+        from langchain_core.messages import ToolMessage
+
         try:
             return tool_func(*args, **kwargs)
         except Exception as e:
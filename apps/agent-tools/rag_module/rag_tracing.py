@@ -0,0 +1,206 @@
+"""
+RAG 流程分阶段追踪 (Per-stage tracing for the RAG pipeline)
+
+每个阶段 (加载、分割、向量化、检索、压缩、LLM) 记录一个 span，包含耗时、
+条目数和 token 数，并关联 ToolRuntime.state 中的 session_id。span 会：
+1. 以 JSON 行写入日志 (及可选的追踪文件)。
+2. 导出为 Prometheus 直方图/计数器 (需安装 prometheus_client)。
+"""
+
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, Iterator, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+logger = logging.getLogger("AgentTools")
+trace_logger = logging.getLogger("AgentTools.Trace")
+
+try:
+    from prometheus_client import Counter, Histogram
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+_session_id: contextvars.ContextVar[str] = contextvars.ContextVar("rag_session_id", default="unknown")
+_trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("rag_trace_id", default=None)
+
+
+@dataclass
+class Span:
+    """单个阶段的追踪记录 (Trace record for one stage)"""
+    name: str
+    trace_id: str
+    session_id: str
+    start_time: float
+    duration_seconds: float = 0.0
+    items: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    status: str = "ok"
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def add_tokens(self, usage: "TokenUsageHandler") -> None:
+        """累加回调统计到的 token 数 (Add token counts collected by a callback)"""
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """
+    统计 LLM 调用 token 数的回调 (Callback that counts LLM token usage)
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        if not usage:
+            # 新版聊天模型把用量放在消息的 usage_metadata 上 (Newer chat models report usage_metadata)
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt += metadata.get("input_tokens", 0)
+                    completion += metadata.get("output_tokens", 0)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt
+            self.completion_tokens += completion
+
+
+class RagTracer:
+    """
+    RAG 阶段追踪器 (RAG stage tracer)
+    """
+
+    def __init__(self, trace_file: Optional[str] = None, enable_prometheus: bool = True):
+        """
+        :param trace_file: JSON 追踪行的输出文件，None 时只写日志 (File for JSON trace lines; log only if None)
+        :param enable_prometheus: 是否导出 Prometheus 指标 (Export Prometheus metrics)
+        """
+        self.trace_file = trace_file
+        self._file_lock = threading.Lock()
+        self._metrics = _prometheus_metrics() if enable_prometheus and PROMETHEUS_AVAILABLE else None
+        if enable_prometheus and not PROMETHEUS_AVAILABLE:
+            logger.warning("prometheus_client 未安装，Prometheus 指标不会导出 (pip install prometheus-client)")
+
+    @contextmanager
+    def session(self, session_id: Optional[str]) -> Iterator[str]:
+        """
+        为一次请求绑定 session_id 和 trace_id (Bind session_id and a new trace_id for one request)
+        """
+        session_token = _session_id.set(session_id or "unknown")
+        trace_token = _trace_id.set(uuid.uuid4().hex)
+        try:
+            yield _trace_id.get()
+        finally:
+            _trace_id.reset(trace_token)
+            _session_id.reset(session_token)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """
+        记录一个阶段 (Record one stage)
+
+        用法 (Usage):
+            with tracer.span("split_documents") as span:
+                chunks = split_documents(docs)
+                span.items = len(chunks)
+        """
+        span = Span(
+            name=name,
+            trace_id=_trace_id.get() or uuid.uuid4().hex,
+            session_id=_session_id.get(),
+            start_time=time.time(),
+            attributes=dict(attributes)
+        )
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception:
+            span.status = "error"
+            raise
+        finally:
+            span.duration_seconds = time.perf_counter() - start
+            self._export(span)
+
+    def _export(self, span: Span) -> None:
+        line = json.dumps(asdict(span), ensure_ascii=False, default=str)
+        trace_logger.info(line)
+        if self.trace_file:
+            with self._file_lock, open(self.trace_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+        if self._metrics is not None:
+            duration, items, tokens = self._metrics
+            duration.labels(stage=span.name, status=span.status).observe(span.duration_seconds)
+            items.labels(stage=span.name).observe(span.items)
+            if span.prompt_tokens:
+                tokens.labels(stage=span.name, kind="prompt").inc(span.prompt_tokens)
+            if span.completion_tokens:
+                tokens.labels(stage=span.name, kind="completion").inc(span.completion_tokens)
+
+
+_METRICS: Optional[tuple] = None
+
+
+def _prometheus_metrics() -> tuple:
+    """
+    进程级共享的 Prometheus 指标，避免重复注册 (Process-wide metrics, registered once)
+
+    session_id 不作为标签，以免基数爆炸；按会话分析请使用 JSON 追踪行。
+    (session_id is not a label to avoid cardinality blow-up; use the JSON trace lines per session.)
+    """
+    global _METRICS
+    if _METRICS is None:
+        _METRICS = (
+            Histogram(
+                "rag_stage_duration_seconds",
+                "Duration of RAG pipeline stages",
+                ["stage", "status"],
+                buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+            ),
+            Histogram(
+                "rag_stage_items",
+                "Items processed per RAG pipeline stage",
+                ["stage"],
+                buckets=(1, 5, 10, 20, 50, 100, 500, 1000, 5000, 10000, 50000)
+            ),
+            Counter(
+                "rag_stage_tokens_total",
+                "LLM tokens consumed per RAG pipeline stage",
+                ["stage", "kind"]
+            ),
+        )
+    return _METRICS
+
+
+_tracer: Optional[RagTracer] = None
+
+
+def configure_tracing(trace_file: Optional[str] = None, enable_prometheus: bool = True) -> RagTracer:
+    """
+    配置全局追踪器 (Configure the global tracer)
+    """
+    global _tracer
+    _tracer = RagTracer(trace_file=trace_file, enable_prometheus=enable_prometheus)
+    return _tracer
+
+
+def get_tracer() -> RagTracer:
+    """获取全局追踪器，首次使用时按默认配置创建 (Get the global tracer, created with defaults on first use)"""
+    if _tracer is None:
+        configure_tracing()
+    return _tracer
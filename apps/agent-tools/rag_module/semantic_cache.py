@@ -0,0 +1,220 @@
+"""
+语义答案缓存 (Semantic answer cache)
+
+用户经常用不同措辞问同一个问题。此缓存对问题做嵌入，在一个小型内存向量索引中
+查找相似度超过阈值的历史问题，命中时直接返回已保存的答案与来源，
+跳过检索和 LLM 调用。
+
+失效策略 (Invalidation):
+1. 索引版本 (index_version) 变化时，该命名空间下的旧条目全部失效。
+2. TTL 过期。
+3. 超过容量时按最近最少使用 (LRU) 淘汰。
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Any, Dict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("AgentTools")
+
+# 最近嵌入过的问题数；未命中时 store() 复用 lookup() 的嵌入
+# (Recently embedded questions; on a miss store() reuses the embedding from lookup())
+EMBED_MEMO_SIZE = 64
+
+
+def directory_fingerprint(directory_path: str) -> str:
+    """
+    根据目录中文件的路径、大小和修改时间计算索引版本
+    (Compute an index version from file paths, sizes and mtimes in a directory)
+
+    :param directory_path: 文档目录 (Document directory)
+    :return: 版本指纹 (Version fingerprint)
+    """
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(directory_path):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            digest.update(f"{os.path.relpath(path, directory_path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedAnswer:
+    """缓存条目 (Cache entry)"""
+    question: str
+    answer: str
+    sources: List[Dict[str, Any]]
+    namespace: str
+    index_version: str
+    created_at: float = field(default_factory=time.time)
+    last_access: float = field(default_factory=time.time)
+    hits: int = 0
+    similarity: float = 1.0
+
+
+class SemanticAnswerCache:
+    """
+    基于问题嵌入相似度的答案缓存 (Answer cache keyed by question-embedding similarity)
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        similarity_threshold: float = 0.92,
+        ttl_seconds: Optional[float] = 3600,
+        max_entries: int = 1024
+    ):
+        """
+        :param embedding: 问题嵌入模型 (Embedding model for questions)
+        :param similarity_threshold: 命中所需的最小余弦相似度 (Minimum cosine similarity for a hit)
+        :param ttl_seconds: 条目存活时间，None 表示不过期 (Entry time-to-live, None = never expire)
+        :param max_entries: 最大条目数 (Maximum number of entries)
+        """
+        self.embedding = embedding
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._entries: List[CachedAnswer] = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._embed_memo: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _embed(self, question: str) -> np.ndarray:
+        with self._lock:
+            vector = self._embed_memo.get(question)
+            if vector is not None:
+                self._embed_memo.move_to_end(question)
+                return vector
+        vector = np.asarray(self.embedding.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        vector = vector / norm if norm else vector
+        with self._lock:
+            self._embed_memo[question] = vector
+            if len(self._embed_memo) > EMBED_MEMO_SIZE:
+                self._embed_memo.popitem(last=False)
+        return vector
+
+    def _remove(self, keep: np.ndarray) -> None:
+        """按布尔掩码保留条目 (Keep entries selected by a boolean mask)"""
+        self._entries = [entry for entry, kept in zip(self._entries, keep) if kept]
+        self._vectors = self._vectors[keep]
+
+    def _expire(self, namespace: Optional[str] = None, index_version: Optional[str] = None) -> None:
+        """移除过期条目和旧版本条目 (Drop expired entries and entries from stale index versions)"""
+        if not self._entries:
+            return
+        now = time.time()
+        keep = np.ones(len(self._entries), dtype=bool)
+        for i, entry in enumerate(self._entries):
+            if self.ttl_seconds is not None and now - entry.created_at > self.ttl_seconds:
+                keep[i] = False
+            elif namespace is not None and entry.namespace == namespace and entry.index_version != index_version:
+                keep[i] = False
+        if not keep.all():
+            self._remove(keep)
+
+    def lookup(self, question: str, namespace: str = "default", index_version: str = "") -> Optional[CachedAnswer]:
+        """
+        查找语义相似的历史问题 (Look up a semantically similar earlier question)
+
+        :param question: 用户问题 (User question)
+        :param namespace: 命名空间，例如文档目录 (Namespace, e.g. the document directory)
+        :param index_version: 当前索引版本 (Current index version)
+        :return: 命中的缓存条目或 None (Cached entry on hit, otherwise None)
+        """
+        query = self._embed(question)
+        with self._lock:
+            self._expire(namespace, index_version)
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            scores = self._vectors @ query
+            for i in np.argsort(-scores):
+                if scores[i] < self.similarity_threshold:
+                    break
+                entry = self._entries[i]
+                if entry.namespace == namespace:
+                    entry.hits += 1
+                    entry.last_access = time.time()
+                    entry.similarity = float(scores[i])
+                    self.hits += 1
+                    logger.info(f"语义缓存命中 (相似度 {scores[i]:.3f}): '{question}' ≈ '{entry.question}'")
+                    return entry
+
+            self.misses += 1
+            return None
+
+    def store(
+        self,
+        question: str,
+        answer: str,
+        sources: List[Dict[str, Any]],
+        namespace: str = "default",
+        index_version: str = ""
+    ) -> None:
+        """
+        保存问答结果 (Store an answer)
+        """
+        vector = self._embed(question)
+        with self._lock:
+            self._expire(namespace, index_version)
+            entry = CachedAnswer(
+                question=question,
+                answer=answer,
+                sources=sources,
+                namespace=namespace,
+                index_version=index_version
+            )
+            if len(self._entries) == 0:
+                self._vectors = vector[np.newaxis, :]
+            else:
+                self._vectors = np.vstack([self._vectors, vector])
+            self._entries.append(entry)
+
+            # LRU 淘汰 (LRU eviction)
+            if len(self._entries) > self.max_entries:
+                order = np.argsort([e.last_access for e in self._entries])
+                keep = np.ones(len(self._entries), dtype=bool)
+                keep[order[:len(self._entries) - self.max_entries]] = False
+                self._remove(keep)
+
+    def invalidate(self, namespace: Optional[str] = None) -> None:
+        """
+        清空缓存或指定命名空间 (Clear the cache or one namespace)
+        """
+        with self._lock:
+            if namespace is None:
+                self._entries = []
+                self._vectors = np.zeros((0, 0), dtype=np.float32)
+            elif self._entries:
+                self._remove(np.array([e.namespace != namespace for e in self._entries]))
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计 (Cache statistics)"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
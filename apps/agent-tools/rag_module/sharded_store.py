@@ -0,0 +1,344 @@
+"""
+分片向量集合 (Sharded vector collections)
+
+把知识库按目录、租户或哈希拆分为多个独立分片，每个分片是一个普通的
+VectorStore (LocalVectorStore 或 Chroma 集合)：
+1. 写入时按分片键分组，只影响对应分片。
+2. 查询时只嵌入一次，在线程池中并行检索所有分片 (scatter)，
+   再用堆合并各分片的 top-k (gather)；超时的分片被跳过并记录。
+3. 单个分片可以独立重建，无需重建整个知识库。新分片以新的存储名构建，
+   替换完成后才删除旧分片，重建期间的查询仍然落在旧分片上。
+"""
+
+import os
+import re
+import json
+import uuid
+import zlib
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Optional, Any, Dict, Iterable, Tuple, Callable
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger("AgentTools")
+
+MANIFEST_FILE = "shards.json"
+SHARD_STRATEGIES = ("directory", "tenant", "hash")
+
+_UNSAFE_NAME_RE = re.compile(r"[^\w.-]+")
+
+
+def _safe_name(value: str) -> str:
+    """
+    转换为可用作目录名和集合名的分片名 (Make a name usable as a directory and collection name)
+
+    替换字符会让不同的键重名 (如 "/a/b" 与 "/a_b")，因此附加原始键的哈希
+    (Sanitizing can merge distinct keys such as "/a/b" and "/a_b", so a hash of the raw key is appended)
+    """
+    readable = _UNSAFE_NAME_RE.sub("_", value).strip("._") or "root"
+    return f"{readable}-{zlib.crc32(value.encode('utf-8')):08x}"
+
+
+def make_shard_key(strategy: str, n_shards: int = 8, tenant_key: str = "tenant") -> Callable[[str, Dict[str, Any]], str]:
+    """
+    创建分片键函数 (Create a shard-key function)
+
+    :param strategy: 分片方式 (Sharding strategy)
+                     - "directory": 按 metadata["source"] 所在目录 (By the directory of the source file)
+                     - "tenant": 按 metadata[tenant_key] (By a tenant metadata field)
+                     - "hash": 按来源哈希均匀分布到 n_shards 个分片 (Hash sources evenly into n_shards)
+    :param n_shards: 哈希分片数量 (Number of hash shards)
+    :param tenant_key: 租户字段名 (Tenant metadata field)
+    :return: (文本, metadata) -> 分片名 ((text, metadata) -> shard name)
+    """
+    if strategy == "directory":
+        return lambda text, metadata: _safe_name(os.path.dirname(str(metadata.get("source", ""))))
+    if strategy == "tenant":
+        return lambda text, metadata: _safe_name(str(metadata.get(tenant_key, "default")))
+    if strategy == "hash":
+        # 同一来源的文本块落在同一分片，便于按文件重建 (Chunks of one source share a shard)
+        return lambda text, metadata: f"shard-{zlib.crc32(str(metadata.get('source', text)).encode('utf-8')) % n_shards:03d}"
+    raise ValueError(f"不支持的分片方式: {strategy} (Unsupported sharding strategy)")
+
+
+def _search_shard(store: VectorStore, embedding: List[float], k: int, **kwargs: Any) -> List[Tuple[Document, float]]:
+    """
+    用已算好的查询向量检索单个分片，返回 (文档, 距离)
+    (Search one shard with a precomputed query vector, returning (document, distance))
+    """
+    if hasattr(store, "similarity_search_by_vector_with_score"):
+        return store.similarity_search_by_vector_with_score(embedding, k=k, **kwargs)
+    if hasattr(store, "similarity_search_by_vector_with_relevance_scores"):
+        # Chroma: 返回的是距离 (Chroma returns distances here)
+        return store.similarity_search_by_vector_with_relevance_scores(embedding, k=k, **kwargs)
+    raise TypeError(f"{type(store).__name__} 不支持按向量带分数检索 (does not support scored vector search)")
+
+
+def _persist_shard(store: VectorStore) -> None:
+    """
+    批量写入后持久化本地分片；Chroma 会自行落盘
+    (Persist a local shard after a batch of writes; Chroma persists on its own)
+    """
+    if getattr(store, "persist_directory", None) and hasattr(store, "persist"):
+        store.persist()
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    分片向量存储 (Sharded vector store)
+
+    对外表现为一个 VectorStore，as_retriever() 等用法不变。
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        shard_factory: Callable[[str], VectorStore],
+        shard_key: Callable[[str, Dict[str, Any]], str],
+        shard_timeout: Optional[float] = 5.0,
+        max_workers: Optional[int] = None,
+        persist_directory: Optional[str] = None,
+        strategy: Optional[str] = None,
+        shard_options: Optional[Dict[str, Any]] = None
+    ):
+        """
+        :param embedding: 嵌入模型，所有分片共用 (Embedding model shared by all shards)
+        :param shard_factory: 存储名 -> 新的空 VectorStore (Storage name -> new empty VectorStore)
+        :param shard_key: (文本, metadata) -> 分片名 ((text, metadata) -> shard name)
+        :param shard_timeout: 单个分片的查询超时秒数，None 表示不限 (Per-shard query timeout, None = unbounded)
+        :param max_workers: 查询线程数，默认等于分片数 (Query threads, defaults to the shard count)
+        :param persist_directory: 分片清单的保存目录 (Directory for the shard manifest)
+        :param strategy: 分片方式名称，记录在清单中 (Strategy name, recorded in the manifest)
+        :param shard_options: make_shard_key 的参数，记录在清单中 (make_shard_key arguments, recorded in the manifest)
+        """
+        self._embedding = embedding
+        self.shard_factory = shard_factory
+        self.shard_key = shard_key
+        self.shard_timeout = shard_timeout
+        self.max_workers = max_workers
+        self.persist_directory = persist_directory
+        self.strategy = strategy
+        self.shard_options = shard_options or {}
+        self.shards: Dict[str, VectorStore] = {}
+        # 分片名 -> 存储名 (目录或集合后缀)；重建后两者不同 (Shard name -> storage name; they differ after a rebuild)
+        self.storage_names: Dict[str, str] = {}
+        self.last_query_stats: Dict[str, Any] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_workers = 0
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # numpy 矩阵运算和 Chroma 客户端都会释放 GIL，线程池即可并行 (numpy and Chroma release the GIL)
+        workers = self.max_workers or max(1, len(self.shards))
+        if self._executor is None or self._executor_workers < workers:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-shard")
+            self._executor_workers = workers
+        return self._executor
+
+    def _get_shard(self, name: str) -> VectorStore:
+        with self._lock:
+            if name not in self.shards:
+                self.storage_names.setdefault(name, name)
+                self.shards[name] = self.shard_factory(self.storage_names[name])
+            return self.shards[name]
+
+    # --- 写入 (Write path) ---
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        """
+        按分片键分组写入 (Group by shard key and add to each shard)
+        """
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        groups: Dict[str, List[int]] = {}
+        for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+            groups.setdefault(self.shard_key(text, metadata), []).append(i)
+
+        added: List[Optional[str]] = [None] * len(texts)
+        for name, rows in groups.items():
+            shard = self._get_shard(name)
+            shard_ids = shard.add_texts(
+                [texts[i] for i in rows],
+                [metadatas[i] for i in rows],
+                ids=[ids[i] for i in rows] if ids else None,
+                **kwargs
+            )
+            _persist_shard(shard)
+            for row, doc_id in zip(rows, shard_ids):
+                added[row] = doc_id
+        self._save_manifest()
+        return added
+
+    def rebuild_shard(self, name: str, documents: List[Document]) -> Optional[VectorStore]:
+        """
+        独立重建单个分片 (Rebuild one shard independently)
+
+        :param name: 分片名 (Shard name)
+        :param documents: 该分片的全部文档，为空时删除该分片 (All documents of the shard; empty drops it)
+        """
+        if not documents:
+            self.drop_shard(name)
+            logger.info(f"分片 {name} 已无文档，已删除。")
+            return None
+        # 先在新的存储名下构建，替换后再删除旧分片 (Build under a new storage name, swap, then delete the old shard)
+        storage_name = f"{name}.{uuid.uuid4().hex[:8]}"
+        shard = self.shard_factory(storage_name)
+        shard.add_documents(documents)
+        _persist_shard(shard)
+        with self._lock:
+            old = self.shards.get(name)
+            self.shards[name] = shard
+            self.storage_names[name] = storage_name
+        self._save_manifest()
+        if old is not None and hasattr(old, "delete_collection"):
+            old.delete_collection()
+        logger.info(f"分片 {name} 已重建 ({len(documents)} 个文本块)。")
+        return shard
+
+    def drop_shard(self, name: str) -> None:
+        """删除分片 (Drop a shard)"""
+        with self._lock:
+            shard = self.shards.pop(name, None)
+            self.storage_names.pop(name, None)
+        if shard is not None and hasattr(shard, "delete_collection"):
+            shard.delete_collection()
+        self._save_manifest()
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[Dict[str, Any]]] = None, **kwargs: Any) -> "ShardedVectorStore":
+        ids = kwargs.pop("ids", None)
+        store = cls(embedding=embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    # --- 检索 (Search path) ---
+
+    def similarity_search_by_vector_with_score(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        shards: Optional[Iterable[str]] = None,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """
+        并行检索各分片并合并 top-k (Scatter the query to shards in parallel and merge the top-k)
+
+        :param embedding: 查询向量 (Query vector)
+        :param k: 返回数量 (Number of results)
+        :param shards: 只查询这些分片，None 表示全部 (Restrict to these shards, None = all)
+        :param kwargs: 传给每个分片的检索参数，如 filter (Per-shard search arguments such as filter)
+        :return: [(文档, 距离)] 按距离升序 ([(document, distance)] ascending)
+        """
+        targets = {name: self.shards[name] for name in (shards or list(self.shards)) if name in self.shards}
+        if not targets:
+            return []
+
+        executor = self._get_executor()
+        futures = {executor.submit(_search_shard, store, embedding, k, **kwargs): name for name, store in targets.items()}
+        done, pending = wait(futures, timeout=self.shard_timeout)
+
+        results: List[Tuple[Document, float]] = []
+        failed: List[str] = []
+        for future in done:
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                failed.append(futures[future])
+                logger.warning(f"分片 {futures[future]} 查询失败: {e}")
+        timed_out = sorted(futures[f] for f in pending)
+        for future in pending:
+            future.cancel()
+        if timed_out:
+            logger.warning(f"{len(timed_out)} 个分片查询超时 (>{self.shard_timeout}s)，已跳过: {timed_out}")
+
+        self.last_query_stats = {"shards": len(targets), "timed_out": timed_out, "failed": sorted(failed)}
+        return heapq.nsmallest(k, results, key=lambda item: item[1])
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # 各分片使用同一后端，距离度量一致 (All shards share one backend and distance metric)
+        if not self.shards:
+            return self._cosine_relevance_score_fn
+        return next(iter(self.shards.values()))._select_relevance_score_fn()
+
+    # --- 持久化 (Persistence) ---
+
+    def _save_manifest(self) -> None:
+        if not self.persist_directory:
+            return
+        os.makedirs(self.persist_directory, exist_ok=True)
+        manifest = {"strategy": self.strategy, "shard_options": self.shard_options, "shards": {name: self.storage_names.get(name, name) for name in sorted(self.shards)}}
+        tmp_path = os.path.join(self.persist_directory, MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.persist_directory, MANIFEST_FILE))
+
+    @classmethod
+    def load(
+        cls,
+        persist_directory: str,
+        embedding: Embeddings,
+        shard_loader: Callable[[str], VectorStore],
+        shard_factory: Callable[[str], VectorStore],
+        shard_key: Optional[Callable[[str, Dict[str, Any]], str]] = None,
+        **kwargs: Any
+    ) -> "ShardedVectorStore":
+        """
+        按清单加载全部分片 (Load all shards listed in the manifest)
+
+        :param shard_loader: 存储名 -> 已持久化的 VectorStore (Storage name -> persisted VectorStore)
+        :param shard_factory: 新分片的构造函数 (Factory for new shards)
+        :param shard_key: 分片键函数，None 时按清单中的方式创建 (Shard-key function; rebuilt from the manifest if None)
+        """
+        with open(os.path.join(persist_directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        store = cls(
+            embedding=embedding,
+            shard_factory=shard_factory,
+            shard_key=shard_key or make_shard_key(manifest["strategy"], **manifest.get("shard_options", {})),
+            persist_directory=persist_directory,
+            strategy=manifest["strategy"],
+            shard_options=manifest.get("shard_options"),
+            **kwargs
+        )
+        store.storage_names = dict(manifest["shards"])
+        store.shards = {name: shard_loader(storage_name) for name, storage_name in store.storage_names.items()}
+        return store
+
+    @classmethod
+    def exists(cls, persist_directory: Optional[str]) -> bool:
+        """判断目录中是否已有分片清单 (Whether a shard manifest exists)"""
+        return bool(persist_directory) and os.path.exists(os.path.join(persist_directory, MANIFEST_FILE))
+
+    def close(self) -> None:
+        """关闭查询线程池 (Shut down the query thread pool)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self._executor_workers = 0
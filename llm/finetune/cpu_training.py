@@ -0,0 +1,99 @@
+"""
+CPU Training Helpers
+
+Settings for LoRA fine-tuning on CPU-only machines:
+1. bf16 detection: CPUs with AVX512-BF16 or AMX run bf16 matmuls natively, so the base
+   weights are stored in bf16 and the Trainer uses bf16 autocast. Other CPUs use float32,
+   because float16 is slow or unsupported there.
+2. Thread tuning: each process is pinned to its own slice of physical cores (one thread
+   per core, hyperthread siblings skipped), so processes launched with torchrun split
+   the sockets instead of oversubscribing them.
+3. Multi-process data parallelism over the gloo backend (set in setup_training_args).
+
+Launch several processes per machine with, e.g.:
+    torchrun --nproc_per_node 2 examples/simple_finetune.py --data_path data.jsonl
+"""
+
+from __future__ import annotations
+
+import os
+from typing import List, Optional, Set
+
+
+def cpu_flags() -> Set[str]:
+    """CPU feature flags from /proc/cpuinfo (empty where it is unavailable)."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            return set(next((line for line in f if line.startswith("flags")), "").split())
+    except OSError:
+        return set()
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether the CPU has native bf16 matmul support (AVX512-BF16 or AMX)."""
+    try:
+        import torch
+        if torch.ops.mkldnn._is_mkldnn_bf16_supported():
+            return True
+    except (ImportError, AttributeError, RuntimeError):
+        pass
+    flags = cpu_flags()
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def physical_cores(cpus: List[int]) -> List[int]:
+    """Keep one logical CPU per physical core (Linux sysfs topology; unchanged elsewhere)."""
+    cores = []
+    for cpu in cpus:
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list") as f:
+                siblings = f.read().strip()
+        except OSError:
+            return cpus
+        # Formats: "0,64" or "0-1"
+        first = int(siblings.replace("-", ",").split(",")[0])
+        if first == cpu:
+            cores.append(cpu)
+    return cores or cpus
+
+
+def configure_cpu_threads(num_threads: Optional[int] = None, pin: bool = True) -> int:
+    """
+    Set the torch thread count for this process and optionally pin it to its cores.
+
+    Under torchrun, the available physical cores are split into LOCAL_WORLD_SIZE contiguous
+    slices and this process takes slice LOCAL_RANK. Contiguous CPU ids usually share a
+    socket, so with one process per socket each process keeps its memory traffic local.
+
+    Args:
+        num_threads: Threads per process (None = one per physical core in the slice)
+        pin: Whether to restrict the process to its slice of cores
+
+    Returns:
+        Number of threads set
+    """
+    import torch
+
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+
+    if hasattr(os, "sched_getaffinity"):
+        cpus = physical_cores(sorted(os.sched_getaffinity(0)))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    per_process = max(1, len(cpus) // local_world_size)
+    own_cpus = cpus[local_rank * per_process:(local_rank + 1) * per_process] or cpus
+
+    if pin and hasattr(os, "sched_setaffinity") and local_world_size > 1:
+        os.sched_setaffinity(0, own_cpus)
+
+    threads = num_threads or len(own_cpus)
+    torch.set_num_threads(threads)
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        # Inter-op parallelism only competes with the intra-op GEMM threads here
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Can only be set before any inter-op work has started
+        pass
+    return threads
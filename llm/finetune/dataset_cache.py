@@ -0,0 +1,139 @@
+"""
+Tokenized Dataset Cache
+
+Formatting and tokenizing a large instruction dataset can take longer than a short
+LoRA run. The tokenized dataset is saved as Arrow files under a key derived from
+everything that changes the result:
+1. The data file contents (or the dataset fingerprint for Hugging Face Hub datasets)
+2. The tokenizer (class, vocabulary, normalization and special tokens)
+3. The prompt template and max_seq_length
+
+Repeat runs and hyperparameter sweeps with the same inputs memory-map the cached
+Arrow files instead of tokenizing again.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import shutil
+import hashlib
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from datasets import Dataset
+
+# Bump when the formatting or tokenization code changes the cached output
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "finetune-datasets")
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_fingerprint(data_path: str) -> Optional[str]:
+    """
+    Fingerprint a local data file or directory by content.
+
+    Returns None for anything else (e.g. a Hugging Face Hub dataset name), in which
+    case the caller falls back to the loaded dataset's own fingerprint.
+    """
+    if os.path.isfile(data_path):
+        return f"file:{file_digest(data_path)}"
+    if os.path.isdir(data_path):
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(data_path):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, data_path).encode('utf-8'))
+                digest.update(file_digest(path).encode('ascii'))
+        return f"dir:{digest.hexdigest()}"
+    return None
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """
+    Fingerprint a tokenizer by everything that affects its output.
+
+    Fast tokenizers serialize their full pipeline (vocabulary, merges, normalizer and
+    post-processor); slow tokenizers fall back to the vocabulary.
+    """
+    digest = hashlib.sha256()
+    digest.update(type(tokenizer).__name__.encode('utf-8'))
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        digest.update(backend.to_str().encode('utf-8'))
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode('utf-8'))
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode('utf-8'))
+    digest.update(str(getattr(tokenizer, "truncation_side", "right")).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def tokenization_cache_key(
+    data_fingerprint: str,
+    tokenizer,
+    prompt_template: str,
+    max_seq_length: int,
+) -> str:
+    """Cache key for a tokenized dataset."""
+    payload = json.dumps({
+        "version": CACHE_VERSION,
+        "data": data_fingerprint,
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "prompt_template": prompt_template,
+        "max_seq_length": max_seq_length,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+class TokenizedDatasetCache:
+    """On-disk cache of tokenized datasets in Arrow format, one directory per key."""
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        """
+        Args:
+            cache_dir: Cache directory (default ~/.cache/finetune-datasets)
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key: str) -> Optional[Dataset]:
+        """Load a cached dataset, or return None if the key is not cached."""
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        from datasets import load_from_disk
+
+        return load_from_disk(path)
+
+    def save(self, key: str, dataset: Dataset) -> Dataset:
+        """
+        Save a dataset under a key and return the memory-mapped copy.
+
+        The dataset is written to a temporary directory and renamed into place, so an
+        interrupted run never leaves a partial entry behind.
+        """
+        from datasets import load_from_disk
+
+        path = self.path(key)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(self.cache_dir, exist_ok=True)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        dataset.save_to_disk(tmp_path)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process saved the same key first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return load_from_disk(path)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+CPU LoRA fine-tuning throughput benchmark.
+
+Trains for a fixed number of steps on synthetic full-length sequences (no padding) and
+reports tokens/sec, the step-time breakdown and peak memory from ThroughputCallback.
+The first logging interval is treated as warm-up and left out of the steady-state numbers.
+
+Single process:
+    python examples/benchmark_cpu_finetune.py --model_name Qwen/Qwen2.5-0.5B --steps 30
+Data parallel over gloo, one process per socket:
+    torchrun --nproc_per_node 2 examples/benchmark_cpu_finetune.py --model_name Qwen/Qwen2.5-0.5B
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+# Add parent directory to path to import utils
+sys.path.append(str(Path(__file__).parent.parent))
+from utils import FineTuningConfig, load_model_and_tokenizer, setup_training_args, use_bf16
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark CPU LoRA fine-tuning throughput")
+    parser.add_argument(
+        "--model_name",
+        type=str,
+        default="Qwen/Qwen2.5-0.5B",
+        help="Base model to fine-tune"
+    )
+    parser.add_argument(
+        "--steps",
+        type=int,
+        default=30,
+        help="Number of optimizer steps"
+    )
+    parser.add_argument(
+        "--log_every",
+        type=int,
+        default=5,
+        help="Steps per measurement interval (the first interval is warm-up)"
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=4,
+        help="Batch size per process"
+    )
+    parser.add_argument(
+        "--gradient_accumulation_steps",
+        type=int,
+        default=1,
+        help="Number of steps to accumulate gradients"
+    )
+    parser.add_argument(
+        "--max_seq_length",
+        type=int,
+        default=512,
+        help="Length of every synthetic sequence"
+    )
+    parser.add_argument(
+        "--lora_r",
+        type=int,
+        default=8,
+        help="LoRA rank"
+    )
+    parser.add_argument(
+        "--cpu_threads",
+        type=int,
+        default=None,
+        help="Threads per process (default: one per physical core)"
+    )
+    parser.add_argument(
+        "--no_bf16",
+        action="store_true",
+        help="Train in float32 even if the CPU supports bf16"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Write JSON results to this file"
+    )
+
+    args = parser.parse_args()
+    # The first interval is warm-up, so at least one more is needed for steady-state numbers
+    if args.log_every < 1 or args.steps < 2 * args.log_every:
+        parser.error("--steps must be at least 2 * --log_every (the first interval is warm-up)")
+    return args
+
+def main():
+    args = parse_args()
+    from datasets import Dataset
+    from transformers import Trainer, default_data_collator
+    from throughput import ThroughputCallback
+
+    output_dir = tempfile.mkdtemp(prefix="cpu-finetune-bench-")
+    config = FineTuningConfig(
+        model_name=args.model_name,
+        output_dir=output_dir,
+        lora_r=args.lora_r,
+        lora_alpha=args.lora_r * 2,
+        batch_size=args.batch_size,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        max_seq_length=args.max_seq_length,
+        max_steps=args.steps,
+        logging_steps=args.log_every,
+        save_steps=args.steps + 1,
+        eval_steps=0,
+        fp16=False,
+        cpu_only=True,
+        cpu_threads=args.cpu_threads,
+        cpu_bf16=False if args.no_bf16 else None,
+    )
+
+    model, tokenizer = load_model_and_tokenizer(config)
+
+    # Synthetic full-length sequences, enough for every process and step
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    rows = args.batch_size * args.gradient_accumulation_steps * args.steps * world_size
+    rng = random.Random(0)
+    vocab_size = len(tokenizer)
+    input_ids = [[rng.randrange(vocab_size) for _ in range(args.max_seq_length)] for _ in range(rows)]
+    dataset = Dataset.from_dict({
+        "input_ids": input_ids,
+        "attention_mask": [[1] * args.max_seq_length for _ in range(rows)],
+        "labels": input_ids,
+    })
+
+    callback = ThroughputCallback(output_dir=output_dir)
+    trainer = Trainer(
+        model=model,
+        args=setup_training_args(config),
+        train_dataset=dataset,
+        data_collator=default_data_collator,
+        callbacks=[callback],
+    )
+    trainer.train()
+
+    if not trainer.is_world_process_zero():
+        return
+
+    # Drop the warm-up interval
+    steady = callback.records[1:]
+    steps = sum(record["steps"] for record in steady)
+    seconds = sum(record["step_time_s"] * record["steps"] for record in steady)
+    tokens = sum(record["tokens"] for record in steady)
+    results = {
+        "model": args.model_name,
+        "world_size": world_size,
+        "threads_per_process": int(os.environ.get("OMP_NUM_THREADS", 0)) or None,
+        "bf16": use_bf16(config),
+        "batch_size": args.batch_size,
+        "gradient_accumulation_steps": args.gradient_accumulation_steps,
+        "max_seq_length": args.max_seq_length,
+        "trainable_params": callback.trainable_params,
+        "total_params": callback.total_params,
+        "steps": steps,
+        "tokens_per_sec": tokens * world_size / seconds if seconds else 0.0,
+        "step_time_s": seconds / steps if steps else 0.0,
+    }
+    for key in ("data_wait_s", "forward_backward_s", "optimizer_s", "other_s"):
+        results[key] = sum(record[key] * record["steps"] for record in steady) / steps if steps else 0.0
+    results["rss_peak_mb"] = max((record["rss_peak_mb"] for record in steady), default=0.0)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -92,6 +92,33 @@ def parse_args():
         action="store_true",
         help="Whether to use bfloat16 precision"
     )
+    parser.add_argument(
+        "--packing", 
+        action="store_true",
+        help="Pack several examples into each max_seq_length sequence"
+    )
+    parser.add_argument(
+        "--group_by_length", 
+        action="store_true",
+        help="Batch examples of similar length together (ignored with --packing)"
+    )
+    parser.add_argument(
+        "--streaming", 
+        action="store_true",
+        help="Stream a JSONL/CSV file instead of loading it into memory (requires --max_steps)"
+    )
+    parser.add_argument(
+        "--max_steps", 
+        type=int, 
+        default=-1,
+        help="Total training steps (-1 = use num_train_epochs)"
+    )
+    parser.add_argument(
+        "--dataloader_num_workers", 
+        type=int, 
+        default=0,
+        help="DataLoader worker processes"
+    )
     parser.add_argument(
         "--test_prompt", 
         type=str, 
@@ -122,6 +149,11 @@ def main():
         fp16=args.fp16,
         bf16=args.bf16,
         use_wandb=args.use_wandb,
+        packing=args.packing,
+        group_by_length=args.group_by_length,
+        streaming=args.streaming,
+        max_steps=args.max_steps,
+        dataloader_num_workers=args.dataloader_num_workers,
     )
     
     # Run fine-tuning
@@ -0,0 +1,289 @@
+"""
+Sequence Packing and Length-Grouped Batching
+
+Short instruction examples padded to the longest example in each batch spend
+most of the compute on padding tokens. This module provides:
+1. Best-fit-decreasing packing of tokenized examples into rows of at most
+   max_seq_length tokens, keeping every example whole.
+2. A collator for packed rows that stops examples from attending to each other
+   and masks the loss at example boundaries.
+3. A padding report comparing random batching with packed or length-grouped batching.
+
+torch is only imported by the collator, so this module stays cheap to import.
+"""
+
+from __future__ import annotations
+
+import random
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Sequence, Tuple, Any
+
+# Label value ignored by the cross-entropy loss in transformers models
+IGNORE_INDEX = -100
+
+
+def pack_lengths(lengths: Sequence[int], max_seq_length: int) -> List[List[int]]:
+    """
+    Group example indices into bins whose total length fits max_seq_length.
+
+    Uses best-fit decreasing: the longest examples are placed first, each into the
+    bin with the least remaining room that still fits it.
+
+    Args:
+        lengths: Token count of each example
+        max_seq_length: Capacity of each bin
+
+    Returns:
+        List of bins, each a list of example indices
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    bins: List[List[int]] = []
+    # (remaining capacity, bin index), kept sorted for the best-fit lookup
+    free: List[Tuple[int, int]] = []
+    for index in order:
+        length = lengths[index]
+        if length <= 0:
+            continue
+        if length > max_seq_length:
+            raise ValueError(f"Example {index} has {length} tokens, more than max_seq_length={max_seq_length}")
+        position = bisect_left(free, (length, -1))
+        if position < len(free):
+            remaining, bin_index = free.pop(position)
+            bins[bin_index].append(index)
+        else:
+            remaining, bin_index = max_seq_length, len(bins)
+            bins.append([index])
+        remaining -= length
+        if remaining > 0:
+            insort(free, (remaining, bin_index))
+    return bins
+
+
+def pack_examples(
+    examples: Dict[str, List[Any]],
+    max_seq_length: int,
+    eos_token_id: Optional[int] = None,
+) -> Dict[str, List[List[int]]]:
+    """
+    Pack a batch of tokenized examples into rows of at most max_seq_length tokens.
+
+    Meant for ``Dataset.map(batched=True)``. Each example gets an EOS token if it does not
+    already end with one. position_ids restart at 0 for every example, which is how the
+    collator finds example boundaries. The first label of every example is ignored so the
+    model is never trained to predict one example from the end of another.
+
+    Args:
+        examples: Batched columns with ``input_ids`` and optionally ``labels``
+        max_seq_length: Maximum length of a packed row
+        eos_token_id: Token appended to each example (None to append nothing)
+
+    Returns:
+        Columns ``input_ids``, ``labels``, ``position_ids`` and ``length`` of the packed rows
+    """
+    sequences, targets = [], []
+    for row, ids in enumerate(examples["input_ids"]):
+        labels = examples["labels"][row] if "labels" in examples else ids
+        if eos_token_id is not None and (not ids or ids[-1] != eos_token_id):
+            ids = list(ids) + [eos_token_id]
+            labels = list(labels) + [eos_token_id]
+        sequences.append(ids[:max_seq_length])
+        targets.append(labels[:max_seq_length])
+
+    packed: Dict[str, List[List[int]]] = {"input_ids": [], "labels": [], "position_ids": [], "length": []}
+    for bin_indices in pack_lengths([len(ids) for ids in sequences], max_seq_length):
+        input_ids, labels, position_ids = [], [], []
+        for index in bin_indices:
+            ids = sequences[index]
+            input_ids.extend(ids)
+            labels.append(IGNORE_INDEX)
+            labels.extend(targets[index][1:])
+            position_ids.extend(range(len(ids)))
+        packed["input_ids"].append(input_ids)
+        packed["labels"].append(labels)
+        packed["position_ids"].append(position_ids)
+        packed["length"].append(len(input_ids))
+    return packed
+
+
+def pack_dataset(
+    dataset,
+    max_seq_length: int,
+    eos_token_id: Optional[int] = None,
+    pack_batch_size: int = 10_000,
+    num_proc: Optional[int] = None,
+):
+    """
+    Pack a tokenized dataset. Examples are packed within groups of pack_batch_size,
+    which keeps bin packing fast while staying close to the optimum.
+
+    Args:
+        dataset: Tokenized dataset with an ``input_ids`` column
+        max_seq_length: Maximum length of a packed row
+        eos_token_id: Token appended to each example
+        pack_batch_size: Number of examples packed together
+        num_proc: Number of processes (None for a single process)
+
+    Returns:
+        Packed dataset
+    """
+    return dataset.map(
+        pack_examples,
+        batched=True,
+        batch_size=pack_batch_size,
+        num_proc=num_proc,
+        remove_columns=dataset.column_names,
+        fn_kwargs={"max_seq_length": max_seq_length, "eos_token_id": eos_token_id},
+    )
+
+
+class PackedDataCollator:
+    """
+    Collator for packed rows produced by ``pack_examples``.
+
+    With flash attention the batch is flattened into a single row and the per-example
+    position_ids tell the varlen kernel where each example starts, so no padding is needed.
+    Other attention implementations get padded rows and a block-diagonal causal
+    attention mask in additive form (0 = attend, dtype minimum = masked).
+    """
+
+    def __init__(self, pad_token_id: int, flatten: bool = False, dtype=None):
+        """
+        Args:
+            pad_token_id: Token used to pad rows
+            flatten: Flatten the batch into one row (for flash_attention_2)
+            dtype: Dtype of the attention mask, should match the model (default float32)
+        """
+        self.pad_token_id = pad_token_id
+        self.flatten = flatten
+        self.dtype = dtype
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, Any]:
+        import torch
+
+        if self.flatten:
+            return {
+                key: torch.tensor([[value for feature in features for value in feature[key]]], dtype=torch.long)
+                for key in ("input_ids", "labels", "position_ids")
+            }
+
+        batch_size = len(features)
+        length = max(len(feature["input_ids"]) for feature in features)
+        input_ids = torch.full((batch_size, length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch_size, length), IGNORE_INDEX, dtype=torch.long)
+        # Padding positions get position 0, so each one is its own single-token segment
+        position_ids = torch.zeros((batch_size, length), dtype=torch.long)
+        for row, feature in enumerate(features):
+            count = len(feature["input_ids"])
+            input_ids[row, :count] = torch.tensor(feature["input_ids"], dtype=torch.long)
+            labels[row, :count] = torch.tensor(feature["labels"], dtype=torch.long)
+            position_ids[row, :count] = torch.tensor(feature["position_ids"], dtype=torch.long)
+
+        return {
+            "input_ids": input_ids,
+            "labels": labels,
+            "position_ids": position_ids,
+            "attention_mask": self.block_causal_mask(position_ids),
+        }
+
+    def block_causal_mask(self, position_ids):
+        """
+        Build a (batch, 1, length, length) additive mask where each token attends only
+        to earlier tokens of the same example.
+        """
+        import torch
+
+        dtype = self.dtype or torch.float32
+        segments = torch.cumsum(position_ids == 0, dim=-1)
+        same_segment = segments[:, :, None] == segments[:, None, :]
+        length = position_ids.shape[-1]
+        causal = torch.ones((length, length), dtype=torch.bool, device=position_ids.device).tril()
+        allowed = same_segment & causal
+        mask = torch.zeros(allowed.shape, dtype=dtype)
+        mask.masked_fill_(~allowed, torch.finfo(dtype).min)
+        return mask[:, None, :, :]
+
+
+def _padding_stats(lengths: Sequence[int], batch_size: int) -> Dict[str, Any]:
+    """Padding cost when consecutive lengths are batched and padded to the longest."""
+    tokens = padded = batches = 0
+    for start in range(0, len(lengths), batch_size):
+        batch = lengths[start:start + batch_size]
+        tokens += sum(batch)
+        padded += max(batch) * len(batch)
+        batches += 1
+    return {
+        "batches": batches,
+        "tokens": tokens,
+        "padded_tokens": padded,
+        "padding_ratio": 1 - tokens / padded if padded else 0.0,
+    }
+
+
+def length_grouped_order(lengths: Sequence[int], batch_size: int, seed: int = 42, mega_batch_mult: int = 50) -> List[int]:
+    """
+    Shuffle, then sort by length within mega-batches of batch_size * mega_batch_mult.
+
+    Mirrors the ordering of the transformers ``LengthGroupedSampler`` that ``Trainer`` uses
+    with ``group_by_length=True``, so the padding report matches training.
+    """
+    indices = list(range(len(lengths)))
+    random.Random(seed).shuffle(indices)
+    mega_batch_size = batch_size * mega_batch_mult
+    order: List[int] = []
+    for start in range(0, len(indices), mega_batch_size):
+        order.extend(sorted(indices[start:start + mega_batch_size], key=lambda i: lengths[i], reverse=True))
+    return order
+
+
+def padding_report(
+    lengths: Sequence[int],
+    batch_size: int,
+    packed_lengths: Optional[Sequence[int]] = None,
+    group_by_length: bool = False,
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """
+    Compare the padding ratio of random batching with packed or length-grouped batching.
+
+    Args:
+        lengths: Token count of each unpacked example
+        batch_size: Batch size per device
+        packed_lengths: Token count of each packed row (if packing is enabled)
+        group_by_length: Whether the unpacked path uses length-grouped batching
+        seed: Shuffle seed
+
+    Returns:
+        Dictionary with a ``before`` entry and, when packing or grouping is on, an ``after`` entry
+    """
+    rng = random.Random(seed)
+    shuffled = list(lengths)
+    rng.shuffle(shuffled)
+    report: Dict[str, Any] = {
+        "examples": len(lengths),
+        "batch_size": batch_size,
+        "before": {"strategy": "random", **_padding_stats(shuffled, batch_size)},
+    }
+    if packed_lengths is not None:
+        rows = list(packed_lengths)
+        rng.shuffle(rows)
+        report["after"] = {"strategy": "packed", "rows": len(rows), **_padding_stats(rows, batch_size)}
+    elif group_by_length:
+        order = length_grouped_order(lengths, batch_size, seed)
+        report["after"] = {
+            "strategy": "length_grouped",
+            **_padding_stats([lengths[i] for i in order], batch_size),
+        }
+    return report
+
+
+def format_padding_report(report: Dict[str, Any]) -> str:
+    """Format a padding report as a short human-readable summary."""
+    lines = [f"Padding report ({report['examples']} examples, batch size {report['batch_size']}):"]
+    for key in ("before", "after"):
+        if key in report:
+            stats = report[key]
+            lines.append(
+                f"  {key:<6} [{stats['strategy']}]: {stats['batches']} batches, "
+                f"{stats['padded_tokens']} token slots, padding ratio {stats['padding_ratio']:.1%}"
+            )
+    return "\n".join(lines)
@@ -0,0 +1,201 @@
+"""
+Streaming Datasets for Corpora Larger Than RAM
+
+Reads a JSONL or CSV file lazily as a ``datasets.IterableDataset``:
+1. The file is split into shards that are spread over DataLoader workers. JSONL shards
+   are byte ranges, so each worker reads only its part of the file. CSV rows can contain
+   newlines, so CSV shards take every n-th row and each worker parses the whole file.
+2. Train/eval membership comes from a hash of each example's content, so the split is
+   deterministic, needs no pass over the data and survives appends and reordering.
+3. Examples are shuffled in a bounded buffer, then tokenized and (optionally) packed
+   in batches as they stream, so memory stays bounded regardless of the corpus size.
+"""
+
+from __future__ import annotations
+
+import os
+import csv
+import json
+import hashlib
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple, Any
+
+from packing import pack_examples
+
+if TYPE_CHECKING:
+    from datasets import IterableDataset
+
+STREAMING_FORMATS = {".jsonl": "jsonl", ".json": "jsonl", ".csv": "csv"}
+
+
+def detect_format(data_path: str) -> str:
+    """Return "jsonl" or "csv" for a streamable file, or raise ValueError."""
+    file_format = STREAMING_FORMATS.get(os.path.splitext(data_path)[1].lower())
+    if file_format is None or not os.path.isfile(data_path):
+        raise ValueError(f"Streaming mode needs a local JSONL or CSV file, got: {data_path}")
+    return file_format
+
+
+def jsonl_shards(data_path: str, num_shards: int) -> List[Tuple[int, int]]:
+    """Split a JSONL file into num_shards byte ranges of roughly equal size."""
+    size = os.path.getsize(data_path)
+    num_shards = max(1, min(num_shards, size))
+    bounds = [size * i // num_shards for i in range(num_shards + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(num_shards)]
+
+
+def iter_jsonl(data_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the records of a JSONL file whose lines start within [start, end).
+
+    Every line belongs to exactly one byte range, so disjoint ranges read disjoint records.
+    """
+    with open(data_path, 'rb') as f:
+        if start > 0:
+            # Skip the line that straddles the start; it belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_csv(data_path: str, shard: int = 0, num_shards: int = 1) -> Iterator[Dict[str, Any]]:
+    """Yield every num_shards-th row of a CSV file, starting at row ``shard``."""
+    with open(data_path, 'r', newline='', encoding='utf-8') as f:
+        for row_index, row in enumerate(csv.DictReader(f)):
+            if row_index % num_shards == shard:
+                yield row
+
+
+def detect_prompt_columns(data_path: str, file_format: str) -> Tuple[str, str]:
+    """Find the (instruction, response) column pair from the first record."""
+    from utils import PROMPT_COLUMNS
+
+    records = iter_jsonl(data_path) if file_format == "jsonl" else iter_csv(data_path)
+    first = next(records, None)
+    if first is not None:
+        for instruction_key, response_key in PROMPT_COLUMNS:
+            if instruction_key in first and response_key in first:
+                return instruction_key, response_key
+    raise ValueError(
+        "Dataset format not recognized. Expected columns: "
+        "(instruction, response) or (prompt, completion) or (input, output)"
+    )
+
+
+def is_eval_example(instruction: str, response: str, eval_fraction: float, seed: int) -> bool:
+    """Deterministically assign an example to the eval split by hashing its content."""
+    digest = hashlib.blake2b(f"{seed}\x1f{instruction}\x1f{response}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2 ** 64 < eval_fraction
+
+
+def _generate_examples(
+    shards: List[Tuple[int, int]],
+    data_path: str,
+    file_format: str,
+    columns: Tuple[str, str],
+    split: Optional[str],
+    eval_fraction: float,
+    seed: int,
+) -> Iterator[Dict[str, str]]:
+    """
+    Generator for ``IterableDataset.from_generator``. ``shards`` is the only list argument,
+    so datasets spreads it over DataLoader workers.
+    """
+    instruction_key, response_key = columns
+    for shard in shards:
+        if file_format == "jsonl":
+            records = iter_jsonl(data_path, *shard)
+        else:
+            records = iter_csv(data_path, *shard)
+        for record in records:
+            instruction, response = record.get(instruction_key), record.get(response_key)
+            if instruction is None or response is None:
+                continue
+            instruction, response = str(instruction), str(response)
+            if split is not None and is_eval_example(instruction, response, eval_fraction, seed) != (split == "eval"):
+                continue
+            yield {"instruction": instruction, "response": response}
+
+
+def load_streaming_dataset(
+    data_path: str,
+    tokenizer,
+    config,
+    prompt_template: str,
+    eval_fraction: float = 0.1,
+    shuffle: bool = True,
+    seed: int = 42,
+) -> Tuple[IterableDataset, Optional[IterableDataset]]:
+    """
+    Build streaming train and eval datasets from a JSONL or CSV file.
+
+    Args:
+        data_path: Path to a JSONL or CSV file
+        tokenizer: Tokenizer for the model
+        config: Fine-tuning configuration
+        prompt_template: Template for formatting prompts
+        eval_fraction: Expected fraction of examples hashed into the eval split
+        shuffle: Whether to shuffle the training stream (shard order plus a bounded buffer)
+        seed: Seed for the split hash and the shuffle
+
+    Returns:
+        Tuple of (train_dataset, eval_dataset); the eval stream is capped at
+        config.stream_eval_examples examples
+    """
+    from datasets import Features, IterableDataset, Value
+    from utils import tokenize_examples
+
+    file_format = detect_format(data_path)
+    columns = detect_prompt_columns(data_path, file_format)
+    if file_format == "jsonl":
+        shards = jsonl_shards(data_path, config.stream_shards)
+    else:
+        shards = [(shard, config.stream_shards) for shard in range(config.stream_shards)]
+    features = Features({"instruction": Value("string"), "response": Value("string")})
+
+    def build(split: Optional[str], shuffled: bool) -> IterableDataset:
+        dataset = IterableDataset.from_generator(
+            _generate_examples,
+            features=features,
+            gen_kwargs={
+                "shards": shards,
+                "data_path": data_path,
+                "file_format": file_format,
+                "columns": columns,
+                "split": split,
+                "eval_fraction": eval_fraction,
+                "seed": seed,
+            },
+        )
+        if shuffled:
+            dataset = dataset.shuffle(seed=seed, buffer_size=config.stream_shuffle_buffer)
+        dataset = dataset.map(
+            tokenize_examples,
+            batched=True,
+            remove_columns=["instruction", "response"],
+            fn_kwargs={
+                "tokenizer": tokenizer,
+                "prompt_template": prompt_template,
+                "max_seq_length": config.max_seq_length,
+            },
+        )
+        if config.packing:
+            dataset = dataset.map(
+                pack_examples,
+                batched=True,
+                batch_size=config.stream_pack_buffer,
+                remove_columns=["input_ids", "attention_mask", "length"],
+                fn_kwargs={"max_seq_length": config.max_seq_length, "eos_token_id": tokenizer.eos_token_id},
+            )
+        return dataset
+
+    if eval_fraction <= 0:
+        return build(None, shuffle), None
+    train_dataset = build("train", shuffle)
+    eval_dataset = build("eval", False).take(config.stream_eval_examples)
+    return train_dataset, eval_dataset
@@ -0,0 +1,326 @@
+"""
+Training Throughput Instrumentation
+
+A Trainer callback that records, for every logging interval:
+1. Tokens/sec, counting only non-padding tokens seen by the model's forward pass
+2. Step time split into data-loading wait, forward/backward and optimizer time
+3. Peak memory (CUDA allocator peak, or process peak RSS on CPU)
+4. Estimated model FLOPs utilization (MFU), against the GPU_PEAK_TFLOPS table on CUDA and
+   against threads x clock x FLOPs/cycle for the detected ISA on CPU
+
+Step phases are timed between Trainer callback events:
+- data wait runs from the end of one optimizer step to the start of the next,
+- forward/backward runs from the step start to just before the optimizer step,
+- optimizer covers the optimizer step itself.
+Before transformers 4.46 the Trainer fetches each micro-batch inside the step, so with
+gradient accumulation part of the data wait shows up as forward/backward time.
+
+The report is written to ``throughput.json`` in the output directory, next to config.json.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+from typing import Dict, List, Optional, Any
+
+from transformers import TrainerCallback
+
+REPORT_FILENAME = "throughput.json"
+
+# Dense bf16/fp16 tensor-core peak TFLOPS, matched against the CUDA device name
+GPU_PEAK_TFLOPS = {
+    "H100": 989.0,
+    "H800": 989.0,
+    "A100": 312.0,
+    "A800": 312.0,
+    "L40S": 362.0,
+    "L4": 121.0,
+    "A10G": 70.0,
+    "A10": 125.0,
+    "V100": 125.0,
+    "T4": 65.0,
+    "RTX 4090": 165.0,
+    "RTX 3090": 71.0,
+}
+
+
+def count_tokens(input_ids, attention_mask=None, position_ids=None) -> int:
+    """
+    Count the non-padding tokens of a batch.
+
+    - 2D attention mask: its sum.
+    - Packed rows with a 4D block mask: each row ends after its last token with a
+      position above 0 (padding restarts positions at 0).
+    - Anything else (e.g. flattened packed batches) has no padding.
+    """
+    import torch
+
+    if attention_mask is not None and attention_mask.dim() == 2:
+        return int(attention_mask.sum())
+    if attention_mask is not None and position_ids is not None:
+        positions = torch.arange(1, position_ids.shape[-1] + 1, device=position_ids.device).expand_as(position_ids)
+        return int(torch.where(position_ids > 0, positions, torch.zeros_like(positions)).max(dim=-1).values.sum())
+    return int(input_ids.numel())
+
+
+def detect_peak_tflops() -> Optional[float]:
+    """Peak TFLOPS of the current CUDA device, if it is in GPU_PEAK_TFLOPS."""
+    import torch
+
+    if not torch.cuda.is_available():
+        return None
+    name = torch.cuda.get_device_name()
+    for key, tflops in GPU_PEAK_TFLOPS.items():
+        if key in name:
+            return tflops
+    return None
+
+
+def cpu_flops_per_cycle(bf16: bool) -> int:
+    """Peak FLOPs per cycle per core for the detected x86 ISA, assuming two FMA ports."""
+    from cpu_training import cpu_flags
+
+    flags = cpu_flags()
+    if bf16 and "amx_bf16" in flags:
+        return 1024
+    if bf16 and "avx512_bf16" in flags:
+        return 128
+    if "avx512f" in flags:
+        return 64
+    if "fma" in flags:
+        return 32
+    return 16
+
+
+def cpu_max_ghz() -> Optional[float]:
+    """Maximum CPU clock in GHz from sysfs, falling back to the current clock in /proc/cpuinfo."""
+    try:
+        with open("/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq") as f:
+            return int(f.read().strip()) / 1e6
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/proc/cpuinfo") as f:
+            line = next((line for line in f if line.startswith("cpu MHz")), None)
+        return float(line.split(":")[1]) / 1e3 if line else None
+    except (OSError, ValueError):
+        return None
+
+
+def detect_cpu_peak_tflops(bf16: bool) -> Optional[float]:
+    """Estimated peak TFLOPS of this process on CPU: threads x clock x FLOPs/cycle."""
+    import torch
+
+    ghz = cpu_max_ghz()
+    if not ghz:
+        return None
+    return torch.get_num_threads() * ghz * cpu_flops_per_cycle(bf16) / 1e3
+
+
+def peak_memory_mb() -> Dict[str, float]:
+    """Peak memory since the last reset: CUDA allocator peak, and process peak RSS."""
+    import resource
+    import torch
+
+    memory = {}
+    if torch.cuda.is_available():
+        memory["cuda_peak_mb"] = torch.cuda.max_memory_allocated() / 2 ** 20
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    memory["rss_peak_mb"] = rss / 2 ** 20 if sys.platform == "darwin" else rss / 2 ** 10
+    return memory
+
+
+class ThroughputCallback(TrainerCallback):
+    """Trainer callback recording throughput, step-time breakdown, memory and MFU."""
+
+    def __init__(self, output_dir: Optional[str] = None, peak_tflops: Optional[float] = None, synchronize: bool = True):
+        """
+        Args:
+            output_dir: Directory for throughput.json (default: the Trainer's output_dir)
+            peak_tflops: Peak hardware TFLOPS per device for MFU (default: detected for known GPUs,
+                estimated from the ISA and clock on CPU)
+            synchronize: Synchronize CUDA at phase boundaries so times reflect GPU work
+        """
+        self.output_dir = output_dir
+        self.peak_tflops = peak_tflops
+        self.synchronize = synchronize
+        self.records: List[Dict[str, Any]] = []
+        self._hook = None
+        self._cuda = False
+        self._world_size = 1
+        self.total_params = self.trainable_params = 0
+        self._num_layers = self._hidden_size = 0
+        self._reset_interval()
+        self._last_step_end: Optional[float] = None
+        self._step_start: Optional[float] = None
+        self._optimizer_start: Optional[float] = None
+
+    def _reset_interval(self) -> None:
+        self._tokens = 0
+        self._sequences = 0
+        self._steps = 0
+        self._data_wait = 0.0
+        self._forward_backward = 0.0
+        self._optimizer = 0.0
+        self._excluded = 0.0
+        self._interval_start = time.perf_counter()
+
+    def _now(self) -> float:
+        if self.synchronize and self._cuda:
+            import torch
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _count_batch(self, module, args, kwargs) -> None:
+        if not module.training:
+            return
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        if input_ids is None:
+            return
+        self._tokens += count_tokens(input_ids, kwargs.get("attention_mask"), kwargs.get("position_ids"))
+        self._sequences += input_ids.shape[0]
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        import torch
+
+        self._cuda = torch.cuda.is_available()
+        self._world_size = max(1, args.world_size)
+        self.output_dir = self.output_dir or args.output_dir
+        if self.peak_tflops is None:
+            self.peak_tflops = detect_peak_tflops() if self._cuda else detect_cpu_peak_tflops(args.bf16)
+            if self.peak_tflops is None:
+                print("Warning: peak TFLOPS unknown for this device, MFU is not reported. Pass peak_tflops to enable it.")
+
+        self.total_params = sum(p.numel() for p in model.parameters())
+        self.trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
+        model_config = getattr(model, "config", None)
+        self._num_layers = getattr(model_config, "num_hidden_layers", 0) or 0
+        self._hidden_size = getattr(model_config, "hidden_size", 0) or 0
+        self._hook = model.register_forward_pre_hook(self._count_batch, with_kwargs=True)
+
+        if self._cuda:
+            torch.cuda.reset_peak_memory_stats()
+        self._reset_interval()
+        self._last_step_end = self._now()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._step_start = self._now()
+        if self._last_step_end is not None:
+            self._data_wait += self._step_start - self._last_step_end
+
+    def on_pre_optimizer_step(self, args, state, control, **kwargs):
+        self._optimizer_start = self._now()
+        if self._step_start is not None:
+            self._forward_backward += self._optimizer_start - self._step_start
+
+    def on_optimizer_step(self, args, state, control, **kwargs):
+        if self._optimizer_start is not None:
+            self._optimizer += self._now() - self._optimizer_start
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self._steps += 1
+        self._last_step_end = self._now()
+
+    def _exclude_since_last_step(self) -> None:
+        # Evaluation and checkpointing run between steps; keep them out of the step times
+        now = self._now()
+        if self._last_step_end is not None:
+            self._excluded += now - max(self._last_step_end, self._interval_start)
+        self._last_step_end = now
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        self._exclude_since_last_step()
+
+    def on_save(self, args, state, control, **kwargs):
+        self._exclude_since_last_step()
+
+    def flops_per_token(self, tokens_per_sequence: float) -> float:
+        """
+        Training FLOPs per token: 2N forward and 2N backward through activations, plus 2N
+        weight gradients for the trainable share of N (so 6N for full fine-tuning and about
+        4N for LoRA), plus 12 * layers * hidden * context for attention.
+        """
+        params = self.total_params
+        trainable_share = self.trainable_params / params if params else 0.0
+        attention = 12 * self._num_layers * self._hidden_size * tokens_per_sequence
+        return (4 + 2 * trainable_share) * params + attention
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if self._steps == 0:
+            return
+        import torch
+
+        elapsed = max(0.0, self._now() - self._interval_start - self._excluded)
+        tokens_per_sec = self._tokens / elapsed if elapsed else 0.0
+        step_time = elapsed / self._steps
+        record: Dict[str, Any] = {
+            "step": state.global_step,
+            "steps": self._steps,
+            "tokens": self._tokens,
+            "tokens_per_sec_per_device": tokens_per_sec,
+            "tokens_per_sec": tokens_per_sec * self._world_size,
+            "step_time_s": step_time,
+            "data_wait_s": self._data_wait / self._steps,
+            "forward_backward_s": self._forward_backward / self._steps,
+            "optimizer_s": self._optimizer / self._steps,
+            **peak_memory_mb(),
+        }
+        record["other_s"] = max(0.0, step_time - record["data_wait_s"] - record["forward_backward_s"] - record["optimizer_s"])
+        if self.peak_tflops and self._sequences:
+            achieved = self.flops_per_token(self._tokens / self._sequences) * tokens_per_sec
+            record["mfu"] = achieved / (self.peak_tflops * 1e12)
+        self.records.append(record)
+
+        if self._cuda:
+            torch.cuda.reset_peak_memory_stats()
+        self._reset_interval()
+        if state.is_world_process_zero:
+            self.save()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self._hook is not None:
+            self._hook.remove()
+            self._hook = None
+        if state.is_world_process_zero:
+            self.save()
+
+    def summary(self) -> Dict[str, Any]:
+        """Token-weighted averages over all recorded intervals."""
+        tokens = sum(record["tokens"] for record in self.records)
+        steps = sum(record["steps"] for record in self.records)
+        if not steps:
+            return {}
+        seconds = sum(record["step_time_s"] * record["steps"] for record in self.records)
+        summary = {
+            "steps": steps,
+            "tokens": tokens,
+            "tokens_per_sec": tokens * self._world_size / seconds if seconds else 0.0,
+        }
+        for key in ("step_time_s", "data_wait_s", "forward_backward_s", "optimizer_s", "other_s"):
+            summary[key] = sum(record[key] * record["steps"] for record in self.records) / steps
+        for key in ("cuda_peak_mb", "rss_peak_mb"):
+            values = [record[key] for record in self.records if key in record]
+            if values:
+                summary[key] = max(values)
+        mfu = [(record["mfu"], record["tokens"]) for record in self.records if "mfu" in record]
+        if mfu and tokens:
+            summary["mfu"] = sum(value * weight for value, weight in mfu) / sum(weight for _, weight in mfu)
+        return summary
+
+    def save(self) -> None:
+        """Write the report to throughput.json in the output directory."""
+        report = {
+            "world_size": self._world_size,
+            "total_params": self.total_params,
+            "trainable_params": self.trainable_params,
+            "peak_tflops": self.peak_tflops,
+            "summary": self.summary(),
+            "intervals": self.records,
+        }
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, REPORT_FILENAME), 'w') as f:
+            json.dump(report, f, indent=2)
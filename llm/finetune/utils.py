@@ -8,49 +8,51 @@ This module provides utility functions for fine-tuning language models using:
 It includes functions for dataset preparation, model loading, training configuration, and evaluation.
 """
 
+from __future__ import annotations
+
 import os
 import json
 import platform
-import pandas as pd
-import numpy as np
-from typing import Dict, List, Optional, Union, Tuple, Any
-from datasets import Dataset, load_dataset
-from transformers import (
-    AutoTokenizer, 
-    TrainingArguments,
-    Trainer,
-    DataCollatorForLanguageModeling
-)
+import importlib.util
+from typing import TYPE_CHECKING, Dict, List, Optional, Union, Tuple, Any
+
+# Heavy dependencies (torch, transformers, datasets, peft, unsloth, mlx) are
+# imported inside the functions that use them, so importing this module for
+# FineTuningConfig or the platform flags stays cheap.
+if TYPE_CHECKING:
+    from datasets import Dataset
+
+from packing import PackedDataCollator, pack_dataset, padding_report, format_padding_report
+from dataset_cache import TokenizedDatasetCache, data_fingerprint, tokenization_cache_key
+from cpu_training import configure_cpu_threads, cpu_supports_bf16
 
 # Determine the platform
 IS_MACOS = platform.system() == "Darwin" and "arm" in platform.machine()
 IS_WINDOWS = platform.system() == "Windows"
 IS_LINUX = platform.system() == "Linux"
 
-# Import platform-specific modules
+
+def _module_available(name: str) -> bool:
+    """Check whether a module can be imported without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+# Detect platform-specific backends
 if not IS_MACOS:
     # For Linux/Windows
-    import torch
-    from peft import LoraConfig, get_peft_model
-    try:
-        from unsloth import FastLanguageModel
-        UNSLOTH_AVAILABLE = True
-    except ImportError:
-        UNSLOTH_AVAILABLE = False
+    UNSLOTH_AVAILABLE = _module_available("unsloth")
+    MLX_AVAILABLE = False
+    if not UNSLOTH_AVAILABLE:
         print("Warning: Unsloth not available. Using standard Hugging Face transformers instead.")
 else:
     # For macOS with Apple Silicon
     UNSLOTH_AVAILABLE = False
-    try:
-        import mlx
-        import mlx.core as mx
-        from mlx_lm import load, generate
-        MLX_AVAILABLE = True
-    except ImportError:
-        MLX_AVAILABLE = False
+    MLX_AVAILABLE = _module_available("mlx_lm")
+    if not MLX_AVAILABLE:
         print("Warning: MLX-LM not available on this macOS system. Please install with 'pip install mlx-lm'.")
-        # Fallback to torch for CPU-only operation
-        import torch
 
 class FineTuningConfig:
     """Configuration class for fine-tuning parameters."""
@@ -82,6 +84,21 @@ class FineTuningConfig:
         cpu_only: bool = True,
         load_in_4bit: bool = True,
         load_in_8bit: bool = False,
+        packing: bool = False,
+        group_by_length: bool = False,
+        dataset_num_proc: Optional[int] = None,
+        use_dataset_cache: bool = True,
+        dataset_cache_dir: Optional[str] = None,
+        streaming: bool = False,
+        stream_shards: int = 64,
+        stream_shuffle_buffer: int = 10_000,
+        stream_pack_buffer: int = 1_000,
+        stream_eval_examples: int = 1_000,
+        max_steps: int = -1,
+        dataloader_num_workers: int = 0,
+        peak_tflops: Optional[float] = None,
+        cpu_threads: Optional[int] = None,
+        cpu_bf16: Optional[bool] = None,
     ):
         """
         Initialize fine-tuning configuration.
@@ -108,6 +125,21 @@ class FineTuningConfig:
             use_wandb: Whether to use Weights & Biases for tracking
             wandb_project: W&B project name
             wandb_run_name: W&B run name
+            packing: Whether to pack several examples into each max_seq_length sequence
+            group_by_length: Whether to batch unpacked examples of similar length together
+            dataset_num_proc: Processes for tokenization and packing (None = all CPUs for large datasets)
+            use_dataset_cache: Whether to cache the tokenized dataset on disk
+            dataset_cache_dir: Tokenized dataset cache directory (None = ~/.cache/finetune-datasets)
+            streaming: Whether to stream a JSONL/CSV file instead of loading it into memory
+            stream_shards: Number of shards the streamed file is split into for loader workers
+            stream_shuffle_buffer: Examples held in the streaming shuffle buffer
+            stream_pack_buffer: Examples packed together in streaming mode
+            stream_eval_examples: Maximum number of streamed eval examples
+            max_steps: Total training steps; required in streaming mode (-1 = use epochs)
+            dataloader_num_workers: DataLoader worker processes
+            peak_tflops: Peak hardware TFLOPS per device for the MFU estimate (None = detect known GPUs or estimate the CPU peak)
+            cpu_threads: Threads per process when cpu_only (None = one per physical core)
+            cpu_bf16: Whether to use bf16 when cpu_only (None = if the CPU supports it natively)
         """
         self.model_name = model_name
         self.output_dir = output_dir
@@ -134,6 +166,21 @@ class FineTuningConfig:
         self.cpu_only = cpu_only
         self.load_in_4bit = load_in_4bit
         self.load_in_8bit = load_in_8bit
+        self.packing = packing
+        self.group_by_length = group_by_length
+        self.dataset_num_proc = dataset_num_proc
+        self.use_dataset_cache = use_dataset_cache
+        self.dataset_cache_dir = dataset_cache_dir
+        self.streaming = streaming
+        self.stream_shards = stream_shards
+        self.stream_shuffle_buffer = stream_shuffle_buffer
+        self.stream_pack_buffer = stream_pack_buffer
+        self.stream_eval_examples = stream_eval_examples
+        self.max_steps = max_steps
+        self.dataloader_num_workers = dataloader_num_workers
+        self.peak_tflops = peak_tflops
+        self.cpu_threads = cpu_threads
+        self.cpu_bf16 = cpu_bf16
         
     def to_dict(self) -> Dict[str, Any]:
         """Convert configuration to dictionary."""
@@ -157,6 +204,158 @@ class FineTuningConfig:
         return cls.from_dict(config_dict)
 
 
+DEFAULT_PROMPT_TEMPLATE = """<|im_start|>system
+You are a helpful AI assistant.<|im_end|>
+<|im_start|>user
+{instruction}<|im_end|>
+<|im_start|>assistant
+{response}<|im_end|>"""
+
+# Supported (instruction, response) column pairs, in order of preference
+PROMPT_COLUMNS = (
+    ("instruction", "response"),
+    ("prompt", "completion"),
+    ("input", "output"),
+)
+
+# Below this many rows, multiprocess tokenization costs more than it saves
+PARALLEL_TOKENIZE_MIN_ROWS = 10_000
+
+
+def format_examples(examples: Dict[str, List[Any]], prompt_template: str) -> List[str]:
+    """
+    Format a batch of examples (a dict of columns) with the prompt template.
+    
+    Args:
+        examples: Batched columns as passed by ``Dataset.map(batched=True)``
+        prompt_template: Template with {instruction} and {response} placeholders
+        
+    Returns:
+        List of formatted texts
+    """
+    for instruction_key, response_key in PROMPT_COLUMNS:
+        if instruction_key in examples and response_key in examples:
+            return [
+                prompt_template.format(instruction=instruction, response=response)
+                for instruction, response in zip(examples[instruction_key], examples[response_key])
+            ]
+    raise ValueError(
+        "Dataset format not recognized. Expected columns: "
+        "(instruction, response) or (prompt, completion) or (input, output)"
+    )
+
+
+def tokenize_examples(
+    examples: Dict[str, List[Any]],
+    tokenizer,
+    prompt_template: str,
+    max_seq_length: int,
+) -> Dict[str, List[Any]]:
+    """
+    Format and tokenize a batch of examples, adding a ``length`` column.
+    
+    Defined at module level so ``Dataset.map`` can pickle it for ``num_proc`` workers.
+    """
+    tokenized = tokenizer(
+        format_examples(examples, prompt_template),
+        padding=False,
+        truncation=True,
+        max_length=max_seq_length,
+        return_tensors=None,
+    )
+    tokenized["length"] = [len(ids) for ids in tokenized["input_ids"]]
+    return tokenized
+
+
+def load_raw_dataset(data_path: str) -> Dataset:
+    """
+    Load an untokenized dataset from a CSV/JSON/JSONL file, a directory or the Hub.
+    
+    Args:
+        data_path: Path to dataset file or directory, or a Hub dataset name
+        
+    Returns:
+        The ``train`` split of the dataset
+    """
+    from datasets import Dataset, load_dataset
+
+    # Load dataset based on file extension
+    if data_path.endswith('.csv'):
+        import pandas as pd
+        df = pd.read_csv(data_path)
+        return Dataset.from_pandas(df)
+    elif data_path.endswith('.json') or data_path.endswith('.jsonl'):
+        return load_dataset('json', data_files=data_path)['train']
+    else:
+        # Assume it's a dataset on Hugging Face Hub or a directory
+        return load_dataset(data_path)['train']
+
+
+def tokenize_dataset(
+    data_path: str,
+    tokenizer,
+    config: FineTuningConfig,
+    prompt_template: str,
+) -> Dataset:
+    """
+    Load, format and tokenize the full dataset, using the on-disk cache when enabled.
+    
+    Local files are fingerprinted by content before loading, so a cache hit skips
+    reading the raw data as well. Hub datasets are keyed by their datasets fingerprint.
+    
+    Args:
+        data_path: Path to dataset file or directory
+        tokenizer: Tokenizer for the model
+        config: Fine-tuning configuration
+        prompt_template: Template for formatting prompts
+        
+    Returns:
+        Tokenized dataset with ``input_ids``, ``attention_mask`` and ``length`` columns
+    """
+    cache = TokenizedDatasetCache(config.dataset_cache_dir) if config.use_dataset_cache else None
+    cache_key = None
+    dataset = None
+    raw_dataset = None
+    
+    if cache is not None:
+        fingerprint = data_fingerprint(data_path)
+        if fingerprint is None:
+            raw_dataset = load_raw_dataset(data_path)
+            fingerprint = f"datasets:{raw_dataset._fingerprint}"
+        cache_key = tokenization_cache_key(fingerprint, tokenizer, prompt_template, config.max_seq_length)
+        dataset = cache.load(cache_key)
+        if dataset is not None:
+            print(f"Loaded tokenized dataset from cache: {cache.path(cache_key)}")
+            return dataset
+    
+    if raw_dataset is None:
+        raw_dataset = load_raw_dataset(data_path)
+    
+    num_proc = config.dataset_num_proc
+    if num_proc is None and len(raw_dataset) >= PARALLEL_TOKENIZE_MIN_ROWS:
+        num_proc = os.cpu_count()
+    if num_proc is not None and num_proc <= 1:
+        num_proc = None
+    
+    dataset = raw_dataset.map(
+        tokenize_examples,
+        batched=True,
+        num_proc=num_proc,
+        remove_columns=raw_dataset.column_names,
+        fn_kwargs={
+            "tokenizer": tokenizer,
+            "prompt_template": prompt_template,
+            "max_seq_length": config.max_seq_length,
+        },
+        desc="Tokenizing",
+    )
+    
+    if cache is not None:
+        dataset = cache.save(cache_key, dataset)
+        print(f"Saved tokenized dataset to cache: {cache.path(cache_key)}")
+    return dataset
+
+
 def prepare_dataset(
     data_path: str,
     tokenizer,
@@ -179,17 +378,30 @@ def prepare_dataset(
         seed: Random seed for shuffling
         
     Returns:
-        Tuple of (train_dataset, eval_dataset)
+        Tuple of (train_dataset, eval_dataset); iterable datasets when config.streaming is set
     """
-    # Load dataset based on file extension
-    if data_path.endswith('.csv'):
-        df = pd.read_csv(data_path)
-        dataset = Dataset.from_pandas(df)
-    elif data_path.endswith('.json') or data_path.endswith('.jsonl'):
-        dataset = load_dataset('json', data_files=data_path)['train']
-    else:
-        # Assume it's a dataset on Hugging Face Hub or a directory
-        dataset = load_dataset(data_path)['train']
+    if prompt_template is None:
+        prompt_template = DEFAULT_PROMPT_TEMPLATE
+    
+    # Stream corpora that don't fit in memory; the split is hash-based
+    if config.streaming:
+        from streaming import load_streaming_dataset
+
+        if config.max_steps <= 0:
+            raise ValueError("Streaming datasets have no length; set config.max_steps")
+        return load_streaming_dataset(
+            data_path,
+            tokenizer,
+            config,
+            prompt_template,
+            eval_fraction=train_test_split,
+            shuffle=shuffle,
+            seed=seed or config.seed,
+        )
+    
+    # Tokenize the full dataset once (cached), then split, so the cache is
+    # shared across different split fractions and seeds
+    dataset = tokenize_dataset(data_path, tokenizer, config, prompt_template)
     
     # Split dataset if needed
     if train_test_split > 0:
@@ -204,63 +416,27 @@ def prepare_dataset(
         train_dataset = dataset
         eval_dataset = None
     
-    # Define default prompt template if none provided
-    if prompt_template is None:
-        prompt_template = """<|im_start|>system
-You are a helpful AI assistant.<|im_end|>
-<|im_start|>user
-{instruction}<|im_end|>
-<|im_start|>assistant
-{response}<|im_end|>"""
-    
-    # Function to format examples according to the prompt template
-    def format_example(example):
-        if 'instruction' in example and 'response' in example:
-            return prompt_template.format(
-                instruction=example['instruction'],
-                response=example['response']
-            )
-        elif 'prompt' in example and 'completion' in example:
-            return prompt_template.format(
-                instruction=example['prompt'],
-                response=example['completion']
-            )
-        elif 'input' in example and 'output' in example:
-            return prompt_template.format(
-                instruction=example['input'],
-                response=example['output']
-            )
-        else:
-            raise ValueError(
-                "Dataset format not recognized. Expected columns: "
-                "(instruction, response) or (prompt, completion) or (input, output)"
-            )
-    
-    # Function to tokenize examples
-    def tokenize_function(examples):
-        formatted_texts = [format_example(example) for example in examples]
-        tokenized = tokenizer(
-            formatted_texts,
-            padding=False,
-            truncation=True,
-            max_length=config.max_seq_length,
-            return_tensors=None,
-        )
-        return tokenized
-    
-    # Tokenize datasets
-    train_dataset = train_dataset.map(
-        tokenize_function,
-        batched=True,
-        remove_columns=train_dataset.column_names,
+    # Pack examples into full-length sequences, or report the grouping gain
+    lengths = train_dataset["length"]
+    packed_lengths = None
+    if config.packing:
+        eos_token_id = tokenizer.eos_token_id
+        train_dataset = pack_dataset(train_dataset, config.max_seq_length, eos_token_id, num_proc=config.dataset_num_proc)
+        if eval_dataset is not None:
+            eval_dataset = pack_dataset(eval_dataset, config.max_seq_length, eos_token_id, num_proc=config.dataset_num_proc)
+        packed_lengths = train_dataset["length"]
+    
+    report = padding_report(
+        lengths,
+        config.batch_size,
+        packed_lengths=packed_lengths,
+        group_by_length=config.group_by_length,
+        seed=seed or config.seed,
     )
-    
-    if eval_dataset is not None:
-        eval_dataset = eval_dataset.map(
-            tokenize_function,
-            batched=True,
-            remove_columns=eval_dataset.column_names,
-        )
+    print(format_padding_report(report))
+    os.makedirs(config.output_dir, exist_ok=True)
+    with open(os.path.join(config.output_dir, "padding_report.json"), 'w') as f:
+        json.dump(report, f, indent=2)
     
     return train_dataset, eval_dataset
 
@@ -282,6 +458,8 @@ def load_model_and_tokenizer(config: FineTuningConfig):
     """
     # For macOS with Apple Silicon and MLX-LM available
     if IS_MACOS and MLX_AVAILABLE:
+        from mlx_lm import load
+
         print(f"Loading model {config.model_name} with MLX-LM for macOS...")
         # MLX-LM has a different loading pattern
         model, tokenizer = load(
@@ -292,8 +470,14 @@ def load_model_and_tokenizer(config: FineTuningConfig):
         )
         return model, tokenizer
     
+    import torch
+
     # For Linux/Windows with Unsloth available
-    elif UNSLOTH_AVAILABLE and not config.cpu_only:
+    if UNSLOTH_AVAILABLE and not config.cpu_only:
+        # Unsloth must be imported before transformers/peft so its patches apply
+        from unsloth import FastLanguageModel
+        from peft import LoraConfig
+
         print(f"Loading model {config.model_name} with Unsloth optimizations...")
         # Load model and tokenizer with Unsloth optimizations
         model, tokenizer = FastLanguageModel.from_pretrained(
@@ -327,47 +511,61 @@ def load_model_and_tokenizer(config: FineTuningConfig):
     # Fallback to standard Hugging Face transformers (CPU or GPU)
     else:
         print(f"Loading model {config.model_name} with standard transformers...")
-        from transformers import AutoModelForCausalLM
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+        from peft import LoraConfig, get_peft_model
         
         # Load tokenizer
         tokenizer = AutoTokenizer.from_pretrained(config.model_name)
         
-        # Set device map to CPU if cpu_only is True
-        device_map = "cpu" if config.cpu_only else config.device_map
-        
-        # Load model with appropriate quantization
-        model = AutoModelForCausalLM.from_pretrained(
-            config.model_name,
-            device_map=device_map,
-            load_in_4bit=config.load_in_4bit and not config.cpu_only,
-            load_in_8bit=config.load_in_8bit and not config.cpu_only,
-            torch_dtype=torch.bfloat16 if config.bf16 else torch.float16,
-        )
-        
-        # Apply LoRA if not using CPU
-        if not config.cpu_only:
-            from peft import prepare_model_for_kbit_training
-            
-            # Configure LoRA
-            lora_config = LoraConfig(
-                r=config.lora_r,
-                lora_alpha=config.lora_alpha,
-                lora_dropout=config.lora_dropout,
-                bias="none",
-                task_type="CAUSAL_LM",
-                target_modules=["q_proj", "v_proj"],
+        if config.cpu_only:
+            # CPU: tune threads before any work starts; no quantization, and bf16
+            # weights only where the CPU runs bf16 natively (fp16 is slow on CPU)
+            threads = configure_cpu_threads(config.cpu_threads)
+            dtype = torch.bfloat16 if use_bf16(config) else torch.float32
+            print(f"CPU training: {threads} threads, {dtype}")
+            model = AutoModelForCausalLM.from_pretrained(
+                config.model_name,
+                device_map="cpu",
+                torch_dtype=dtype,
+            )
+        else:
+            # Load model with appropriate quantization
+            model = AutoModelForCausalLM.from_pretrained(
+                config.model_name,
+                device_map=config.device_map,
+                load_in_4bit=config.load_in_4bit,
+                load_in_8bit=config.load_in_8bit,
+                torch_dtype=torch.bfloat16 if config.bf16 else torch.float16,
             )
             
             # Prepare model for k-bit training if using quantization
             if config.load_in_4bit or config.load_in_8bit:
+                from peft import prepare_model_for_kbit_training
                 model = prepare_model_for_kbit_training(model)
-            
-            # Apply LoRA
-            model = get_peft_model(model, lora_config)
+        
+        # Configure LoRA
+        lora_config = LoraConfig(
+            r=config.lora_r,
+            lora_alpha=config.lora_alpha,
+            lora_dropout=config.lora_dropout,
+            bias="none",
+            task_type="CAUSAL_LM",
+            target_modules=["q_proj", "v_proj"],
+        )
+        
+        # Apply LoRA (adapters are kept in float32 even when the base weights are bf16)
+        model = get_peft_model(model, lora_config)
         
         return model, tokenizer
 
 
+def use_bf16(config: FineTuningConfig) -> bool:
+    """Whether to train in bf16: config.bf16 on GPU; on CPU, config.cpu_bf16 or native support."""
+    if config.cpu_only:
+        return config.cpu_bf16 if config.cpu_bf16 is not None else cpu_supports_bf16()
+    return config.bf16
+
+
 def setup_training_args(config: FineTuningConfig):
     """
     Set up training arguments for the Trainer.
@@ -378,6 +576,8 @@ def setup_training_args(config: FineTuningConfig):
     Returns:
         TrainingArguments object
     """
+    from transformers import TrainingArguments
+
     # Initialize W&B if requested
     if config.use_wandb:
         import wandb
@@ -395,6 +595,7 @@ def setup_training_args(config: FineTuningConfig):
         gradient_accumulation_steps=config.gradient_accumulation_steps,
         learning_rate=config.learning_rate,
         num_train_epochs=config.num_train_epochs,
+        max_steps=config.max_steps,
         weight_decay=0.01,
         adam_beta1=0.9,
         adam_beta2=0.95,
@@ -408,11 +609,17 @@ def setup_training_args(config: FineTuningConfig):
         evaluation_strategy="steps" if config.eval_steps > 0 else "no",
         eval_steps=config.eval_steps if config.eval_steps > 0 else None,
         load_best_model_at_end=config.eval_steps > 0,
-        fp16=config.fp16 and not config.bf16,
-        bf16=config.bf16,
+        # fp16 autocast needs CUDA; on CPU, bf16 autocast is used where supported
+        fp16=config.fp16 and not config.bf16 and not config.cpu_only,
+        bf16=use_bf16(config),
+        use_cpu=config.cpu_only,
+        # Multi-process CPU data parallelism (torchrun) goes over gloo
+        ddp_backend="gloo" if config.cpu_only else None,
         seed=config.seed,
         report_to="wandb" if config.use_wandb else "none",
         ddp_find_unused_parameters=False,
+        group_by_length=config.group_by_length and not config.packing and not config.streaming,
+        dataloader_num_workers=config.dataloader_num_workers,
     )
     
     return training_args
@@ -438,14 +645,28 @@ def train_model(
     Returns:
         Trained model
     """
+    from transformers import Trainer, DataCollatorForLanguageModeling
+    from throughput import ThroughputCallback
+
     # Set up training arguments
     training_args = setup_training_args(config)
     
     # Create data collator
-    data_collator = DataCollatorForLanguageModeling(
-        tokenizer=tokenizer,
-        mlm=False,
-    )
+    if config.packing:
+        # Flash attention separates packed examples by position_ids alone;
+        # other attention implementations need a block-diagonal mask
+        attn_implementation = getattr(model.config, "_attn_implementation", None)
+        pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        data_collator = PackedDataCollator(
+            pad_token_id=pad_token_id,
+            flatten=attn_implementation == "flash_attention_2",
+            dtype=getattr(model, "dtype", None),
+        )
+    else:
+        data_collator = DataCollatorForLanguageModeling(
+            tokenizer=tokenizer,
+            mlm=False,
+        )
     
     # Initialize trainer
     trainer = Trainer(
@@ -454,6 +675,8 @@ def train_model(
         train_dataset=train_dataset,
         eval_dataset=eval_dataset,
         data_collator=data_collator,
+        # Writes throughput.json (tokens/sec, step-time split, peak memory, MFU)
+        callbacks=[ThroughputCallback(output_dir=config.output_dir, peak_tflops=config.peak_tflops)],
     )
     
     # Train model
@@ -503,6 +726,8 @@ def generate_text(
     """
     # For macOS with Apple Silicon and MLX-LM available
     if IS_MACOS and MLX_AVAILABLE and hasattr(model, "generate") and hasattr(model.generate, "__module__") and "mlx_lm" in model.generate.__module__:
+        from mlx_lm import generate
+
         print("Generating text with MLX-LM for macOS...")
         # MLX-LM has a different generation pattern
         response = generate(
@@ -518,6 +743,8 @@ def generate_text(
     
     # For standard Hugging Face models
     else:
+        import torch
+
         print("Generating text with transformers...")
         # Check if we're using a torch model
         if hasattr(model, "device"):